@@ -0,0 +1,1351 @@
+from pymongo import AsyncMongoClient, ReturnDocument, CursorType
+from pymongo.errors import DuplicateKeyError
+from gridfs import AsyncGridFSBucket
+from dotenv import load_dotenv
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Tuple
+from bson import ObjectId
+from backend.database import _dm_job_doc, _digest_event_doc, _leads_ready_event_doc, _user_messages_query, DM_JOB_EVENTS_MAX_BYTES, PRIORITY_BULK, PRIORITY_NORMAL
+from backend.pagination import paginate_async, KEYSET_SORT
+import secrets
+
+load_dotenv()
+
+# Connection pool for the web process; every request borrows a socket instead of blocking the loop
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "200"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+# Parallel connection handshakes, so a burst of requests does not stampede the server
+MONGO_MAX_CONNECTING = int(os.getenv("MONGO_MAX_CONNECTING", "10"))
+# Fail a request instead of queueing forever when the pool is exhausted
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+
+
+client = AsyncMongoClient(
+    os.getenv("MONGO_URI"),
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    maxConnecting=MONGO_MAX_CONNECTING,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS
+)
+db = client.dmify
+
+
+users_collection = db.users
+projects_collection = db.projects
+messages_collection = db.messages
+verification_codes_collection = db.verification_codes
+user_credits_collection = db.user_credits
+payment_transactions_collection = db.payment_transactions
+dm_generation_jobs_collection = db.dm_generation_jobs
+instagram_profiles_collection = db.instagram_profiles
+dm_job_batches_collection = db.dm_job_batches
+dm_job_events_collection = db.dm_job_events
+export_jobs_collection = db.export_jobs
+refresh_tokens_collection = db.refresh_tokens
+email_outbox_collection = db.email_outbox
+email_digest_events_collection = db.email_digest_events
+stripe_events_collection = db.stripe_events
+export_files_bucket = AsyncGridFSBucket(db, bucket_name="export_files")
+export_cache_bucket = AsyncGridFSBucket(db, bucket_name="export_cache")
+
+_job_events_ready = False
+
+async def _ensure_dm_job_events_collection() -> None:
+    """Create the capped event collection on first use (tailable cursors need a capped collection)"""
+    global _job_events_ready
+    if _job_events_ready:
+        return
+
+    if "dm_job_events" not in await db.list_collection_names(filter={"name": "dm_job_events"}):
+        try:
+            await db.create_collection("dm_job_events", capped=True, size=DM_JOB_EVENTS_MAX_BYTES)
+        except Exception:
+            # Another process created it first
+            pass
+    _job_events_ready = True
+
+async def _publish_dm_job_event(job: Dict[str, Any], status: str, **extra) -> None:
+    """Append a job state transition to the event log, with batch progress when the job is part of one"""
+    try:
+        await _ensure_dm_job_events_collection()
+
+        event = {
+            "type": "job",
+            "job_id": job["_id"],
+            "user_id": job["user_id"],
+            "project_id": job["project_id"],
+            "batch_id": job.get("batch_id"),
+            "username": job.get("username"),
+            "status": status,
+            "created_at": datetime.utcnow()
+        }
+        event.update(extra)
+
+        # Completed/failed jobs move their batch counters
+        if job.get("batch_id") and status in ("completed", "failed", "cancelled"):
+            batch = await dm_job_batches_collection.find_one_and_update(
+                {"_id": job["batch_id"]},
+                {"$inc": {status: 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if batch:
+                event["batch"] = {
+                    "total": batch.get("total", 0),
+                    "completed": batch.get("completed", 0),
+                    "failed": batch.get("failed", 0),
+                    "cancelled": batch.get("cancelled", 0)
+                }
+                leads_ready = _leads_ready_event_doc(batch)
+                if leads_ready:
+                    await email_digest_events_collection.insert_one(leads_ready)
+
+        await dm_job_events_collection.insert_one(event)
+    except Exception as e:
+        print(f"Error publishing DM job event: {e}")
+
+class AsyncDatabase:
+    """Asyncio counterpart of Database for the web routes; method names, arguments and return shapes match"""
+
+    @staticmethod
+    async def create_user(email: str, password_hash: str, name: str) -> str:
+        """Create a new user with initial credits"""
+        user_doc = {
+            "email": email.lower(),
+            "password_hash": password_hash,
+            "name": name,
+            "email_verified": False,
+            "created_at": datetime.utcnow()
+        }
+        result = await users_collection.insert_one(user_doc)
+        user_id = str(result.inserted_id)
+
+        # Initialize user with 10 free credits
+        await AsyncDatabase.initialize_user_credits(user_id)
+
+        return user_id
+
+    @staticmethod
+    async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
+
+        user = await users_collection.find_one({"email": email.lower()})
+        if user:
+            user["_id"] = str(user["_id"])
+        return user
+
+    @staticmethod
+    async def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
+
+        try:
+            user = await users_collection.find_one({"_id": ObjectId(user_id)})
+            if user:
+                user["_id"] = str(user["_id"])
+            return user
+        except:
+            return None
+
+    @staticmethod
+    async def create_project(user_id: str, name: str, product_info: str, offer_info: str) -> str:
+
+        project_doc = {
+            "user_id": ObjectId(user_id),
+            "name": name,
+            "product_info": product_info,
+            "offer_info": offer_info,
+            "created_at": datetime.utcnow()
+        }
+        result = await projects_collection.insert_one(project_doc)
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def get_user_projects(user_id: str) -> list:
+
+        try:
+            projects = await projects_collection.find({"user_id": ObjectId(user_id)}).to_list(None)
+            for project in projects:
+                project["_id"] = str(project["_id"])
+                project["user_id"] = str(project["user_id"])
+            return projects
+        except:
+            return []
+
+    @staticmethod
+    async def get_project_by_id(project_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+
+        try:
+            project = await projects_collection.find_one({
+                "_id": ObjectId(project_id),
+                "user_id": ObjectId(user_id)
+            })
+            if project:
+                project["_id"] = str(project["_id"])
+                project["user_id"] = str(project["user_id"])
+            return project
+        except:
+            return None
+
+    @staticmethod
+    async def update_project(project_id: str, user_id: str, updates: Dict[str, Any]) -> bool:
+
+        try:
+            update = {"$set": updates}
+            if "name" in updates:
+                # Exports carry the name in their filename and sheet title, so a rename invalidates cached ones and ETags
+                update["$inc"] = {"content_version": 1}
+            result = await projects_collection.update_one(
+                {"_id": ObjectId(project_id), "user_id": ObjectId(user_id)},
+                update
+            )
+            return result.modified_count > 0
+        except:
+            return False
+
+    @staticmethod
+    async def delete_project(project_id: str, user_id: str) -> bool:
+
+        try:
+            result = await projects_collection.delete_one({
+                "_id": ObjectId(project_id),
+                "user_id": ObjectId(user_id)
+            })
+
+            if result.deleted_count > 0:
+                await messages_collection.delete_many({"project_id": ObjectId(project_id)})
+                await AsyncDatabase.delete_cached_exports({"metadata.project_id": ObjectId(project_id)})
+                await AsyncDatabase.delete_export_jobs({"project_id": ObjectId(project_id)}, {"metadata.project_id": project_id})
+
+            return result.deleted_count > 0
+        except:
+            return False
+
+    @staticmethod
+    async def bump_content_version(project_id: str) -> None:
+        """Invalidate cached exports and ETags for a project whose messages changed"""
+        await projects_collection.update_one({"_id": ObjectId(project_id)}, {"$inc": {"content_version": 1}})
+
+    @staticmethod
+    async def save_message(project_id: str, username: str, generated_message: str, user_info: Dict[str, Any], user_id: str = None) -> str:
+        """Save a message with optional user_id for subscription tracking"""
+        message_doc = {
+            "project_id": ObjectId(project_id),
+            "username": username,
+            "generated_message": generated_message,
+            "user_info": user_info,
+            "created_at": datetime.utcnow()
+        }
+
+        # Add user_id if provided for better tracking
+        if user_id:
+            message_doc["user_id"] = ObjectId(user_id)
+
+        result = await messages_collection.insert_one(message_doc)
+        await AsyncDatabase.bump_content_version(project_id)
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def get_project_messages(project_id: str) -> list:
+
+        try:
+            messages = await messages_collection.find(
+                {"project_id": ObjectId(project_id)}
+            ).sort("created_at", -1).to_list(None)
+
+            for message in messages:
+                message["_id"] = str(message["_id"])
+                message["project_id"] = str(message["project_id"])
+
+            return messages
+        except:
+            return []
+
+    @staticmethod
+    async def iter_project_messages(project_id: str, batch_size: int = 1000):
+        """Yield a project's messages newest first, fetching batch_size documents per round trip"""
+        cursor = messages_collection.find(
+            {"project_id": ObjectId(project_id)}
+        ).sort("created_at", -1).batch_size(batch_size)
+
+        async for message in cursor:
+            message["_id"] = str(message["_id"])
+            message["project_id"] = str(message["project_id"])
+            yield message
+
+    @staticmethod
+    async def get_project_messages_page(project_id: str, limit: int, cursor: str = None) -> Tuple[list, Optional[str]]:
+        """One keyset page of project messages, newest first. Raises ValueError for a bad cursor."""
+        messages, next_cursor = await paginate_async(
+            messages_collection,
+            {"project_id": ObjectId(project_id)},
+            limit,
+            cursor
+        )
+        for message in messages:
+            message["_id"] = str(message["_id"])
+            message["project_id"] = str(message["project_id"])
+        return messages, next_cursor
+
+    @staticmethod
+    async def get_user_messages_page(user_id: str, limit: int, cursor: str = None, project_id: str = None,
+                                     since: datetime = None, until: datetime = None) -> Tuple[list, Optional[str]]:
+        """One keyset page of a user's messages across all projects, newest first. Raises ValueError for a bad cursor."""
+        query = _user_messages_query(user_id, project_id, since, until)
+        messages, next_cursor = await paginate_async(messages_collection, query, limit, cursor)
+        for message in messages:
+            message["_id"] = str(message["_id"])
+            message["project_id"] = str(message["project_id"])
+            message["user_id"] = str(message["user_id"])
+        return messages, next_cursor
+
+    @staticmethod
+    async def get_user_messages(user_id: str, project_id: str = None, since: datetime = None, until: datetime = None) -> list:
+        """All of a user's messages across projects, newest first (the unpaged get_user_messages_page)"""
+        try:
+            messages = await messages_collection.find(
+                _user_messages_query(user_id, project_id, since, until)
+            ).sort(KEYSET_SORT).to_list(None)
+
+            for message in messages:
+                message["_id"] = str(message["_id"])
+                message["project_id"] = str(message["project_id"])
+                message["user_id"] = str(message["user_id"])
+
+            return messages
+        except:
+            return []
+
+    @staticmethod
+    async def backfill_message_user_ids() -> int:
+        """Copy the owning project's user_id onto messages saved without one; returns messages updated"""
+        updated = 0
+        async for project in projects_collection.find({}, {"user_id": 1}):
+            result = await messages_collection.update_many(
+                {"project_id": project["_id"], "user_id": {"$exists": False}},
+                {"$set": {"user_id": project["user_id"]}}
+            )
+            updated += result.modified_count
+        return updated
+
+    @staticmethod
+    async def create_verification_code(email: str) -> str:
+        code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
+
+        verification_doc = {
+            "email": email.lower(),
+            "code": code,
+            "created_at": datetime.utcnow(),
+            "expires_at": datetime.utcnow() + timedelta(minutes=15),
+            "used": False
+        }
+
+        await verification_codes_collection.delete_many({"email": email.lower()})
+        await verification_codes_collection.insert_one(verification_doc)
+        return code
+
+    @staticmethod
+    async def verify_email_code(email: str, code: str) -> bool:
+        try:
+            verification = await verification_codes_collection.find_one({
+                "email": email.lower(),
+                "code": code,
+                "used": False,
+                "expires_at": {"$gt": datetime.utcnow()}
+            })
+
+            if verification:
+                await verification_codes_collection.update_one(
+                    {"_id": verification["_id"]},
+                    {"$set": {"used": True}}
+                )
+
+                await users_collection.update_one(
+                    {"email": email.lower()},
+                    {"$set": {"email_verified": True}}
+                )
+                return True
+            return False
+        except:
+            return False
+
+    @staticmethod
+    async def create_password_reset_token(email: str) -> str:
+        """Create secure reset token, reusing verification collection"""
+        token = secrets.token_urlsafe(32)  # Cryptographically secure
+
+        reset_doc = {
+            "email": email.lower(),
+            "code": token,  # Reuse 'code' field for token
+            "created_at": datetime.utcnow(),
+            "expires_at": datetime.utcnow() + timedelta(hours=1),  # 1 hour expiry
+            "used": False,
+            "type": "password_reset"  # Distinguish from email verification
+        }
+
+        # Remove any existing reset tokens for this email
+        await verification_codes_collection.delete_many({
+            "email": email.lower(),
+            "type": "password_reset"
+        })
+        await verification_codes_collection.insert_one(reset_doc)
+        return token
+
+    @staticmethod
+    async def verify_reset_token(email: str, token: str) -> bool:
+        """Verify reset token and mark as used"""
+        try:
+            reset_request = await verification_codes_collection.find_one({
+                "email": email.lower(),
+                "code": token,
+                "type": "password_reset",
+                "used": False,
+                "expires_at": {"$gt": datetime.utcnow()}
+            })
+
+            if reset_request:
+                await verification_codes_collection.update_one(
+                    {"_id": reset_request["_id"]},
+                    {"$set": {"used": True}}
+                )
+                return True
+            return False
+        except:
+            return False
+
+    @staticmethod
+    async def update_user_password(email: str, new_password_hash: str) -> bool:
+        """Update user password"""
+        try:
+            result = await users_collection.update_one(
+                {"email": email.lower()},
+                {"$set": {"password_hash": new_password_hash}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+
+    # Refresh Tokens (stored as keyed hashes; a family is one login session across rotations)
+    @staticmethod
+    async def create_refresh_token(user_id: str, token_hash: str, family_id: str, expires_at: datetime) -> None:
+        await refresh_tokens_collection.insert_one({
+            "token_hash": token_hash,
+            "user_id": ObjectId(user_id),
+            "family_id": family_id,
+            "created_at": datetime.utcnow(),
+            "expires_at": expires_at,
+            "revoked_at": None,
+            "rotated_at": None  # set when revoked by rotation rather than logout or reuse
+        })
+
+    @staticmethod
+    async def consume_refresh_token(token_hash: str) -> Optional[Dict[str, Any]]:
+        """Atomically revoke an active refresh token and return it; None if it is unknown, expired or already used"""
+        try:
+            now = datetime.utcnow()
+            token = await refresh_tokens_collection.find_one_and_update(
+                {"token_hash": token_hash, "revoked_at": None, "expires_at": {"$gt": now}},
+                {"$set": {"revoked_at": now, "rotated_at": now}}
+            )
+            if token:
+                token["user_id"] = str(token["user_id"])
+            return token
+        except:
+            return None
+
+    @staticmethod
+    async def get_refresh_token(token_hash: str) -> Optional[Dict[str, Any]]:
+        try:
+            token = await refresh_tokens_collection.find_one({"token_hash": token_hash})
+            if token:
+                token["user_id"] = str(token["user_id"])
+            return token
+        except:
+            return None
+
+    @staticmethod
+    async def refresh_token_family_active(family_id: str) -> bool:
+        """True while the session still has an unrevoked, unexpired token (it was not logged out or revoked for reuse)"""
+        try:
+            token = await refresh_tokens_collection.find_one(
+                {"family_id": family_id, "revoked_at": None, "expires_at": {"$gt": datetime.utcnow()}},
+                {"_id": 1}
+            )
+            return token is not None
+        except:
+            return False
+
+    @staticmethod
+    async def revoke_refresh_token_family(family_id: str) -> int:
+        try:
+            result = await refresh_tokens_collection.update_many(
+                {"family_id": family_id, "revoked_at": None},
+                {"$set": {"revoked_at": datetime.utcnow()}}
+            )
+            return result.modified_count
+        except:
+            return 0
+
+    @staticmethod
+    async def revoke_user_refresh_tokens(user_id: str) -> int:
+        """Sign a user out of every session, e.g. after a password reset"""
+        try:
+            result = await refresh_tokens_collection.update_many(
+                {"user_id": ObjectId(user_id), "revoked_at": None},
+                {"$set": {"revoked_at": datetime.utcnow()}}
+            )
+            return result.modified_count
+        except:
+            return 0
+
+    # Email Outbox (emails are queued here and sent by the dispatcher in backend/email_outbox.py)
+    @staticmethod
+    async def enqueue_email(kind: str, message: Dict[str, Any]) -> Optional[str]:
+        """Queue a rendered Mailgun message (from/to/subject/html); returns its ID, or None if the insert failed"""
+        try:
+            now = datetime.utcnow()
+            result = await email_outbox_collection.insert_one({
+                "kind": kind,
+                "message": message,
+                "status": "pending",  # pending, sending, sent, dead
+                "attempts": 0,
+                "created_at": now,
+                "next_attempt_at": now,
+                "sent_at": None,
+                "worker_id": None,
+                "lease_expires_at": None,
+                "last_error": None
+            })
+            return str(result.inserted_id)
+        except Exception as e:
+            print(f"Error queueing email: {e}")
+            return None
+
+    # Email Digests (events collected here go out as one email per kind and interval)
+    @staticmethod
+    async def record_digest_event(kind: str, data: Dict[str, Any]) -> Optional[str]:
+        try:
+            result = await email_digest_events_collection.insert_one(_digest_event_doc(kind, data))
+            return str(result.inserted_id)
+        except Exception as e:
+            print(f"Error recording digest event: {e}")
+            return None
+
+    # Stripe Events (verified webhooks are stored here and fulfilled by backend/stripe_events.py)
+    @staticmethod
+    async def record_stripe_event(event_id: str, event_type: str, payload: str) -> Optional[bool]:
+        """Store a verified webhook event; True if new, False if Stripe already delivered it, None if the insert failed"""
+        try:
+            now = datetime.utcnow()
+            await stripe_events_collection.insert_one({
+                "event_id": event_id,
+                "type": event_type,
+                "payload": payload,  # raw JSON body as Stripe signed it
+                "status": "pending",  # pending, processing, processed, failed
+                "attempts": 0,
+                "created_at": now,
+                "next_attempt_at": now,
+                "processed_at": None,
+                "worker_id": None,
+                "lease_expires_at": None,
+                "last_error": None
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            print(f"Error recording Stripe event: {e}")
+            return None
+
+    # Credit Management Methods
+    @staticmethod
+    async def initialize_user_credits(user_id: str) -> None:
+        """Initialize a new user with 10 free credits"""
+        try:
+            credit_doc = {
+                "user_id": ObjectId(user_id),
+                "credits": 10,
+                "total_earned": 10,
+                "total_used": 0,
+                "created_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }
+            await user_credits_collection.insert_one(credit_doc)
+        except Exception as e:
+            # If credits already exist for user, skip
+            pass
+
+    @staticmethod
+    async def get_user_credits(user_id: str) -> int:
+        """Get current credit balance for user"""
+        try:
+            credits = await user_credits_collection.find_one({"user_id": ObjectId(user_id)})
+            return credits["credits"] if credits else 0
+        except:
+            return 0
+
+    @staticmethod
+    async def use_credit(user_id: str) -> bool:
+        """Use one credit for message generation. Returns True if successful."""
+        try:
+            result = await user_credits_collection.update_one(
+                {
+                    "user_id": ObjectId(user_id),
+                    "credits": {"$gt": 0}  # Only if credits > 0
+                },
+                {
+                    "$inc": {"credits": -1, "total_used": 1},
+                    "$set": {"updated_at": datetime.utcnow()}
+                }
+            )
+            return result.modified_count > 0
+        except:
+            return False
+
+    @staticmethod
+    async def add_credits(user_id: str, credits_to_add: int, transaction_id: str = None) -> bool:
+        """Add credits to user account"""
+        try:
+            await user_credits_collection.update_one(
+                {"user_id": ObjectId(user_id)},
+                {
+                    "$inc": {"credits": credits_to_add, "total_earned": credits_to_add},
+                    "$set": {"updated_at": datetime.utcnow()}
+                },
+                upsert=True
+            )
+            return True
+        except:
+            return False
+
+    @staticmethod
+    async def get_user_credit_info(user_id: str) -> Optional[Dict[str, Any]]:
+        """Get detailed credit information for user"""
+        try:
+            credits = await user_credits_collection.find_one({"user_id": ObjectId(user_id)})
+            if credits:
+                credits["_id"] = str(credits["_id"])
+                credits["user_id"] = str(credits["user_id"])
+            return credits
+        except:
+            return None
+
+    # Payment Transaction Methods
+    @staticmethod
+    async def create_payment_transaction(
+        user_id: str,
+        stripe_session_id: str,
+        amount: int,
+        credits: int,
+        price_id: str,
+        status: str = "pending",
+        transaction_type: str = "one_time",
+        subscription_id: str = None
+    ) -> str:
+        """Create a payment transaction record"""
+        transaction_doc = {
+            "user_id": ObjectId(user_id),
+            "stripe_session_id": stripe_session_id,
+            "amount": amount,  # in cents
+            "credits": credits,
+            "price_id": price_id,
+            "status": status,  # pending, fulfilling, completed, failed
+            "transaction_type": transaction_type,  # one_time, subscription
+            "subscription_id": subscription_id,  # for subscription transactions
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        result = await payment_transactions_collection.insert_one(transaction_doc)
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def get_payment_by_session_id(stripe_session_id: str) -> Optional[Dict[str, Any]]:
+        """Get payment transaction by Stripe session ID"""
+        try:
+            transaction = await payment_transactions_collection.find_one(
+                {"stripe_session_id": stripe_session_id}
+            )
+            if transaction:
+                transaction["_id"] = str(transaction["_id"])
+                transaction["user_id"] = str(transaction["user_id"])
+            return transaction
+        except:
+            return None
+
+    @staticmethod
+    async def update_payment_status(stripe_session_id: str, status: str) -> bool:
+        """Update payment transaction status"""
+        try:
+            result = await payment_transactions_collection.update_one(
+                {"stripe_session_id": stripe_session_id},
+                {
+                    "$set": {
+                        "status": status,
+                        "updated_at": datetime.utcnow()
+                    }
+                }
+            )
+            return result.modified_count > 0
+        except:
+            return False
+
+    @staticmethod
+    async def get_user_payment_history(user_id: str) -> list:
+        """Get payment history for user"""
+        try:
+            transactions = await payment_transactions_collection.find(
+                {"user_id": ObjectId(user_id)}
+            ).sort("created_at", -1).to_list(None)
+
+            for transaction in transactions:
+                transaction["_id"] = str(transaction["_id"])
+                transaction["user_id"] = str(transaction["user_id"])
+
+            return transactions
+        except:
+            return []
+
+    @staticmethod
+    async def get_user_payment_history_page(user_id: str, limit: int, cursor: str = None) -> Tuple[list, Optional[str]]:
+        """One keyset page of payment history, newest first. Raises ValueError for a bad cursor."""
+        transactions, next_cursor = await paginate_async(
+            payment_transactions_collection,
+            {"user_id": ObjectId(user_id)},
+            limit,
+            cursor
+        )
+        for transaction in transactions:
+            transaction["_id"] = str(transaction["_id"])
+            transaction["user_id"] = str(transaction["user_id"])
+        return transactions, next_cursor
+
+    # DM Generation Job Management
+    @staticmethod
+    async def create_dm_job(user_id: str, project_id: str, username: str, force_refresh: bool = False, new_variant: bool = False, priority: int = PRIORITY_NORMAL) -> str:
+        """Create a new DM generation job"""
+        job_doc = _dm_job_doc(user_id, project_id, username, force_refresh, new_variant, priority=priority)
+        result = await dm_generation_jobs_collection.insert_one(job_doc)
+        await _publish_dm_job_event(job_doc, "pending")
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def create_dm_job_batch(
+        user_id: str,
+        project_id: str,
+        usernames: list,
+        force_refresh: bool = False,
+        new_variant: bool = False,
+        priority: int = PRIORITY_BULK,
+        chunk_size: int = 1000
+    ) -> str:
+        """Create a batch record and one pending job per username using chunked insert_many"""
+        batch_doc = {
+            "user_id": ObjectId(user_id),
+            "project_id": ObjectId(project_id),
+            "total": len(usernames),
+            "created_at": datetime.utcnow()
+        }
+        batch_id = (await dm_job_batches_collection.insert_one(batch_doc)).inserted_id
+
+        for start in range(0, len(usernames), chunk_size):
+            chunk = usernames[start:start + chunk_size]
+            await dm_generation_jobs_collection.insert_many(
+                [_dm_job_doc(user_id, project_id, username, force_refresh, new_variant, batch_id, priority) for username in chunk],
+                ordered=False
+            )
+
+        # One event for the whole batch instead of one per queued job
+        try:
+            await _ensure_dm_job_events_collection()
+            await dm_job_events_collection.insert_one({
+                "type": "batch",
+                "user_id": ObjectId(user_id),
+                "project_id": ObjectId(project_id),
+                "batch_id": batch_id,
+                "status": "pending",
+                "batch": {"total": len(usernames), "completed": 0, "failed": 0, "cancelled": 0},
+                "created_at": datetime.utcnow()
+            })
+        except Exception as e:
+            print(f"Error publishing DM batch event: {e}")
+
+        return str(batch_id)
+
+    @staticmethod
+    async def get_dm_job(job_id: str) -> Optional[Dict[str, Any]]:
+        """Get DM generation job by ID"""
+        try:
+            job = await dm_generation_jobs_collection.find_one({"_id": ObjectId(job_id)})
+            if job:
+                job["_id"] = str(job["_id"])
+                job["user_id"] = str(job["user_id"])
+                job["project_id"] = str(job["project_id"])
+            return job
+        except:
+            return None
+
+    @staticmethod
+    async def get_project_dm_jobs(project_id: str, user_id: str) -> list:
+        """Get all DM jobs for a project"""
+        try:
+            jobs = await dm_generation_jobs_collection.find({
+                "project_id": ObjectId(project_id),
+                "user_id": ObjectId(user_id)
+            }).sort("created_at", -1).to_list(None)
+
+            for job in jobs:
+                job["_id"] = str(job["_id"])
+                job["user_id"] = str(job["user_id"])
+                job["project_id"] = str(job["project_id"])
+
+            return jobs
+        except:
+            return []
+
+    @staticmethod
+    async def get_project_dm_jobs_page(project_id: str, user_id: str, limit: int, cursor: str = None) -> Tuple[list, Optional[str]]:
+        """One keyset page of a project's DM jobs, newest first. Raises ValueError for a bad cursor."""
+        jobs, next_cursor = await paginate_async(
+            dm_generation_jobs_collection,
+            {"project_id": ObjectId(project_id), "user_id": ObjectId(user_id)},
+            limit,
+            cursor
+        )
+        for job in jobs:
+            job["_id"] = str(job["_id"])
+            job["user_id"] = str(job["user_id"])
+            job["project_id"] = str(job["project_id"])
+        return jobs, next_cursor
+
+    @staticmethod
+    async def update_dm_job_status(job_id: str, status: str, started_at: datetime = None) -> bool:
+        """Update DM job status"""
+        try:
+            update_doc = {
+                "status": status,
+                "updated_at": datetime.utcnow()
+            }
+            if started_at:
+                update_doc["started_at"] = started_at
+            if status == "completed" or status == "failed":
+                update_doc["completed_at"] = datetime.utcnow()
+
+            job = await dm_generation_jobs_collection.find_one_and_update(
+                {"_id": ObjectId(job_id)},
+                {"$set": update_doc}
+            )
+            if job:
+                await _publish_dm_job_event(job, status)
+            return job is not None
+        except:
+            return False
+
+    @staticmethod
+    async def complete_dm_job(job_id: str, result: Dict[str, Any], worker_id: str = None) -> bool:
+        """Mark DM job as completed with result (only while worker_id still holds its lease, if given)"""
+        try:
+            query = {"_id": ObjectId(job_id)}
+            if worker_id:
+                query.update({"worker_id": worker_id, "status": "processing"})
+
+            job = await dm_generation_jobs_collection.find_one_and_update(
+                query,
+                {
+                    "$set": {
+                        "status": "completed",
+                        "completed_at": datetime.utcnow(),
+                        "lease_expires_at": None,
+                        "result": result
+                    }
+                }
+            )
+            if job:
+                await _publish_dm_job_event(job, "completed", message_id=result.get("message_id"))
+            return job is not None
+        except:
+            return False
+
+    @staticmethod
+    async def fail_dm_job(job_id: str, error: str, worker_id: str = None) -> bool:
+        """Mark DM job as failed with error (only while worker_id still holds its lease, if given)"""
+        try:
+            query = {"_id": ObjectId(job_id)}
+            if worker_id:
+                query.update({"worker_id": worker_id, "status": "processing"})
+
+            job = await dm_generation_jobs_collection.find_one_and_update(
+                query,
+                {
+                    "$set": {
+                        "status": "failed",
+                        "completed_at": datetime.utcnow(),
+                        "lease_expires_at": None,
+                        "result": {
+                            "success": False,
+                            "error": error,
+                            "message": None,
+                            "user_info": None,
+                            "message_id": None
+                        }
+                    }
+                }
+            )
+            if job:
+                await _publish_dm_job_event(job, "failed", error=error)
+            return job is not None
+        except:
+            return False
+
+    @staticmethod
+    async def get_pending_dm_jobs() -> list:
+        """Get all pending DM jobs for background processing"""
+        try:
+            jobs = await dm_generation_jobs_collection.find({
+                "status": "pending"
+            }).sort("created_at", 1).to_list(None)  # FIFO processing
+
+            for job in jobs:
+                job["_id"] = str(job["_id"])
+                job["user_id"] = str(job["user_id"])
+                job["project_id"] = str(job["project_id"])
+
+            return jobs
+        except:
+            return []
+
+    @staticmethod
+    async def get_pending_dm_job_users() -> list:
+        """Summarize pending jobs per user: highest priority and the oldest job at that priority"""
+        try:
+            # Sorted like the (status, user_id, priority, created_at) index and grouped with $first only,
+            # MongoDB answers this with a DISTINCT_SCAN: one index seek per user, not a read of the backlog
+            cursor = await dm_generation_jobs_collection.aggregate([
+                {"$match": {"status": "pending"}},
+                {"$sort": {"user_id": 1, "priority": -1, "created_at": 1}},
+                {"$group": {
+                    "_id": "$user_id",
+                    "priority": {"$first": "$priority"},
+                    "oldest": {"$first": "$created_at"}
+                }}
+            ])
+            return await cursor.to_list(None)
+        except Exception as e:
+            print(f"Error summarizing pending DM jobs: {e}")
+            return []
+
+    @staticmethod
+    async def get_processing_dm_job_counts() -> Dict[Any, int]:
+        """Count jobs currently processing per user (across all workers)"""
+        try:
+            counts = await dm_generation_jobs_collection.aggregate([
+                {"$match": {"status": "processing"}},
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+            ])
+            return {doc["_id"]: doc["count"] async for doc in counts}
+        except Exception as e:
+            print(f"Error counting processing DM jobs: {e}")
+            return {}
+
+    @staticmethod
+    async def claim_next_dm_job(worker_id: str, lease_seconds: int, user_id: ObjectId = None) -> Optional[Dict[str, Any]]:
+        """Atomically move the next pending job (optionally for one user) to processing under a lease"""
+        try:
+            query = {"status": "pending"}
+            if user_id is not None:
+                query["user_id"] = user_id
+
+            # find_one_and_update is atomic, so two workers never claim the same job
+            now = datetime.utcnow()
+            job = await dm_generation_jobs_collection.find_one_and_update(
+                query,
+                {
+                    "$set": {
+                        "status": "processing",
+                        "worker_id": worker_id,
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        "heartbeat_at": now,
+                        "started_at": now,
+                        "updated_at": now
+                    },
+                    "$inc": {"attempts": 1}
+                },
+                sort=[("priority", -1), ("created_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if job:
+                await _publish_dm_job_event(job, "processing")
+                job["_id"] = str(job["_id"])
+                job["user_id"] = str(job["user_id"])
+                job["project_id"] = str(job["project_id"])
+            return job
+        except Exception as e:
+            print(f"Error claiming DM job: {e}")
+            return None
+
+    @staticmethod
+    async def renew_dm_job_leases(job_ids: list, worker_id: str, lease_seconds: int) -> int:
+        """Heartbeat: extend the lease on jobs this worker is still processing"""
+        try:
+            now = datetime.utcnow()
+            result = await dm_generation_jobs_collection.update_many(
+                {
+                    "_id": {"$in": [ObjectId(job_id) for job_id in job_ids]},
+                    "worker_id": worker_id,
+                    "status": "processing"
+                },
+                {
+                    "$set": {
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        "heartbeat_at": now
+                    }
+                }
+            )
+            return result.modified_count
+        except:
+            return 0
+
+    @staticmethod
+    async def mark_dm_job_credit_used(job_id: str) -> bool:
+        """Record that a credit was taken for this job, so retries do not charge again"""
+        try:
+            result = await dm_generation_jobs_collection.update_one(
+                {"_id": ObjectId(job_id)},
+                {"$set": {"credit_used": True}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+
+    @staticmethod
+    async def refund_dm_job_credit(job_id: str, reason: str) -> bool:
+        """Refund the job's credit at most once. Returns True if this call refunded it."""
+        try:
+            # Flip the flag first; only the caller that wins the flip adds the credit back
+            job = await dm_generation_jobs_collection.find_one_and_update(
+                {
+                    "_id": ObjectId(job_id),
+                    "credit_used": True,
+                    "credit_refunded": {"$ne": True}
+                },
+                {"$set": {"credit_refunded": True, "refunded_at": datetime.utcnow()}}
+            )
+            if not job:
+                return False
+
+            return await AsyncDatabase.add_credits(str(job["user_id"]), 1, reason)
+        except:
+            return False
+
+    @staticmethod
+    async def requeue_expired_dm_jobs(lease_seconds: int, max_attempts: int) -> Dict[str, int]:
+        """Reaper: put jobs with an expired lease back to pending, or fail them after max_attempts"""
+        counts = {"requeued": 0, "failed": 0}
+        now = datetime.utcnow()
+        expired = {
+            "status": "processing",
+            "$or": [
+                {"lease_expires_at": {"$lt": now}},
+                # Jobs claimed before leases existed
+                {"lease_expires_at": None, "started_at": {"$lt": now - timedelta(seconds=lease_seconds)}}
+            ]
+        }
+
+        try:
+            # Jobs claimed before leases existed have no attempts or credit flags. They were claimed once,
+            # and the old worker charged the credit right after claiming, so a retry must not charge again
+            await dm_generation_jobs_collection.update_many(
+                {**expired, "attempts": {"$exists": False}},
+                {"$set": {"attempts": 1}}
+            )
+            await dm_generation_jobs_collection.update_many(
+                {**expired, "credit_used": {"$exists": False}},
+                {"$set": {"credit_used": True, "credit_refunded": False}}
+            )
+
+            while True:
+                job = await dm_generation_jobs_collection.find_one_and_update(
+                    {**expired, "attempts": {"$lt": max_attempts}},
+                    {
+                        "$set": {
+                            "status": "pending",
+                            "worker_id": None,
+                            "lease_expires_at": None,
+                            "updated_at": now
+                        }
+                    }
+                )
+                if not job:
+                    break
+                await _publish_dm_job_event(job, "pending", requeued=True)
+                counts["requeued"] += 1
+
+            while True:
+                job = await dm_generation_jobs_collection.find_one({**expired, "attempts": {"$gte": max_attempts}})
+                if not job:
+                    break
+
+                error = f"Job abandoned after {job.get('attempts', 0)} attempts"
+                if not await AsyncDatabase.fail_dm_job(str(job["_id"]), error, worker_id=job.get("worker_id")):
+                    # Finished or re-claimed meanwhile; anything left is picked up next pass
+                    break
+                await AsyncDatabase.refund_dm_job_credit(str(job["_id"]), "refund_abandoned_job")
+                counts["failed"] += 1
+
+            return counts
+        except Exception as e:
+            print(f"Error requeueing expired DM jobs: {e}")
+            return counts
+
+    @staticmethod
+    async def delete_dm_job(job_id: str, user_id: str) -> bool:
+        """Delete a DM job (only if pending and belongs to user)"""
+        try:
+            job = await dm_generation_jobs_collection.find_one_and_delete({
+                "_id": ObjectId(job_id),
+                "user_id": ObjectId(user_id),
+                "status": "pending"
+            })
+            if job:
+                await _publish_dm_job_event(job, "cancelled")
+            return job is not None
+        except:
+            return False
+
+    @staticmethod
+    async def get_latest_dm_job_event_id() -> Optional[ObjectId]:
+        """Id of the newest job event, so subscribers only see events from now on"""
+        try:
+            await _ensure_dm_job_events_collection()
+            latest = await dm_job_events_collection.find_one(sort=[("$natural", -1)])
+            return latest["_id"] if latest else None
+        except:
+            return None
+
+    @staticmethod
+    async def tail_dm_job_events(after_id: Optional[ObjectId] = None):
+        """Tailable cursor over job events newer than after_id; iterate with async for"""
+        await _ensure_dm_job_events_collection()
+        query = {"_id": {"$gt": after_id}} if after_id else {}
+        return dm_job_events_collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+
+    # Instagram Profile Cache
+    @staticmethod
+    async def get_cached_profile(username: str, max_age_seconds: int) -> Optional[Dict[str, Any]]:
+        """Get a cached filtered profile if it was fetched within max_age_seconds"""
+        try:
+            cached = await instagram_profiles_collection.find_one({
+                "username": username.lower(),
+                "fetched_at": {"$gt": datetime.utcnow() - timedelta(seconds=max_age_seconds)}
+            })
+            return cached["profile"] if cached else None
+        except:
+            return None
+
+    @staticmethod
+    async def save_cached_profile(username: str, profile: Dict[str, Any]) -> bool:
+        """Store (or refresh) a filtered profile in the cache"""
+        try:
+            await instagram_profiles_collection.update_one(
+                {"username": username.lower()},
+                {
+                    "$set": {
+                        "profile": profile,
+                        "fetched_at": datetime.utcnow()
+                    }
+                },
+                upsert=True
+            )
+            return True
+        except:
+            return False
+
+    @staticmethod
+    def _format_message(message: Dict[str, Any]) -> Dict[str, Any]:
+        message["_id"] = str(message["_id"])
+        message["project_id"] = str(message["project_id"])
+        if message.get("user_id"):
+            message["user_id"] = str(message["user_id"])
+        return message
+
+    @staticmethod
+    async def get_project_message(project_id: str, message_id: str) -> Optional[Dict[str, Any]]:
+        """Get one message by ID, only if it belongs to the project (caller checks project ownership)"""
+        try:
+            message = await messages_collection.find_one({
+                "_id": ObjectId(message_id),
+                "project_id": ObjectId(project_id)
+            })
+            return AsyncDatabase._format_message(message) if message else None
+        except Exception as e:
+            print(f"Error getting message: {e}")
+            return None
+
+    @staticmethod
+    async def update_message(project_id: str, message_id: str, generated_message: str) -> Optional[Dict[str, Any]]:
+        """Update a message's content in one round trip; returns the updated message, or None if it is not in the project"""
+        try:
+            message = await messages_collection.find_one_and_update(
+                {"_id": ObjectId(message_id), "project_id": ObjectId(project_id)},
+                {
+                    "$set": {
+                        "generated_message": generated_message,
+                        "updated_at": datetime.utcnow()
+                    }
+                },
+                return_document=ReturnDocument.AFTER
+            )
+            if not message:
+                return None
+            await AsyncDatabase.bump_content_version(project_id)
+            return AsyncDatabase._format_message(message)
+        except Exception as e:
+            print(f"Error updating message: {e}")
+            return None
+
+    # Export Cache (written by Database.save_cached_export from the export endpoint's worker thread)
+    @staticmethod
+    async def get_cached_export(project_id: str, content_version: int, export_format: str, include_user_info: bool) -> Optional[Dict[str, Any]]:
+        """Find the export rendered from this content version, if one is cached"""
+        try:
+            cached = await export_cache_bucket.find({
+                "metadata.project_id": ObjectId(project_id),
+                "metadata.format": export_format,
+                "metadata.include_user_info": include_user_info,
+                "metadata.content_version": content_version
+            }).limit(1).to_list(1)
+            if not cached:
+                return None
+            return {"file_id": str(cached[0]._id), "filename": cached[0].filename, "size": cached[0].length}
+        except Exception as e:
+            print(f"Error getting cached export: {e}")
+            return None
+
+    @staticmethod
+    async def open_cached_export(file_id: str):
+        """Open a cached export for chunked reading; None if a newer version replaced it meanwhile"""
+        try:
+            return await export_cache_bucket.open_download_stream(ObjectId(file_id))
+        except Exception:
+            return None
+
+    @staticmethod
+    async def delete_cached_exports(query: Dict[str, Any]) -> int:
+        """Delete cached export files matching a query on the export_cache.files collection"""
+        deleted = 0
+        try:
+            async for cached in export_cache_bucket.find(query):
+                await export_cache_bucket.delete(cached._id)
+                deleted += 1
+            return deleted
+        except Exception as e:
+            print(f"Error deleting cached exports: {e}")
+            return deleted
+
+    @staticmethod
+    async def delete_export_jobs(query: Dict[str, Any], file_query: Dict[str, Any]) -> int:
+        """Delete export jobs matching query and their stored files, plus export_files matching file_query (uploads whose job has not completed yet)"""
+        deleted = 0
+        try:
+            async for job in export_jobs_collection.find({**query, "file_id": {"$ne": None}}, {"file_id": 1}):
+                try:
+                    await export_files_bucket.delete(job["file_id"])
+                except Exception:
+                    # Already gone
+                    pass
+            async for stored in export_files_bucket.find(file_query):
+                await export_files_bucket.delete(stored._id)
+            deleted = (await export_jobs_collection.delete_many(query)).deleted_count
+            return deleted
+        except Exception as e:
+            print(f"Error deleting export jobs: {e}")
+            return deleted
+
+    @staticmethod
+    async def delete_account_immediately(user_id: str) -> bool:
+        """Permanently delete user account and all associated data immediately"""
+        try:
+            user_object_id = ObjectId(user_id)
+
+            # Delete all user's projects
+            await projects_collection.delete_many({"user_id": user_object_id})
+
+            # Delete all user's message generation history
+            await messages_collection.delete_many({"user_id": user_object_id})
+
+            # Delete user's credits/usage history
+            await user_credits_collection.delete_many({"user_id": user_object_id})
+
+            # Delete user's payment transactions
+            await payment_transactions_collection.delete_many({"user_id": user_object_id})
+
+            # Delete user's refresh tokens (sessions)
+            await refresh_tokens_collection.delete_many({"user_id": user_object_id})
+
+            # Drop leads-ready notices still waiting for a digest
+            await email_digest_events_collection.delete_many({"kind": "leads_ready", "data.user_id": user_id})
+
+            # Delete cached exports of the user's projects
+            await AsyncDatabase.delete_cached_exports({"metadata.user_id": user_object_id})
+
+            # Delete export jobs and their stored files
+            await AsyncDatabase.delete_export_jobs({"user_id": user_object_id}, {"metadata.user_id": user_id})
+
+            # Finally, delete the user account itself
+            result = await users_collection.delete_one({"_id": user_object_id})
+
+            return result.deleted_count > 0
+        except Exception as e:
+            print(f"Error deleting account immediately: {e}")
+            return False
+
+    # Export Job Management
+    @staticmethod
+    def _format_export_job(job: Dict[str, Any]) -> Dict[str, Any]:
+        job["_id"] = str(job["_id"])
+        job["user_id"] = str(job["user_id"])
+        job["project_id"] = str(job["project_id"])
+        if job.get("file_id"):
+            job["file_id"] = str(job["file_id"])
+        return job
+
+    @staticmethod
+    async def create_export_job(user_id: str, project_id: str, export_format: str, include_user_info: bool = False, notify_email: str = None) -> str:
+        """Create a pending export job; notify_email gets a message when the file is ready"""
+        job_doc = {
+            "user_id": ObjectId(user_id),
+            "project_id": ObjectId(project_id),
+            "format": export_format,
+            "include_user_info": include_user_info,
+            "notify_email": notify_email,
+            "status": "pending",  # pending, processing, completed, failed, expired
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "completed_at": None,
+            "attempts": 0,
+            "worker_id": None,
+            "lease_expires_at": None,
+            "file_id": None,  # GridFS id in the export_files bucket
+            "filename": None,
+            "row_count": None,
+            "size": None,
+            "expires_at": None,  # when the stored file is deleted
+            "error": None
+        }
+        result = await export_jobs_collection.insert_one(job_doc)
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def get_export_job(job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get an export job by ID (only if it belongs to user)"""
+        try:
+            job = await export_jobs_collection.find_one({"_id": ObjectId(job_id), "user_id": ObjectId(user_id)})
+            return AsyncDatabase._format_export_job(job) if job else None
+        except:
+            return None
+
+    @staticmethod
+    async def open_export_file(file_id: str):
+        """Open a stored export file for chunked reading (AsyncGridOut.readchunk); None if it was deleted"""
+        try:
+            return await export_files_bucket.open_download_stream(ObjectId(file_id))
+        except Exception:
+            return None
@@ -0,0 +1,140 @@
+from apify_client import ApifyClientAsync
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from backend.profile_cache import ProfileCache
+from backend.completion_cache import CompletionCache
+from backend.scraper_algos import MODEL, PROMPT_VERSION, build_prompt_messages, filter_user, map_profile_items
+import asyncio
+import httpx
+import os
+
+load_dotenv()
+
+# Async counterparts of the clients in scraper_algos. They are created once per
+# process so every request shares the same keep-alive connection pools.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+APIFY_MAX_CONCURRENT_RUNS = int(os.getenv("APIFY_MAX_CONCURRENT_RUNS", "25"))
+
+apify = ApifyClientAsync(os.getenv("APIFY_API_TOKEN"))
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS // 2
+        )
+    )
+)
+
+# Apify caps concurrent runs per account, so excess runs wait here instead of failing
+_actor_runs = asyncio.Semaphore(APIFY_MAX_CONCURRENT_RUNS)
+
+
+async def scrape_instagram_profiles(usernames):
+    """Async version of scraper_algos.scrape_instagram_profiles"""
+    usernames = list(dict.fromkeys(u.strip().lstrip('@').lower() for u in usernames if u.strip()))
+    if not usernames:
+        return {}
+
+    try:
+        async with _actor_runs:
+            run = await apify.actor("apify/instagram-profile-scraper").call(run_input={"usernames": usernames})
+            if not run:
+                raise Exception("Actor run did not start")
+
+            items = [item async for item in apify.dataset(run["defaultDatasetId"]).iterate_items()]
+        return map_profile_items(usernames, items)
+    except Exception as e:
+        return {username: {"error": f"An error occurred: {str(e)}"} for username in usernames}
+
+async def get_filtered_profiles(usernames, force_refresh=False):
+    """Async version of scraper_algos.get_filtered_profiles"""
+    usernames = list(dict.fromkeys(u.strip().lstrip('@').lower() for u in usernames if u.strip()))
+    profiles = {}
+    to_scrape = []
+
+    for username in usernames:
+        # The profile cache talks to Mongo synchronously, so keep it off the event loop
+        cached = None if force_refresh else await asyncio.to_thread(ProfileCache.get, username)
+        if cached is not None:
+            profiles[username] = cached
+        else:
+            to_scrape.append(username)
+
+    if to_scrape:
+        scraped = await scrape_instagram_profiles(to_scrape)
+        for username, user_info in scraped.items():
+            filtered_user_info = filter_user(user_info)
+            # Only successful scrapes are cached so failures get retried
+            if "message" not in filtered_user_info:
+                await asyncio.to_thread(ProfileCache.set, username, filtered_user_info)
+            profiles[username] = filtered_user_info
+
+    return profiles
+
+async def get_filtered_profile(username, force_refresh=False):
+    username = username.strip().lstrip('@').lower()
+    profiles = await get_filtered_profiles([username], force_refresh=force_refresh)
+    return profiles.get(username, {"message": "Profile not found"})
+
+async def construct_business_message(user_info, product_info, offer_info, name, new_variant=False):
+    # new_variant skips the lookup (the user asked for a fresh DM) but still caches the result
+    cache_key = CompletionCache.make_key(MODEL, PROMPT_VERSION, user_info, product_info, offer_info, name)
+    if not new_variant:
+        cached = CompletionCache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    response = await client.chat.completions.create(
+        model=MODEL,
+        messages=build_prompt_messages(user_info, product_info, offer_info, name)
+    )
+    message = response.choices[0].message.content
+    CompletionCache.set(cache_key, message)
+    return message
+
+async def generate_from_profile(user_info, product_info, offer_info, name, new_variant=False):
+    """Async version of scraper_algos.generate_from_profile; user_info has already been through filter_user"""
+    try:
+
+        if "message" in user_info:
+            # filter_user's failure shape (private, missing or failed lookup)
+            return {
+                "success": False,
+                "message": None,
+                "user_info": None,
+                "error": user_info["message"]
+            }
+
+        generated_message = await construct_business_message(user_info, product_info, offer_info, name, new_variant=new_variant)
+
+        return {
+            "success": True,
+            "message": generated_message,
+            "user_info": user_info,
+            "error": None
+        }
+
+    except Exception as e:
+        return {
+            "success": False,
+            "message": None,
+            "user_info": None,
+            "error": f"An error occurred: {str(e)}"
+        }
+
+async def scrape(username, product_info, offer_info, name, force_refresh=False, new_variant=False):
+    """Async version of scraper_algos.scrape that never blocks the event loop"""
+    try:
+
+        user_info = await get_filtered_profile(username, force_refresh=force_refresh)
+
+    except Exception as e:
+        return {
+            "success": False,
+            "message": None,
+            "user_info": None,
+            "error": f"An error occurred: {str(e)}"
+        }
+
+    return await generate_from_profile(user_info, product_info, offer_info, name, new_variant=new_variant)
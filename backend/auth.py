@@ -1,12 +1,16 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import hashlib
+import hmac
 import os
+import secrets
 from dotenv import load_dotenv
-from backend.database import Database
+from backend.async_database import AsyncDatabase
+from backend.user_cache import UserCache
+from backend.password_hasher import PasswordHasher, PasswordHasherBusy, PASSWORD_HASH_RETRY_AFTER_SECONDS
 
 load_dotenv()
 
@@ -14,23 +18,41 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Refresh tokens let a client get new access tokens without sending the password (and paying for bcrypt) again
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# A rotated token presented again within this window is treated as a client race, not theft
+REFRESH_TOKEN_REUSE_GRACE_SECONDS = int(os.getenv("REFRESH_TOKEN_REUSE_GRACE_SECONDS", "10"))
+# Lifetime of an event stream ticket; it only has to survive until the EventSource connects
+SSE_TICKET_EXPIRE_SECONDS = int(os.getenv("SSE_TICKET_EXPIRE_SECONDS", "60"))
+SSE_TICKET_PURPOSE = "sse"
 
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+def password_hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-in attempts right now, please try again in a moment",
+        headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+    )
 
 class Auth:
     @staticmethod
-    def hash_password(password: str) -> str:
-    
-        return pwd_context.hash(password)
+    async def hash_password(password: str) -> str:
+        """bcrypt on the password hashing pool; 503 when the pool is saturated"""
+        try:
+            return await PasswordHasher.hash(password)
+        except PasswordHasherBusy:
+            raise password_hashing_busy()
     
     @staticmethod
-    def verify_password(plain_password: str, hashed_password: str) -> bool:
-    
-        return pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(plain_password: str, hashed_password: str) -> bool:
+        """bcrypt on the password hashing pool; 503 when the pool is saturated"""
+        try:
+            return await PasswordHasher.verify(plain_password, hashed_password)
+        except PasswordHasherBusy:
+            raise password_hashing_busy()
     
     @staticmethod
     def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -45,6 +67,14 @@ class Auth:
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
     
+    @staticmethod
+    def create_stream_ticket(user_id: str) -> str:
+        """A short-lived token that only opens /scrape/events, so the access token never goes in a URL"""
+        return Auth.create_access_token(
+            {"sub": user_id, "purpose": SSE_TICKET_PURPOSE},
+            expires_delta=timedelta(seconds=SSE_TICKET_EXPIRE_SECONDS)
+        )
+    
     @staticmethod
     def verify_token(token: str) -> Optional[dict]:
     
@@ -55,18 +85,70 @@ class Auth:
             return None
     
     @staticmethod
-    def authenticate_user(email: str, password: str) -> Optional[dict]:
+    def hash_refresh_token(token: str) -> str:
+        # Tokens are random 256-bit strings, so a keyed SHA-256 is enough; a leaked collection cannot be replayed
+        return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+    
+    @staticmethod
+    async def create_refresh_token(user_id: str, family_id: Optional[str] = None) -> str:
+        """Issue a refresh token; family_id carries a rotated token over into the same session"""
+        token = secrets.token_urlsafe(32)
+        await AsyncDatabase.create_refresh_token(
+            user_id,
+            Auth.hash_refresh_token(token),
+            family_id or secrets.token_hex(16),
+            datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        )
+        return token
     
-        user = Database.get_user_by_email(email)
+    @staticmethod
+    async def rotate_refresh_token(token: str) -> Optional[Tuple[str, str]]:
+        """
+        Exchange a refresh token for a new one in the same session.
+        
+        Returns (user_id, new_refresh_token), or None if the token is not usable. A token rotated
+        within the grace window is a concurrent refresh (two tabs sharing storage) and gets a new
+        token in the same session; presented again after that, it was stolen, so its session is revoked.
+        """
+        token_hash = Auth.hash_refresh_token(token)
+        current = await AsyncDatabase.consume_refresh_token(token_hash)
+        if current:
+            return current["user_id"], await Auth.create_refresh_token(current["user_id"], current["family_id"])
+        
+        reused = await AsyncDatabase.get_refresh_token(token_hash)
+        if not reused or not reused["revoked_at"]:
+            return None
+        
+        if datetime.utcnow() - reused["revoked_at"] > timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE_SECONDS):
+            await AsyncDatabase.revoke_refresh_token_family(reused["family_id"])
+            return None
+        
+        # Only a rotation is forgiven, and only while the session is still live (not logged out meanwhile)
+        if reused.get("rotated_at") and await AsyncDatabase.refresh_token_family_active(reused["family_id"]):
+            return reused["user_id"], await Auth.create_refresh_token(reused["user_id"], reused["family_id"])
+        return None
+    
+    @staticmethod
+    async def revoke_refresh_token(token: str) -> None:
+        """Revoke the whole session a refresh token belongs to"""
+        existing = await AsyncDatabase.get_refresh_token(Auth.hash_refresh_token(token))
+        if existing:
+            await AsyncDatabase.revoke_refresh_token_family(existing["family_id"])
+    
+    @staticmethod
+    async def authenticate_user(email: str, password: str) -> Optional[dict]:
+    
+        user = await AsyncDatabase.get_user_by_email(email)
         if not user:
             return None
         
-        if not Auth.verify_password(password, user["password_hash"]):
+        if not await Auth.verify_password(password, user["password_hash"]):
             return None
         
         return user
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_user_from_token(token: str, purpose: Optional[str] = None) -> dict:
+    """Resolve a token to its user; purpose must match the token's (None for access tokens)"""
     
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -75,7 +157,6 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     )
     
     try:
-        token = credentials.credentials
         payload = Auth.verify_token(token)
         if payload is None:
             raise credentials_exception
@@ -83,12 +164,42 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
+        
+        # Keeps a stream ticket from working as an access token, and an access token from working as a ticket
+        if payload.get("purpose") != purpose:
+            raise credentials_exception
             
     except JWTError:
         raise credentials_exception
     
-    user = Database.get_user_by_id(user_id)
+    user = UserCache.get(user_id)
+    if user is not None:
+        return user
+    
+    user = await AsyncDatabase.get_user_by_id(user_id)
     if user is None:
         raise credentials_exception
     
+    UserCache.set(user)
     return user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    
+    return await get_user_from_token(credentials.credentials)
+
+async def get_current_user_for_stream(
+    ticket: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Like get_current_user, but also accepts ?ticket= (from POST /scrape/events/ticket) because browser
+    EventSource cannot send headers"""
+    if credentials:
+        return await get_user_from_token(credentials.credentials)
+    if ticket:
+        return await get_user_from_token(ticket, purpose=SSE_TICKET_PURPOSE)
+    
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
@@ -0,0 +1,46 @@
+from backend.cache import TTLCache
+from dotenv import load_dotenv
+from typing import Optional, Dict, Any
+import hashlib
+import json
+import os
+
+load_dotenv()
+
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "2000"))
+COMPLETION_CACHE_TTL_SECONDS = int(os.getenv("COMPLETION_CACHE_TTL_SECONDS", str(60 * 60)))
+
+# Least recently used completions are evicted first once the cache is full
+_cache = TTLCache(COMPLETION_CACHE_MAX_ENTRIES, COMPLETION_CACHE_TTL_SECONDS)
+
+
+class CompletionCache:
+    """Content-addressed cache of generated DMs, keyed by model, prompt version and inputs"""
+
+    @staticmethod
+    def make_key(model: str, prompt_version: str, user_info: Dict[str, Any], product_info: str, offer_info: str, name: str) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "prompt_version": prompt_version,
+                "user_info": user_info,
+                "product_info": product_info,
+                "offer_info": offer_info,
+                "name": name
+            },
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get(key: str) -> Optional[str]:
+        return _cache.get(key)
+
+    @staticmethod
+    def set(key: str, completion: str) -> None:
+        _cache.set(key, completion)
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        return _cache.stats()
@@ -1,9 +1,12 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, CursorType
+from pymongo.errors import DuplicateKeyError
+from gridfs import GridFSBucket
 from dotenv import load_dotenv
 import os
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from bson import ObjectId
+from backend.pagination import paginate, KEYSET_SORT
 import secrets
 
 load_dotenv()
@@ -20,6 +23,138 @@ verification_codes_collection = db.verification_codes
 user_credits_collection = db.user_credits
 payment_transactions_collection = db.payment_transactions
 dm_generation_jobs_collection = db.dm_generation_jobs
+instagram_profiles_collection = db.instagram_profiles
+dm_job_batches_collection = db.dm_job_batches
+dm_job_events_collection = db.dm_job_events
+export_jobs_collection = db.export_jobs
+refresh_tokens_collection = db.refresh_tokens
+email_outbox_collection = db.email_outbox
+email_digest_events_collection = db.email_digest_events
+email_digest_runs_collection = db.email_digest_runs
+stripe_events_collection = db.stripe_events
+# Finished export files, referenced by export_jobs.file_id
+export_files_bucket = GridFSBucket(db, bucket_name="export_files")
+# Rendered exports keyed by project content version, served again until the project changes
+export_cache_bucket = GridFSBucket(db, bucket_name="export_cache")
+
+# Size of the capped job event log the SSE endpoint tails
+DM_JOB_EVENTS_MAX_BYTES = int(os.getenv("DM_JOB_EVENTS_MAX_BYTES", str(64 * 1024 * 1024)))
+_job_events_ready = False
+
+# Job priorities, higher runs first
+PRIORITY_BULK = 0
+PRIORITY_NORMAL = 1
+
+def _dm_job_doc(user_id: str, project_id: str, username: str, force_refresh: bool = False, new_variant: bool = False, batch_id: ObjectId = None, priority: int = PRIORITY_NORMAL) -> Dict[str, Any]:
+    return {
+        "user_id": ObjectId(user_id),
+        "project_id": ObjectId(project_id),
+        "username": username.strip().lstrip('@'),
+        "status": "pending",  # pending, processing, completed, failed
+        "created_at": datetime.utcnow(),
+        "started_at": None,
+        "completed_at": None,
+        "result": None,
+        "force_refresh": force_refresh,  # bypass the profile cache
+        "new_variant": new_variant,  # bypass the completion cache
+        "batch_id": batch_id,  # set for jobs queued through the bulk endpoint
+        "attempts": 0,  # claims so far, see requeue_expired_dm_jobs
+        "worker_id": None,
+        "lease_expires_at": None,  # renewed by the owning worker's heartbeat
+        "heartbeat_at": None,
+        "credit_used": False,
+        "credit_refunded": False,
+        "priority": priority  # higher runs first, see DMJobScheduler
+    }
+
+def _ensure_dm_job_events_collection() -> None:
+    """Create the capped event collection on first use (tailable cursors need a capped collection)"""
+    global _job_events_ready
+    if _job_events_ready:
+        return
+    
+    if "dm_job_events" not in db.list_collection_names(filter={"name": "dm_job_events"}):
+        try:
+            db.create_collection("dm_job_events", capped=True, size=DM_JOB_EVENTS_MAX_BYTES)
+        except Exception:
+            # Another process created it first
+            pass
+    _job_events_ready = True
+
+def _digest_event_doc(kind: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """An event waiting for the next email digest of its kind (see backend/email_outbox.py)"""
+    return {
+        "kind": kind,
+        "data": data,
+        "created_at": datetime.utcnow(),
+        "digest_id": None,
+        "digested_at": None
+    }
+
+def _user_messages_query(user_id: str, project_id: str = None, since: datetime = None, until: datetime = None) -> Dict[str, Any]:
+    """Filter for a user's messages across projects, optionally narrowed to one project and a created_at range"""
+    query = {"user_id": ObjectId(user_id)}
+    if project_id:
+        query["project_id"] = ObjectId(project_id)
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lt"] = until
+    return query
+
+def _leads_ready_event_doc(batch: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """A leads_ready digest event for the job that just finished a batch, or None if the batch is still running or produced nothing"""
+    finished = batch.get("completed", 0) + batch.get("failed", 0) + batch.get("cancelled", 0)
+    # Counters move by one per job, so exactly one job sees finished == total
+    if finished != batch.get("total", 0) or not batch.get("completed", 0):
+        return None
+    return _digest_event_doc("leads_ready", {
+        "user_id": str(batch["user_id"]),
+        "project_id": str(batch["project_id"]),
+        "batch_id": str(batch["_id"]),
+        "lead_count": batch["completed"]
+    })
+
+def _publish_dm_job_event(job: Dict[str, Any], status: str, **extra) -> None:
+    """Append a job state transition to the event log, with batch progress when the job is part of one"""
+    try:
+        _ensure_dm_job_events_collection()
+        
+        event = {
+            "type": "job",
+            "job_id": job["_id"],
+            "user_id": job["user_id"],
+            "project_id": job["project_id"],
+            "batch_id": job.get("batch_id"),
+            "username": job.get("username"),
+            "status": status,
+            "created_at": datetime.utcnow()
+        }
+        event.update(extra)
+        
+        # Completed/failed jobs move their batch counters
+        if job.get("batch_id") and status in ("completed", "failed", "cancelled"):
+            batch = dm_job_batches_collection.find_one_and_update(
+                {"_id": job["batch_id"]},
+                {"$inc": {status: 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if batch:
+                event["batch"] = {
+                    "total": batch.get("total", 0),
+                    "completed": batch.get("completed", 0),
+                    "failed": batch.get("failed", 0),
+                    "cancelled": batch.get("cancelled", 0)
+                }
+                leads_ready = _leads_ready_event_doc(batch)
+                if leads_ready:
+                    email_digest_events_collection.insert_one(leads_ready)
+        
+        dm_job_events_collection.insert_one(event)
+    except Exception as e:
+        print(f"Error publishing DM job event: {e}")
 
 class Database:
     @staticmethod
@@ -103,9 +238,13 @@ class Database:
     def update_project(project_id: str, user_id: str, updates: Dict[str, Any]) -> bool:
     
         try:
+            update = {"$set": updates}
+            if "name" in updates:
+                # Exports carry the name in their filename and sheet title, so a rename invalidates cached ones and ETags
+                update["$inc"] = {"content_version": 1}
             result = projects_collection.update_one(
                 {"_id": ObjectId(project_id), "user_id": ObjectId(user_id)},
-                {"$set": updates}
+                update
             )
             return result.modified_count > 0
         except:
@@ -124,11 +263,18 @@ class Database:
 
             if result.deleted_count > 0:
                 messages_collection.delete_many({"project_id": ObjectId(project_id)})
+                Database.delete_cached_exports({"metadata.project_id": ObjectId(project_id)})
+                Database.delete_export_jobs({"project_id": ObjectId(project_id)}, {"metadata.project_id": project_id})
             
             return result.deleted_count > 0
         except:
             return False
     
+    @staticmethod
+    def bump_content_version(project_id: str) -> None:
+        """Invalidate cached exports and ETags for a project whose messages changed"""
+        projects_collection.update_one({"_id": ObjectId(project_id)}, {"$inc": {"content_version": 1}})
+    
     @staticmethod
     def save_message(project_id: str, username: str, generated_message: str, user_info: Dict[str, Any], user_id: str = None) -> str:
         """Save a message with optional user_id for subscription tracking"""
@@ -145,6 +291,7 @@ class Database:
             message_doc["user_id"] = ObjectId(user_id)
             
         result = messages_collection.insert_one(message_doc)
+        Database.bump_content_version(project_id)
         return str(result.inserted_id)
     
     @staticmethod
@@ -163,6 +310,73 @@ class Database:
         except:
             return []
     
+    @staticmethod
+    def iter_project_messages(project_id: str, batch_size: int = 1000):
+        """Yield a project's messages newest first, fetching batch_size documents per round trip"""
+        cursor = messages_collection.find(
+            {"project_id": ObjectId(project_id)}
+        ).sort("created_at", -1).batch_size(batch_size)
+        
+        for message in cursor:
+            message["_id"] = str(message["_id"])
+            message["project_id"] = str(message["project_id"])
+            yield message
+    
+    @staticmethod
+    def get_project_messages_page(project_id: str, limit: int, cursor: str = None) -> Tuple[list, Optional[str]]:
+        """One keyset page of project messages, newest first. Raises ValueError for a bad cursor."""
+        messages, next_cursor = paginate(
+            messages_collection,
+            {"project_id": ObjectId(project_id)},
+            limit,
+            cursor
+        )
+        for message in messages:
+            message["_id"] = str(message["_id"])
+            message["project_id"] = str(message["project_id"])
+        return messages, next_cursor
+    
+    @staticmethod
+    def get_user_messages_page(user_id: str, limit: int, cursor: str = None, project_id: str = None,
+                               since: datetime = None, until: datetime = None) -> Tuple[list, Optional[str]]:
+        """One keyset page of a user's messages across all projects, newest first. Raises ValueError for a bad cursor."""
+        query = _user_messages_query(user_id, project_id, since, until)
+        messages, next_cursor = paginate(messages_collection, query, limit, cursor)
+        for message in messages:
+            message["_id"] = str(message["_id"])
+            message["project_id"] = str(message["project_id"])
+            message["user_id"] = str(message["user_id"])
+        return messages, next_cursor
+    
+    @staticmethod
+    def get_user_messages(user_id: str, project_id: str = None, since: datetime = None, until: datetime = None) -> list:
+        """All of a user's messages across projects, newest first (the unpaged get_user_messages_page)"""
+        try:
+            messages = list(messages_collection.find(
+                _user_messages_query(user_id, project_id, since, until)
+            ).sort(KEYSET_SORT))
+            
+            for message in messages:
+                message["_id"] = str(message["_id"])
+                message["project_id"] = str(message["project_id"])
+                message["user_id"] = str(message["user_id"])
+            
+            return messages
+        except:
+            return []
+    
+    @staticmethod
+    def backfill_message_user_ids() -> int:
+        """Copy the owning project's user_id onto messages saved without one; returns messages updated"""
+        updated = 0
+        for project in projects_collection.find({}, {"user_id": 1}):
+            result = messages_collection.update_many(
+                {"project_id": project["_id"], "user_id": {"$exists": False}},
+                {"$set": {"user_id": project["user_id"]}}
+            )
+            updated += result.modified_count
+        return updated
+    
     @staticmethod
     def create_verification_code(email: str) -> str:
         code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
@@ -260,6 +474,384 @@ class Database:
         except:
             return False
     
+    # Refresh Tokens (stored as keyed hashes; a family is one login session across rotations)
+    @staticmethod
+    def create_refresh_token(user_id: str, token_hash: str, family_id: str, expires_at: datetime) -> None:
+        refresh_tokens_collection.insert_one({
+            "token_hash": token_hash,
+            "user_id": ObjectId(user_id),
+            "family_id": family_id,
+            "created_at": datetime.utcnow(),
+            "expires_at": expires_at,
+            "revoked_at": None,
+            "rotated_at": None  # set when revoked by rotation rather than logout or reuse
+        })
+    
+    @staticmethod
+    def consume_refresh_token(token_hash: str) -> Optional[Dict[str, Any]]:
+        """Atomically revoke an active refresh token and return it; None if it is unknown, expired or already used"""
+        try:
+            now = datetime.utcnow()
+            token = refresh_tokens_collection.find_one_and_update(
+                {"token_hash": token_hash, "revoked_at": None, "expires_at": {"$gt": now}},
+                {"$set": {"revoked_at": now, "rotated_at": now}}
+            )
+            if token:
+                token["user_id"] = str(token["user_id"])
+            return token
+        except:
+            return None
+    
+    @staticmethod
+    def get_refresh_token(token_hash: str) -> Optional[Dict[str, Any]]:
+        try:
+            token = refresh_tokens_collection.find_one({"token_hash": token_hash})
+            if token:
+                token["user_id"] = str(token["user_id"])
+            return token
+        except:
+            return None
+    
+    @staticmethod
+    def refresh_token_family_active(family_id: str) -> bool:
+        """True while the session still has an unrevoked, unexpired token (it was not logged out or revoked for reuse)"""
+        try:
+            token = refresh_tokens_collection.find_one(
+                {"family_id": family_id, "revoked_at": None, "expires_at": {"$gt": datetime.utcnow()}},
+                {"_id": 1}
+            )
+            return token is not None
+        except:
+            return False
+    
+    @staticmethod
+    def revoke_refresh_token_family(family_id: str) -> int:
+        try:
+            result = refresh_tokens_collection.update_many(
+                {"family_id": family_id, "revoked_at": None},
+                {"$set": {"revoked_at": datetime.utcnow()}}
+            )
+            return result.modified_count
+        except:
+            return 0
+    
+    @staticmethod
+    def revoke_user_refresh_tokens(user_id: str) -> int:
+        """Sign a user out of every session, e.g. after a password reset"""
+        try:
+            result = refresh_tokens_collection.update_many(
+                {"user_id": ObjectId(user_id), "revoked_at": None},
+                {"$set": {"revoked_at": datetime.utcnow()}}
+            )
+            return result.modified_count
+        except:
+            return 0
+    
+    # Email Outbox (emails are queued here and sent by the dispatcher in backend/email_outbox.py)
+    @staticmethod
+    def enqueue_email(kind: str, message: Dict[str, Any]) -> Optional[str]:
+        """Queue a rendered Mailgun message (from/to/subject/html); returns its ID, or None if the insert failed"""
+        try:
+            now = datetime.utcnow()
+            result = email_outbox_collection.insert_one({
+                "kind": kind,
+                "message": message,
+                "status": "pending",  # pending, sending, sent, dead
+                "attempts": 0,
+                "created_at": now,
+                "next_attempt_at": now,
+                "sent_at": None,
+                "worker_id": None,
+                "lease_expires_at": None,
+                "last_error": None
+            })
+            return str(result.inserted_id)
+        except Exception as e:
+            print(f"Error queueing email: {e}")
+            return None
+    
+    @staticmethod
+    def claim_next_email(worker_id: str, lease_seconds: int) -> Optional[Dict[str, Any]]:
+        """Atomically move the longest-due pending email to sending under a lease"""
+        try:
+            now = datetime.utcnow()
+            email = email_outbox_collection.find_one_and_update(
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {
+                    "$set": {
+                        "status": "sending",
+                        "worker_id": worker_id,
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds)
+                    },
+                    "$inc": {"attempts": 1}
+                },
+                sort=[("next_attempt_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if email:
+                email["_id"] = str(email["_id"])
+            return email
+        except Exception as e:
+            print(f"Error claiming email: {e}")
+            return None
+    
+    @staticmethod
+    def mark_email_sent(email_id: str, worker_id: str) -> bool:
+        try:
+            result = email_outbox_collection.update_one(
+                {"_id": ObjectId(email_id), "worker_id": worker_id, "status": "sending"},
+                {"$set": {"status": "sent", "sent_at": datetime.utcnow(), "lease_expires_at": None, "last_error": None}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+    
+    @staticmethod
+    def retry_email(email_id: str, worker_id: str, error: str, next_attempt_at: datetime) -> bool:
+        """Put a failed email back in the queue, due again at next_attempt_at"""
+        try:
+            result = email_outbox_collection.update_one(
+                {"_id": ObjectId(email_id), "worker_id": worker_id, "status": "sending"},
+                {"$set": {"status": "pending", "next_attempt_at": next_attempt_at, "worker_id": None, "lease_expires_at": None, "last_error": error}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+    
+    @staticmethod
+    def dead_letter_email(email_id: str, worker_id: str, error: str) -> bool:
+        """Stop retrying an email; it stays in the outbox with status dead for inspection or retry_dead_emails"""
+        try:
+            result = email_outbox_collection.update_one(
+                {"_id": ObjectId(email_id), "worker_id": worker_id, "status": "sending"},
+                {"$set": {"status": "dead", "lease_expires_at": None, "last_error": error}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+    
+    @staticmethod
+    def requeue_expired_emails() -> int:
+        """Reaper: make emails whose dispatcher died due again (their attempt still counts)"""
+        try:
+            result = email_outbox_collection.update_many(
+                {"status": "sending", "lease_expires_at": {"$lt": datetime.utcnow()}},
+                {"$set": {"status": "pending", "worker_id": None, "lease_expires_at": None}}
+            )
+            return result.modified_count
+        except Exception as e:
+            print(f"Error requeueing expired emails: {e}")
+            return 0
+    
+    @staticmethod
+    def retry_dead_emails() -> int:
+        """Give dead-lettered emails a fresh set of attempts"""
+        try:
+            result = email_outbox_collection.update_many(
+                {"status": "dead"},
+                {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.utcnow()}}
+            )
+            return result.modified_count
+        except Exception as e:
+            print(f"Error retrying dead emails: {e}")
+            return 0
+    
+    # Email Digests (events collected here go out as one email per kind and interval)
+    @staticmethod
+    def record_digest_event(kind: str, data: Dict[str, Any]) -> Optional[str]:
+        try:
+            result = email_digest_events_collection.insert_one(_digest_event_doc(kind, data))
+            return str(result.inserted_id)
+        except Exception as e:
+            print(f"Error recording digest event: {e}")
+            return None
+    
+    @staticmethod
+    def claim_digest_run(kind: str, interval_seconds: float) -> bool:
+        """True if this caller owns the next digest of this kind; at most one claim succeeds per interval across processes"""
+        try:
+            now = datetime.utcnow()
+            run = email_digest_runs_collection.find_one_and_update(
+                {"_id": kind, "next_run_at": {"$lte": now}},
+                {"$set": {"last_run_at": now, "next_run_at": now + timedelta(seconds=interval_seconds)}}
+            )
+            if run:
+                return True
+            
+            # First digest of this kind ever
+            email_digest_runs_collection.insert_one({
+                "_id": kind,
+                "last_run_at": now,
+                "next_run_at": now + timedelta(seconds=interval_seconds)
+            })
+            return True
+        except DuplicateKeyError:
+            # The run exists and is not due yet
+            return False
+        except Exception as e:
+            print(f"Error claiming digest run: {e}")
+            return False
+    
+    @staticmethod
+    def claim_digest_events(kind: str, digest_id: str) -> list:
+        """Stamp every undigested event of this kind with digest_id and return them oldest first"""
+        try:
+            email_digest_events_collection.update_many(
+                {"kind": kind, "digest_id": None},
+                {"$set": {"digest_id": digest_id, "digested_at": datetime.utcnow()}}
+            )
+            events = list(email_digest_events_collection.find({"digest_id": digest_id}).sort("created_at", 1))
+            for event in events:
+                event["_id"] = str(event["_id"])
+            return events
+        except Exception as e:
+            print(f"Error claiming digest events: {e}")
+            return []
+    
+    @staticmethod
+    def release_digest_events(digest_id: str) -> int:
+        """Hand a digest's events back to the next one (its email could not be queued)"""
+        try:
+            result = email_digest_events_collection.update_many(
+                {"digest_id": digest_id},
+                {"$set": {"digest_id": None, "digested_at": None}}
+            )
+            return result.modified_count
+        except Exception as e:
+            print(f"Error releasing digest events: {e}")
+            return 0
+    
+    # Stripe Events (verified webhooks are stored here and fulfilled by backend/stripe_events.py)
+    @staticmethod
+    def record_stripe_event(event_id: str, event_type: str, payload: str) -> Optional[bool]:
+        """Store a verified webhook event; True if new, False if Stripe already delivered it, None if the insert failed"""
+        try:
+            now = datetime.utcnow()
+            stripe_events_collection.insert_one({
+                "event_id": event_id,
+                "type": event_type,
+                "payload": payload,  # raw JSON body as Stripe signed it
+                "status": "pending",  # pending, processing, processed, failed
+                "attempts": 0,
+                "created_at": now,
+                "next_attempt_at": now,
+                "processed_at": None,
+                "worker_id": None,
+                "lease_expires_at": None,
+                "last_error": None
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            print(f"Error recording Stripe event: {e}")
+            return None
+    
+    @staticmethod
+    def claim_next_stripe_event(worker_id: str, lease_seconds: int) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest due pending event to processing under a lease"""
+        try:
+            now = datetime.utcnow()
+            event = stripe_events_collection.find_one_and_update(
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {
+                    "$set": {
+                        "status": "processing",
+                        "worker_id": worker_id,
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds)
+                    },
+                    "$inc": {"attempts": 1}
+                },
+                sort=[("next_attempt_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if event:
+                event["_id"] = str(event["_id"])
+            return event
+        except Exception as e:
+            print(f"Error claiming Stripe event: {e}")
+            return None
+    
+    @staticmethod
+    def mark_stripe_event_processed(event_id: str, worker_id: str) -> bool:
+        try:
+            result = stripe_events_collection.update_one(
+                {"event_id": event_id, "worker_id": worker_id, "status": "processing"},
+                {"$set": {"status": "processed", "processed_at": datetime.utcnow(), "lease_expires_at": None, "last_error": None}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+    
+    @staticmethod
+    def retry_stripe_event(event_id: str, worker_id: str, error: str, next_attempt_at: datetime) -> bool:
+        """Put an event that failed to process back in the queue, due again at next_attempt_at"""
+        try:
+            result = stripe_events_collection.update_one(
+                {"event_id": event_id, "worker_id": worker_id, "status": "processing"},
+                {"$set": {"status": "pending", "next_attempt_at": next_attempt_at, "worker_id": None, "lease_expires_at": None, "last_error": error}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+    
+    @staticmethod
+    def fail_stripe_event(event_id: str, worker_id: str, error: str) -> bool:
+        """Stop retrying an event; it stays with status failed until replayed"""
+        try:
+            result = stripe_events_collection.update_one(
+                {"event_id": event_id, "worker_id": worker_id, "status": "processing"},
+                {"$set": {"status": "failed", "lease_expires_at": None, "last_error": error}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+    
+    @staticmethod
+    def requeue_expired_stripe_events() -> int:
+        """Reaper: make events whose consumer died due again (their attempt still counts)"""
+        try:
+            result = stripe_events_collection.update_many(
+                {"status": "processing", "lease_expires_at": {"$lt": datetime.utcnow()}},
+                {"$set": {"status": "pending", "worker_id": None, "lease_expires_at": None}}
+            )
+            return result.modified_count
+        except Exception as e:
+            print(f"Error requeueing expired Stripe events: {e}")
+            return 0
+    
+    @staticmethod
+    def get_failed_stripe_events(limit: int = 50) -> list:
+        """Most recent failed events, without their payloads"""
+        try:
+            events = list(stripe_events_collection.find(
+                {"status": "failed"},
+                {"payload": 0}
+            ).sort("created_at", -1).limit(limit))
+            for event in events:
+                event["_id"] = str(event["_id"])
+            return events
+        except Exception as e:
+            print(f"Error getting failed Stripe events: {e}")
+            return []
+    
+    @staticmethod
+    def replay_stripe_events(event_ids: Optional[list] = None) -> int:
+        """Queue events again with fresh attempts: the given IDs (any finished status), or every failed event"""
+        try:
+            if event_ids:
+                query = {"event_id": {"$in": event_ids}, "status": {"$in": ["processed", "failed"]}}
+            else:
+                query = {"status": "failed"}
+            result = stripe_events_collection.update_many(
+                query,
+                {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.utcnow(), "last_error": None}}
+            )
+            return result.modified_count
+        except Exception as e:
+            print(f"Error replaying Stripe events: {e}")
+            return 0
+    
     # Credit Management Methods
     @staticmethod
     def initialize_user_credits(user_id: str) -> None:
@@ -321,6 +913,27 @@ class Database:
         except:
             return False
     
+    @staticmethod
+    def add_payment_credits(user_id: str, credits_to_add: int, transaction_id: str) -> bool:
+        """add_credits that credits each payment transaction at most once, so a fulfillment can safely be retried"""
+        try:
+            user_credits_collection.update_one(
+                {"user_id": ObjectId(user_id), "credited_transactions": {"$ne": str(transaction_id)}},
+                {
+                    "$inc": {"credits": credits_to_add, "total_earned": credits_to_add},
+                    "$addToSet": {"credited_transactions": str(transaction_id)},
+                    "$set": {"updated_at": datetime.utcnow()}
+                },
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # The filter missed because the transaction was already credited, and the upsert hit the unique user_id index
+            return True
+        except Exception as e:
+            print(f"Error adding payment credits: {e}")
+            return False
+    
     @staticmethod
     def get_user_credit_info(user_id: str) -> Optional[Dict[str, Any]]:
         """Get detailed credit information for user"""
@@ -352,7 +965,7 @@ class Database:
             "amount": amount,  # in cents
             "credits": credits,
             "price_id": price_id,
-            "status": status,  # pending, completed, failed
+            "status": status,  # pending, fulfilling, completed, failed
             "transaction_type": transaction_type,  # one_time, subscription
             "subscription_id": subscription_id,  # for subscription transactions
             "created_at": datetime.utcnow(),
@@ -392,6 +1005,30 @@ class Database:
         except:
             return False
     
+    @staticmethod
+    def claim_payment_fulfillment(stripe_session_id: str, timeout_seconds: int) -> bool:
+        """Atomically move a pending transaction to fulfilling; only the caller that wins may add its credits.
+        A fulfilling transaction older than timeout_seconds belongs to a handler that died and can be claimed again."""
+        try:
+            now = datetime.utcnow()
+            stale = now - timedelta(seconds=timeout_seconds)
+            result = payment_transactions_collection.update_one(
+                {
+                    "stripe_session_id": stripe_session_id,
+                    "$or": [
+                        {"status": {"$in": ["pending", "failed"]}},
+                        {"status": "fulfilling", "fulfilling_at": {"$lt": stale}},
+                        # Claimed before fulfilling_at was recorded
+                        {"status": "fulfilling", "fulfilling_at": {"$exists": False}, "updated_at": {"$lt": stale}}
+                    ]
+                },
+                {"$set": {"status": "fulfilling", "fulfilling_at": now, "updated_at": now}}
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            print(f"Error claiming payment fulfillment: {e}")
+            return False
+    
     @staticmethod
     def get_user_payment_history(user_id: str) -> list:
         """Get payment history for user"""
@@ -408,23 +1045,71 @@ class Database:
         except:
             return []
     
+    @staticmethod
+    def get_user_payment_history_page(user_id: str, limit: int, cursor: str = None) -> Tuple[list, Optional[str]]:
+        """One keyset page of payment history, newest first. Raises ValueError for a bad cursor."""
+        transactions, next_cursor = paginate(
+            payment_transactions_collection,
+            {"user_id": ObjectId(user_id)},
+            limit,
+            cursor
+        )
+        for transaction in transactions:
+            transaction["_id"] = str(transaction["_id"])
+            transaction["user_id"] = str(transaction["user_id"])
+        return transactions, next_cursor
+    
     # DM Generation Job Management
     @staticmethod
-    def create_dm_job(user_id: str, project_id: str, username: str) -> str:
+    def create_dm_job(user_id: str, project_id: str, username: str, force_refresh: bool = False, new_variant: bool = False, priority: int = PRIORITY_NORMAL) -> str:
         """Create a new DM generation job"""
-        job_doc = {
+        job_doc = _dm_job_doc(user_id, project_id, username, force_refresh, new_variant, priority=priority)
+        result = dm_generation_jobs_collection.insert_one(job_doc)
+        _publish_dm_job_event(job_doc, "pending")
+        return str(result.inserted_id)
+    
+    @staticmethod
+    def create_dm_job_batch(
+        user_id: str,
+        project_id: str,
+        usernames: list,
+        force_refresh: bool = False,
+        new_variant: bool = False,
+        priority: int = PRIORITY_BULK,
+        chunk_size: int = 1000
+    ) -> str:
+        """Create a batch record and one pending job per username using chunked insert_many"""
+        batch_doc = {
             "user_id": ObjectId(user_id),
             "project_id": ObjectId(project_id),
-            "username": username.strip().lstrip('@'),
-            "status": "pending",  # pending, processing, completed, failed
-            "created_at": datetime.utcnow(),
-            "started_at": None,
-            "completed_at": None,
-            "result": None,
-            "priority": 1  # for future use
+            "total": len(usernames),
+            "created_at": datetime.utcnow()
         }
-        result = dm_generation_jobs_collection.insert_one(job_doc)
-        return str(result.inserted_id)
+        batch_id = dm_job_batches_collection.insert_one(batch_doc).inserted_id
+        
+        for start in range(0, len(usernames), chunk_size):
+            chunk = usernames[start:start + chunk_size]
+            dm_generation_jobs_collection.insert_many(
+                [_dm_job_doc(user_id, project_id, username, force_refresh, new_variant, batch_id, priority) for username in chunk],
+                ordered=False
+            )
+        
+        # One event for the whole batch instead of one per queued job
+        try:
+            _ensure_dm_job_events_collection()
+            dm_job_events_collection.insert_one({
+                "type": "batch",
+                "user_id": ObjectId(user_id),
+                "project_id": ObjectId(project_id),
+                "batch_id": batch_id,
+                "status": "pending",
+                "batch": {"total": len(usernames), "completed": 0, "failed": 0, "cancelled": 0},
+                "created_at": datetime.utcnow()
+            })
+        except Exception as e:
+            print(f"Error publishing DM batch event: {e}")
+        
+        return str(batch_id)
     
     @staticmethod
     def get_dm_job(job_id: str) -> Optional[Dict[str, Any]]:
@@ -457,6 +1142,21 @@ class Database:
         except:
             return []
     
+    @staticmethod
+    def get_project_dm_jobs_page(project_id: str, user_id: str, limit: int, cursor: str = None) -> Tuple[list, Optional[str]]:
+        """One keyset page of a project's DM jobs, newest first. Raises ValueError for a bad cursor."""
+        jobs, next_cursor = paginate(
+            dm_generation_jobs_collection,
+            {"project_id": ObjectId(project_id), "user_id": ObjectId(user_id)},
+            limit,
+            cursor
+        )
+        for job in jobs:
+            job["_id"] = str(job["_id"])
+            job["user_id"] = str(job["user_id"])
+            job["project_id"] = str(job["project_id"])
+        return jobs, next_cursor
+    
     @staticmethod
     def update_dm_job_status(job_id: str, status: str, started_at: datetime = None) -> bool:
         """Update DM job status"""
@@ -470,42 +1170,56 @@ class Database:
             if status == "completed" or status == "failed":
                 update_doc["completed_at"] = datetime.utcnow()
             
-            result = dm_generation_jobs_collection.update_one(
+            job = dm_generation_jobs_collection.find_one_and_update(
                 {"_id": ObjectId(job_id)},
                 {"$set": update_doc}
             )
-            return result.modified_count > 0
+            if job:
+                _publish_dm_job_event(job, status)
+            return job is not None
         except:
             return False
     
     @staticmethod
-    def complete_dm_job(job_id: str, result: Dict[str, Any]) -> bool:
-        """Mark DM job as completed with result"""
+    def complete_dm_job(job_id: str, result: Dict[str, Any], worker_id: str = None) -> bool:
+        """Mark DM job as completed with result (only while worker_id still holds its lease, if given)"""
         try:
-            update_result = dm_generation_jobs_collection.update_one(
-                {"_id": ObjectId(job_id)},
+            query = {"_id": ObjectId(job_id)}
+            if worker_id:
+                query.update({"worker_id": worker_id, "status": "processing"})
+            
+            job = dm_generation_jobs_collection.find_one_and_update(
+                query,
                 {
                     "$set": {
                         "status": "completed",
                         "completed_at": datetime.utcnow(),
+                        "lease_expires_at": None,
                         "result": result
                     }
                 }
             )
-            return update_result.modified_count > 0
+            if job:
+                _publish_dm_job_event(job, "completed", message_id=result.get("message_id"))
+            return job is not None
         except:
             return False
     
     @staticmethod
-    def fail_dm_job(job_id: str, error: str) -> bool:
-        """Mark DM job as failed with error"""
+    def fail_dm_job(job_id: str, error: str, worker_id: str = None) -> bool:
+        """Mark DM job as failed with error (only while worker_id still holds its lease, if given)"""
         try:
-            update_result = dm_generation_jobs_collection.update_one(
-                {"_id": ObjectId(job_id)},
+            query = {"_id": ObjectId(job_id)}
+            if worker_id:
+                query.update({"worker_id": worker_id, "status": "processing"})
+            
+            job = dm_generation_jobs_collection.find_one_and_update(
+                query,
                 {
                     "$set": {
                         "status": "failed",
                         "completed_at": datetime.utcnow(),
+                        "lease_expires_at": None,
                         "result": {
                             "success": False,
                             "error": error,
@@ -516,7 +1230,9 @@ class Database:
                     }
                 }
             )
-            return update_result.modified_count > 0
+            if job:
+                _publish_dm_job_event(job, "failed", error=error)
+            return job is not None
         except:
             return False
     
@@ -537,30 +1253,392 @@ class Database:
         except:
             return []
     
+    @staticmethod
+    def get_pending_dm_job_users() -> list:
+        """Summarize pending jobs per user: highest priority and the oldest job at that priority"""
+        try:
+            # Sorted like the (status, user_id, priority, created_at) index and grouped with $first only,
+            # MongoDB answers this with a DISTINCT_SCAN: one index seek per user, not a read of the backlog
+            return list(dm_generation_jobs_collection.aggregate([
+                {"$match": {"status": "pending"}},
+                {"$sort": {"user_id": 1, "priority": -1, "created_at": 1}},
+                {"$group": {
+                    "_id": "$user_id",
+                    "priority": {"$first": "$priority"},
+                    "oldest": {"$first": "$created_at"}
+                }}
+            ]))
+        except Exception as e:
+            print(f"Error summarizing pending DM jobs: {e}")
+            return []
+    
+    @staticmethod
+    def get_processing_dm_job_counts() -> Dict[Any, int]:
+        """Count jobs currently processing per user (across all workers)"""
+        try:
+            counts = dm_generation_jobs_collection.aggregate([
+                {"$match": {"status": "processing"}},
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+            ])
+            return {doc["_id"]: doc["count"] for doc in counts}
+        except Exception as e:
+            print(f"Error counting processing DM jobs: {e}")
+            return {}
+    
+    @staticmethod
+    def claim_next_dm_job(worker_id: str, lease_seconds: int, user_id: ObjectId = None) -> Optional[Dict[str, Any]]:
+        """Atomically move the next pending job (optionally for one user) to processing under a lease"""
+        try:
+            query = {"status": "pending"}
+            if user_id is not None:
+                query["user_id"] = user_id
+            
+            # find_one_and_update is atomic, so two workers never claim the same job
+            now = datetime.utcnow()
+            job = dm_generation_jobs_collection.find_one_and_update(
+                query,
+                {
+                    "$set": {
+                        "status": "processing",
+                        "worker_id": worker_id,
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        "heartbeat_at": now,
+                        "started_at": now,
+                        "updated_at": now
+                    },
+                    "$inc": {"attempts": 1}
+                },
+                sort=[("priority", -1), ("created_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if job:
+                _publish_dm_job_event(job, "processing")
+                job["_id"] = str(job["_id"])
+                job["user_id"] = str(job["user_id"])
+                job["project_id"] = str(job["project_id"])
+            return job
+        except Exception as e:
+            print(f"Error claiming DM job: {e}")
+            return None
+    
+    @staticmethod
+    def renew_dm_job_leases(job_ids: list, worker_id: str, lease_seconds: int) -> int:
+        """Heartbeat: extend the lease on jobs this worker is still processing"""
+        try:
+            now = datetime.utcnow()
+            result = dm_generation_jobs_collection.update_many(
+                {
+                    "_id": {"$in": [ObjectId(job_id) for job_id in job_ids]},
+                    "worker_id": worker_id,
+                    "status": "processing"
+                },
+                {
+                    "$set": {
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        "heartbeat_at": now
+                    }
+                }
+            )
+            return result.modified_count
+        except:
+            return 0
+    
+    @staticmethod
+    def mark_dm_job_credit_used(job_id: str) -> bool:
+        """Record that a credit was taken for this job, so retries do not charge again"""
+        try:
+            result = dm_generation_jobs_collection.update_one(
+                {"_id": ObjectId(job_id)},
+                {"$set": {"credit_used": True}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+    
+    @staticmethod
+    def refund_dm_job_credit(job_id: str, reason: str) -> bool:
+        """Refund the job's credit at most once. Returns True if this call refunded it."""
+        try:
+            # Flip the flag first; only the caller that wins the flip adds the credit back
+            job = dm_generation_jobs_collection.find_one_and_update(
+                {
+                    "_id": ObjectId(job_id),
+                    "credit_used": True,
+                    "credit_refunded": {"$ne": True}
+                },
+                {"$set": {"credit_refunded": True, "refunded_at": datetime.utcnow()}}
+            )
+            if not job:
+                return False
+            
+            return Database.add_credits(str(job["user_id"]), 1, reason)
+        except:
+            return False
+    
+    @staticmethod
+    def requeue_expired_dm_jobs(lease_seconds: int, max_attempts: int) -> Dict[str, int]:
+        """Reaper: put jobs with an expired lease back to pending, or fail them after max_attempts"""
+        counts = {"requeued": 0, "failed": 0}
+        now = datetime.utcnow()
+        expired = {
+            "status": "processing",
+            "$or": [
+                {"lease_expires_at": {"$lt": now}},
+                # Jobs claimed before leases existed
+                {"lease_expires_at": None, "started_at": {"$lt": now - timedelta(seconds=lease_seconds)}}
+            ]
+        }
+        
+        try:
+            # Jobs claimed before leases existed have no attempts or credit flags. They were claimed once,
+            # and the old worker charged the credit right after claiming, so a retry must not charge again
+            dm_generation_jobs_collection.update_many(
+                {**expired, "attempts": {"$exists": False}},
+                {"$set": {"attempts": 1}}
+            )
+            dm_generation_jobs_collection.update_many(
+                {**expired, "credit_used": {"$exists": False}},
+                {"$set": {"credit_used": True, "credit_refunded": False}}
+            )
+            
+            while True:
+                job = dm_generation_jobs_collection.find_one_and_update(
+                    {**expired, "attempts": {"$lt": max_attempts}},
+                    {
+                        "$set": {
+                            "status": "pending",
+                            "worker_id": None,
+                            "lease_expires_at": None,
+                            "updated_at": now
+                        }
+                    }
+                )
+                if not job:
+                    break
+                _publish_dm_job_event(job, "pending", requeued=True)
+                counts["requeued"] += 1
+            
+            while True:
+                job = dm_generation_jobs_collection.find_one({**expired, "attempts": {"$gte": max_attempts}})
+                if not job:
+                    break
+                
+                error = f"Job abandoned after {job.get('attempts', 0)} attempts"
+                if not Database.fail_dm_job(str(job["_id"]), error, worker_id=job.get("worker_id")):
+                    # Finished or re-claimed meanwhile; anything left is picked up next pass
+                    break
+                Database.refund_dm_job_credit(str(job["_id"]), "refund_abandoned_job")
+                counts["failed"] += 1
+            
+            return counts
+        except Exception as e:
+            print(f"Error requeueing expired DM jobs: {e}")
+            return counts
+    
     @staticmethod
     def delete_dm_job(job_id: str, user_id: str) -> bool:
         """Delete a DM job (only if pending and belongs to user)"""
         try:
-            result = dm_generation_jobs_collection.delete_one({
+            job = dm_generation_jobs_collection.find_one_and_delete({
                 "_id": ObjectId(job_id),
                 "user_id": ObjectId(user_id),
                 "status": "pending"
             })
-            return result.deleted_count > 0
+            if job:
+                _publish_dm_job_event(job, "cancelled")
+            return job is not None
         except:
             return False
     
     @staticmethod
-    def update_message(message_id: str, generated_message: str) -> bool:
-        """Update a message's content"""
+    def get_latest_dm_job_event_id() -> Optional[ObjectId]:
+        """Id of the newest job event, so subscribers only see events from now on"""
         try:
-            result = messages_collection.update_one(
-                {"_id": ObjectId(message_id)},
+            _ensure_dm_job_events_collection()
+            latest = dm_job_events_collection.find_one(sort=[("$natural", -1)])
+            return latest["_id"] if latest else None
+        except:
+            return None
+    
+    @staticmethod
+    def tail_dm_job_events(after_id: Optional[ObjectId] = None):
+        """Tailable cursor over job events newer than after_id; blocks waiting for new events"""
+        _ensure_dm_job_events_collection()
+        query = {"_id": {"$gt": after_id}} if after_id else {}
+        return dm_job_events_collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+    
+    # Instagram Profile Cache
+    @staticmethod
+    def get_cached_profile(username: str, max_age_seconds: int) -> Optional[Dict[str, Any]]:
+        """Get a cached filtered profile if it was fetched within max_age_seconds"""
+        try:
+            cached = instagram_profiles_collection.find_one({
+                "username": username.lower(),
+                "fetched_at": {"$gt": datetime.utcnow() - timedelta(seconds=max_age_seconds)}
+            })
+            return cached["profile"] if cached else None
+        except:
+            return None
+    
+    @staticmethod
+    def save_cached_profile(username: str, profile: Dict[str, Any]) -> bool:
+        """Store (or refresh) a filtered profile in the cache"""
+        try:
+            instagram_profiles_collection.update_one(
+                {"username": username.lower()},
+                {
+                    "$set": {
+                        "profile": profile,
+                        "fetched_at": datetime.utcnow()
+                    }
+                },
+                upsert=True
+            )
+            return True
+        except:
+            return False
+    
+    @staticmethod
+    def _format_message(message: Dict[str, Any]) -> Dict[str, Any]:
+        message["_id"] = str(message["_id"])
+        message["project_id"] = str(message["project_id"])
+        if message.get("user_id"):
+            message["user_id"] = str(message["user_id"])
+        return message
+    
+    @staticmethod
+    def get_project_message(project_id: str, message_id: str) -> Optional[Dict[str, Any]]:
+        """Get one message by ID, only if it belongs to the project (caller checks project ownership)"""
+        try:
+            message = messages_collection.find_one({
+                "_id": ObjectId(message_id),
+                "project_id": ObjectId(project_id)
+            })
+            return Database._format_message(message) if message else None
+        except Exception as e:
+            print(f"Error getting message: {e}")
+            return None
+    
+    @staticmethod
+    def update_message(project_id: str, message_id: str, generated_message: str) -> Optional[Dict[str, Any]]:
+        """Update a message's content in one round trip; returns the updated message, or None if it is not in the project"""
+        try:
+            message = messages_collection.find_one_and_update(
+                {"_id": ObjectId(message_id), "project_id": ObjectId(project_id)},
                 {
                     "$set": {
                         "generated_message": generated_message,
                         "updated_at": datetime.utcnow()
                     }
+                },
+                return_document=ReturnDocument.AFTER
+            )
+            if not message:
+                return None
+            Database.bump_content_version(project_id)
+            return Database._format_message(message)
+        except Exception as e:
+            print(f"Error updating message: {e}")
+            return None
+    
+    # Export Job Management (same pending -> processing -> completed/failed lifecycle as DM jobs)
+    @staticmethod
+    def _format_export_job(job: Dict[str, Any]) -> Dict[str, Any]:
+        job["_id"] = str(job["_id"])
+        job["user_id"] = str(job["user_id"])
+        job["project_id"] = str(job["project_id"])
+        if job.get("file_id"):
+            job["file_id"] = str(job["file_id"])
+        return job
+    
+    @staticmethod
+    def create_export_job(user_id: str, project_id: str, export_format: str, include_user_info: bool = False, notify_email: str = None) -> str:
+        """Create a pending export job; notify_email gets a message when the file is ready"""
+        job_doc = {
+            "user_id": ObjectId(user_id),
+            "project_id": ObjectId(project_id),
+            "format": export_format,
+            "include_user_info": include_user_info,
+            "notify_email": notify_email,
+            "status": "pending",  # pending, processing, completed, failed, expired
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "completed_at": None,
+            "attempts": 0,
+            "worker_id": None,
+            "lease_expires_at": None,
+            "file_id": None,  # GridFS id in the export_files bucket
+            "filename": None,
+            "row_count": None,
+            "size": None,
+            "expires_at": None,  # when the stored file is deleted
+            "error": None
+        }
+        result = export_jobs_collection.insert_one(job_doc)
+        return str(result.inserted_id)
+    
+    @staticmethod
+    def get_export_job(job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get an export job by ID (only if it belongs to user)"""
+        try:
+            job = export_jobs_collection.find_one({"_id": ObjectId(job_id), "user_id": ObjectId(user_id)})
+            return Database._format_export_job(job) if job else None
+        except:
+            return None
+    
+    @staticmethod
+    def claim_next_export_job(worker_id: str, lease_seconds: int) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest pending export job to processing under a lease"""
+        try:
+            now = datetime.utcnow()
+            job = export_jobs_collection.find_one_and_update(
+                {"status": "pending"},
+                {
+                    "$set": {
+                        "status": "processing",
+                        "worker_id": worker_id,
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        "started_at": now
+                    },
+                    "$inc": {"attempts": 1}
+                },
+                sort=[("created_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            return Database._format_export_job(job) if job else None
+        except Exception as e:
+            print(f"Error claiming export job: {e}")
+            return None
+    
+    @staticmethod
+    def renew_export_job_lease(job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        try:
+            result = export_jobs_collection.update_one(
+                {"_id": ObjectId(job_id), "worker_id": worker_id, "status": "processing"},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}}
+            )
+            return result.modified_count > 0
+        except:
+            return False
+    
+    @staticmethod
+    def complete_export_job(job_id: str, worker_id: str, file_id: ObjectId, filename: str, row_count: int, size: int, retention_seconds: int) -> bool:
+        """Mark an export job as completed with its stored file (only while worker_id holds its lease)"""
+        try:
+            now = datetime.utcnow()
+            result = export_jobs_collection.update_one(
+                {"_id": ObjectId(job_id), "worker_id": worker_id, "status": "processing"},
+                {
+                    "$set": {
+                        "status": "completed",
+                        "completed_at": now,
+                        "lease_expires_at": None,
+                        "file_id": file_id,
+                        "filename": filename,
+                        "row_count": row_count,
+                        "size": size,
+                        "expires_at": now + timedelta(seconds=retention_seconds)
+                    }
                 }
             )
             return result.modified_count > 0
@@ -568,14 +1646,139 @@ class Database:
             return False
     
     @staticmethod
-    def get_message_by_id(message_id: str) -> Optional[Dict[str, Any]]:
-        """Get a single message by ID"""
+    def fail_export_job(job_id: str, error: str, worker_id: str = None) -> bool:
+        """Mark an export job as failed (only while worker_id holds its lease, if given)"""
         try:
-            message = messages_collection.find_one({"_id": ObjectId(message_id)})
-            return message
+            query = {"_id": ObjectId(job_id)}
+            if worker_id:
+                query.update({"worker_id": worker_id, "status": "processing"})
+            
+            result = export_jobs_collection.update_one(
+                query,
+                {
+                    "$set": {
+                        "status": "failed",
+                        "completed_at": datetime.utcnow(),
+                        "lease_expires_at": None,
+                        "error": error
+                    }
+                }
+            )
+            return result.modified_count > 0
         except:
+            return False
+    
+    @staticmethod
+    def requeue_expired_export_jobs(max_attempts: int) -> Dict[str, int]:
+        """Reaper: retry export jobs whose worker died, failing them after max_attempts"""
+        try:
+            now = datetime.utcnow()
+            expired = {"status": "processing", "lease_expires_at": {"$lt": now}}
+            failed = export_jobs_collection.update_many(
+                {**expired, "attempts": {"$gte": max_attempts}},
+                {"$set": {"status": "failed", "completed_at": now, "lease_expires_at": None, "error": "Export abandoned after repeated worker failures"}}
+            )
+            requeued = export_jobs_collection.update_many(
+                expired,
+                {"$set": {"status": "pending", "worker_id": None, "lease_expires_at": None}}
+            )
+            return {"requeued": requeued.modified_count, "failed": failed.modified_count}
+        except Exception as e:
+            print(f"Error requeueing expired export jobs: {e}")
+            return {"requeued": 0, "failed": 0}
+    
+    @staticmethod
+    def save_export_file(path: str, filename: str, metadata: Dict[str, Any]) -> ObjectId:
+        """Upload a finished export file to GridFS in chunks"""
+        with open(path, "rb") as f:
+            return export_files_bucket.upload_from_stream(filename, f, metadata=metadata)
+    
+    @staticmethod
+    def delete_expired_export_files() -> int:
+        """Remove stored export files past their retention; returns files deleted"""
+        deleted = 0
+        try:
+            now = datetime.utcnow()
+            while True:
+                job = export_jobs_collection.find_one_and_update(
+                    {"status": "completed", "expires_at": {"$lt": now}},
+                    {"$set": {"status": "expired"}}
+                )
+                if not job:
+                    break
+                if job.get("file_id"):
+                    try:
+                        export_files_bucket.delete(job["file_id"])
+                    except Exception:
+                        # Already gone
+                        pass
+                deleted += 1
+            return deleted
+        except Exception as e:
+            print(f"Error deleting expired export files: {e}")
+            return deleted
+    
+    @staticmethod
+    def delete_export_jobs(query: Dict[str, Any], file_query: Dict[str, Any]) -> int:
+        """Delete export jobs matching query and their stored files, plus export_files matching file_query (uploads whose job has not completed yet)"""
+        deleted = 0
+        try:
+            for job in export_jobs_collection.find({**query, "file_id": {"$ne": None}}, {"file_id": 1}):
+                try:
+                    export_files_bucket.delete(job["file_id"])
+                except Exception:
+                    # Already gone
+                    pass
+            for stored in export_files_bucket.find(file_query):
+                export_files_bucket.delete(stored._id)
+            deleted = export_jobs_collection.delete_many(query).deleted_count
+            return deleted
+        except Exception as e:
+            print(f"Error deleting export jobs: {e}")
+            return deleted
+    
+    # Export Cache (GridFS files tagged with the project content version they were rendered from)
+    @staticmethod
+    def save_cached_export(path: str, filename: str, user_id: str, project_id: str, content_version: int, export_format: str, include_user_info: bool) -> Optional[ObjectId]:
+        """Store a rendered export for this content version and drop the ones it supersedes"""
+        try:
+            key = {
+                "metadata.project_id": ObjectId(project_id),
+                "metadata.format": export_format,
+                "metadata.include_user_info": include_user_info
+            }
+            with open(path, "rb") as f:
+                file_id = export_cache_bucket.upload_from_stream(
+                    filename,
+                    f,
+                    metadata={
+                        "user_id": ObjectId(user_id),
+                        "project_id": ObjectId(project_id),
+                        "content_version": content_version,
+                        "format": export_format,
+                        "include_user_info": include_user_info
+                    }
+                )
+            # An upload for an older version finishing late never removes a newer one
+            Database.delete_cached_exports({**key, "metadata.content_version": {"$lte": content_version}, "_id": {"$ne": file_id}})
+            return file_id
+        except Exception as e:
+            print(f"Error caching export: {e}")
             return None
     
+    @staticmethod
+    def delete_cached_exports(query: Dict[str, Any]) -> int:
+        """Delete cached export files matching a query on the export_cache.files collection"""
+        deleted = 0
+        try:
+            for cached in export_cache_bucket.find(query):
+                export_cache_bucket.delete(cached._id)
+                deleted += 1
+            return deleted
+        except Exception as e:
+            print(f"Error deleting cached exports: {e}")
+            return deleted
+    
     @staticmethod
     def delete_account_immediately(user_id: str) -> bool:
         """Permanently delete user account and all associated data immediately"""
@@ -597,6 +1800,18 @@ class Database:
             # Delete user's payment transactions
             payment_transactions_collection.delete_many({"user_id": user_object_id})
             
+            # Delete user's refresh tokens (sessions)
+            refresh_tokens_collection.delete_many({"user_id": user_object_id})
+            
+            # Drop leads-ready notices still waiting for a digest
+            email_digest_events_collection.delete_many({"kind": "leads_ready", "data.user_id": user_id})
+            
+            # Delete cached exports of the user's projects
+            Database.delete_cached_exports({"metadata.user_id": user_object_id})
+            
+            # Delete export jobs and their stored files
+            Database.delete_export_jobs({"user_id": user_object_id}, {"metadata.user_id": user_id})
+            
             # Note: No subscription data to delete since we only use one-time payments
             
             # Finally, delete the user account itself
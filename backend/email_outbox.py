@@ -0,0 +1,184 @@
+from backend.database import Database
+from backend.email_service import send_message, send_admin_signup_digest, send_leads_ready_emails
+from backend.email_transport import close_email_transport
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+load_dotenv()
+
+# Emails a dispatcher sends at once
+EMAIL_DISPATCH_CONCURRENCY = int(os.getenv("EMAIL_DISPATCH_CONCURRENCY", "10"))
+# How long a claimed email belongs to its dispatcher (a send with retries is well under this)
+EMAIL_DISPATCH_LEASE_SECONDS = int(os.getenv("EMAIL_DISPATCH_LEASE_SECONDS", "120"))
+# Sends per email before it is dead-lettered; each attempt already includes the transport's quick retries
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+# Wait before the second attempt; doubles per attempt after that
+EMAIL_RETRY_BACKOFF_SECONDS = float(os.getenv("EMAIL_RETRY_BACKOFF_SECONDS", "30"))
+# How often run_worker.py looks for due emails
+EMAIL_DISPATCH_POLL_SECONDS = float(os.getenv("EMAIL_DISPATCH_POLL_SECONDS", "2"))
+# Set to false when run_worker.py dispatches email; follows DM_INLINE_JOBS by default
+EMAIL_INLINE_DISPATCH = os.getenv("EMAIL_INLINE_DISPATCH", os.getenv("DM_INLINE_JOBS", "true")).lower() == "true"
+# With inline dispatch, how often the web process dispatches without a request to trigger it (digests, retries)
+EMAIL_INLINE_POLL_SECONDS = float(os.getenv("EMAIL_INLINE_POLL_SECONDS", "30"))
+# Admin signup and leads-ready notices are collected and sent as one digest per interval; 0 sends them every dispatch pass
+EMAIL_DIGEST_INTERVAL_SECONDS = float(os.getenv("EMAIL_DIGEST_INTERVAL_SECONDS", "600"))
+
+_stats = {"sent": 0, "retried": 0, "dead_lettered": 0, "digests": 0, "digested_events": 0}
+
+
+async def send_outbox_email(email: Dict[str, Any]) -> bool:
+    """Send one claimed email, then mark it sent, schedule a retry or dead-letter it"""
+    try:
+        sent = await send_message(email["message"])
+        error = None if sent else "Transport rejected or failed to deliver the message"
+    except Exception as e:
+        sent = False
+        error = f"Send error: {str(e)}"
+
+    if sent:
+        _stats["sent"] += 1
+        await asyncio.to_thread(Database.mark_email_sent, email["_id"], email["worker_id"])
+        return True
+
+    if email["attempts"] >= EMAIL_MAX_ATTEMPTS:
+        _stats["dead_lettered"] += 1
+        logging.error(f"Dead-lettering {email['kind']} email {email['_id']} to {email['message']['to']} after {email['attempts']} attempts: {error}")
+        await asyncio.to_thread(Database.dead_letter_email, email["_id"], email["worker_id"], error)
+        return False
+
+    _stats["retried"] += 1
+    backoff = EMAIL_RETRY_BACKOFF_SECONDS * (2 ** (email["attempts"] - 1))
+    await asyncio.to_thread(
+        Database.retry_email, email["_id"], email["worker_id"], error, datetime.utcnow() + timedelta(seconds=backoff)
+    )
+    return False
+
+async def send_admin_signup_digest_events(events: List[Dict[str, Any]]) -> bool:
+    return await send_admin_signup_digest([{**event["data"], "created_at": event["created_at"]} for event in events])
+
+async def send_leads_ready_digest_events(events: List[Dict[str, Any]]) -> bool:
+    """One leads-ready email per user, covering every batch of theirs that finished since the last digest"""
+    per_user = {}
+    for event in events:
+        data = event["data"]
+        project = await asyncio.to_thread(Database.get_project_by_id, data["project_id"], data["user_id"])
+        if not project:
+            # Deleted since the batch finished
+            continue
+        entry = per_user.setdefault(data["user_id"], {"project_names": [], "lead_count": 0})
+        if project["name"] not in entry["project_names"]:
+            entry["project_names"].append(project["name"])
+        entry["lead_count"] += data["lead_count"]
+
+    recipients = []
+    for user_id, entry in per_user.items():
+        user = await asyncio.to_thread(Database.get_user_by_id, user_id)
+        if user:
+            recipients.append({
+                "email": user["email"],
+                "project_name": ", ".join(entry["project_names"]),
+                "lead_count": entry["lead_count"]
+            })
+
+    if not recipients:
+        return True
+    return await send_leads_ready_emails(recipients)
+
+DIGEST_SENDERS = {
+    "admin_signup": send_admin_signup_digest_events,
+    "leads_ready": send_leads_ready_digest_events
+}
+
+async def send_due_digests() -> int:
+    """Queue the digest email(s) for every kind whose interval has passed; returns how many events they covered"""
+    digested = 0
+    for kind, send_digest in DIGEST_SENDERS.items():
+        # One process wins each interval; the rest skip until the next one
+        if not await asyncio.to_thread(Database.claim_digest_run, kind, EMAIL_DIGEST_INTERVAL_SECONDS):
+            continue
+
+        digest_id = uuid.uuid4().hex
+        events = await asyncio.to_thread(Database.claim_digest_events, kind, digest_id)
+        if not events:
+            continue
+
+        try:
+            queued = await send_digest(events)
+        except Exception as e:
+            logging.error(f"Failed to build {kind} digest: {str(e)}")
+            queued = False
+
+        if not queued:
+            # Leave the events for the next digest rather than dropping them
+            await asyncio.to_thread(Database.release_digest_events, digest_id)
+            continue
+
+        _stats["digests"] += 1
+        _stats["digested_events"] += len(events)
+        digested += len(events)
+    return digested
+
+async def dispatch_pending_emails(worker_id: str) -> int:
+    """Queue due digests, then send every due email, EMAIL_DISPATCH_CONCURRENCY at a time; returns how many were sent"""
+    requeued = await asyncio.to_thread(Database.requeue_expired_emails)
+    if requeued:
+        logging.warning(f"Requeued {requeued} emails whose dispatcher died")
+
+    await send_due_digests()
+
+    sent = 0
+    while True:
+        batch = []
+        for _ in range(EMAIL_DISPATCH_CONCURRENCY):
+            email = await asyncio.to_thread(Database.claim_next_email, worker_id, EMAIL_DISPATCH_LEASE_SECONDS)
+            if not email:
+                break
+            batch.append(email)
+
+        if not batch:
+            return sent
+
+        results = await asyncio.gather(*(send_outbox_email(email) for email in batch))
+        sent += sum(results)
+
+async def run_inline_dispatcher(worker_id: str) -> None:
+    """Dispatch loop for the web process when run_worker.py is not sending email"""
+    while True:
+        await asyncio.sleep(EMAIL_INLINE_POLL_SECONDS)
+        try:
+            await dispatch_pending_emails(worker_id)
+        except Exception as e:
+            logging.error(f"Inline email dispatch failed: {str(e)}")
+
+def email_outbox_stats() -> Dict[str, Any]:
+    return dict(_stats)
+
+async def dispatch_once() -> int:
+    try:
+        return await dispatch_pending_emails(f"cli:{socket.gethostname()}:{os.getpid()}")
+    finally:
+        await close_email_transport()
+
+def main():
+    parser = argparse.ArgumentParser(description="DMify email outbox")
+    parser.add_argument("--dispatch-once", action="store_true", help="send every due email and exit")
+    parser.add_argument("--retry-dead", action="store_true", help="requeue dead-lettered emails with fresh attempts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.retry_dead:
+        print(f"Requeued {Database.retry_dead_emails()} dead-lettered emails")
+    if args.dispatch_once:
+        print(f"Sent {asyncio.run(dispatch_once())} emails")
+    if not args.retry_dead and not args.dispatch_once:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
-import requests
 import os
+import html
+import json
 import logging
-from typing import Optional
+from datetime import datetime
+from typing import Optional, List, Dict, Any
 from jinja2 import Environment, BaseLoader
 from dotenv import load_dotenv
+from backend.email_transport import get_email_transport, EMAIL_TRANSPORT
+from backend.async_database import AsyncDatabase
 
 load_dotenv()
 
@@ -12,13 +16,19 @@ DOMAIN = "dmify.app"
 FROM_EMAIL = f"DMify <postmaster@{DOMAIN}>"
 FRONTEND_URL = os.getenv("FRONTEND_URL", "https://dmify.app")
 ADMIN_EMAIL = "shashi.optimizestudio@gmail.com"
+# Send before returning instead of queueing in email_outbox (tests and scripts without a dispatcher)
+EMAIL_OUTBOX_SYNC = os.getenv("EMAIL_OUTBOX_SYNC", "false").lower() == "true"
+# Mailgun's limit on recipients per batch send
+MAILGUN_BATCH_MAX_RECIPIENTS = 1000
 
-if not EMAIL_SENDING_KEY:
+if EMAIL_TRANSPORT == "fake":
+    logging.info("EMAIL_TRANSPORT=fake: emails are recorded in memory, not sent")
+elif not EMAIL_SENDING_KEY:
     logging.error("EMAIL_SENDING_KEY environment variable not found!")
 else:
     logging.info(f"EMAIL_SENDING_KEY loaded successfully (length: {len(EMAIL_SENDING_KEY)})")
 
-template_env = Environment(loader=BaseLoader())
+template_env = Environment(loader=BaseLoader(), autoescape=True)
 
 verification_template = """
 <!DOCTYPE html>
@@ -205,43 +215,49 @@ reset_password_template = """
 </html>
 """
 
+def build_message(to_email: str, subject: str, html_content: str) -> dict:
+    return {
+        "from": FROM_EMAIL,
+        "to": to_email,
+        "subject": subject,
+        "html": html_content
+    }
+
+def build_batch_message(recipient_variables: Dict[str, Dict[str, str]], subject: str, html_content: str) -> dict:
+    """One Mailgun call for many recipients; each gets their own copy with %recipient.<key>% filled in"""
+    return {
+        "from": FROM_EMAIL,
+        "to": ", ".join(recipient_variables),
+        "subject": subject,
+        "html": html_content,
+        "recipient-variables": json.dumps(recipient_variables)
+    }
+
+async def send_message(message: dict) -> bool:
+    # Pooled async client (or the fake transport); retries transient failures itself
+    sent = await get_email_transport(DOMAIN, EMAIL_SENDING_KEY).send(message)
+    if sent:
+        logging.info(f"Email sent successfully to {message['to']}")
+    return sent
+
 async def send_email_mailgun(to_email: str, subject: str, html_content: str) -> bool:
-    try:
-        url = f"https://api.mailgun.net/v3/{DOMAIN}/messages"
-        
-        data = {
-            "from": FROM_EMAIL,
-            "to": to_email,
-            "subject": subject,
-            "html": html_content
-        }
-        
-        response = requests.post(
-            url,
-            auth=("api", EMAIL_SENDING_KEY),
-            data=data,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            logging.info(f"Email sent successfully to {to_email}")
-            return True
-        else:
-            logging.error(f"Failed to send email to {to_email}. Status: {response.status_code}, Response: {response.text}")
-            return False
-            
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request error sending email to {to_email}: {str(e)}")
-        return False
-    except Exception as e:
-        logging.error(f"Unexpected error sending email to {to_email}: {str(e)}")
-        return False
+    return await send_message(build_message(to_email, subject, html_content))
+
+async def deliver_message(kind: str, message: dict) -> bool:
+    """Queue a built message for the outbox dispatcher; True once it is queued (or sent, with EMAIL_OUTBOX_SYNC)"""
+    if EMAIL_OUTBOX_SYNC:
+        return await send_message(message)
+    
+    return await AsyncDatabase.enqueue_email(kind, message) is not None
+
+async def deliver_email(kind: str, to_email: str, subject: str, html_content: str) -> bool:
+    return await deliver_message(kind, build_message(to_email, subject, html_content))
 
 async def send_verification_email(email: str, verification_code: str) -> bool:
-    template = template_env.from_string(verification_template)
-    html_content = template.render(verification_code=verification_code)
+    html_content = render_template("verification", verification_code=verification_code)
     
-    return await send_email_mailgun(
+    return await deliver_email(
+        kind="verification",
         to_email=email,
         subject="Verify Your Email - DMify",
         html_content=html_content
@@ -249,153 +265,179 @@ async def send_verification_email(email: str, verification_code: str) -> bool:
 
 async def send_password_reset_email(email: str, token: str) -> bool:
     reset_url = f"{FRONTEND_URL}/reset-password?token={token}"
-    template = template_env.from_string(reset_password_template)
-    html_content = template.render(reset_url=reset_url)
+    html_content = render_template("reset_password", reset_url=reset_url)
     
-    return await send_email_mailgun(
+    return await deliver_email(
+        kind="password_reset",
         to_email=email,
         subject="Reset Your Password - DMify",
         html_content=html_content
     )
 
-async def send_leads_ready_email(email: str, project_name: str, lead_count: int) -> bool:
-    subject = f"🎉 Your leads are ready for '{project_name}'"
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Your Leads Are Ready - DMify</title>
-        <style>
-            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap');
-            
-            .gradient-bg {{
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            }}
+# Leads ready template; batch sends render it once with Mailgun %recipient.*% placeholders
+leads_ready_template = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Your Leads Are Ready - DMify</title>
+    <style>
+        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap');
+        
+        .gradient-bg {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+        }
+        
+        .glass-effect {
+            background: rgba(255, 255, 255, 0.95);
+            backdrop-filter: blur(10px);
+            border: 1px solid rgba(255, 255, 255, 0.2);
+        }
+        
+        .electric-blue { color: #4F46E5; }
+        .neon-purple { color: #7C3AED; }
+    </style>
+</head>
+<body style="margin: 0; padding: 0; font-family: 'Inter', Arial, sans-serif; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); min-height: 100vh;">
+    <div style="max-width: 600px; margin: 0 auto; padding: 40px 20px;">
+        <!-- Main Container -->
+        <div style="background: rgba(255, 255, 255, 0.95); backdrop-filter: blur(10px); border-radius: 24px; padding: 40px; box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.25);">
             
-            .glass-effect {{
-                background: rgba(255, 255, 255, 0.95);
-                backdrop-filter: blur(10px);
-                border: 1px solid rgba(255, 255, 255, 0.2);
-            }}
+            <!-- Header with Logo -->
+            <div style="text-align: center; margin-bottom: 40px;">
+                <img src="https://dmify.app/dmifylogo.png" alt="DMify" style="height: 48px; margin-bottom: 20px;">
+                <h1 style="margin: 0; font-size: 32px; font-weight: 800; background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); -webkit-background-clip: text; -webkit-text-fill-color: transparent; background-clip: text;">
+                    🎉 Your Leads Are Ready!
+                </h1>
+            </div>
             
-            .electric-blue {{ color: #4F46E5; }}
-            .neon-purple {{ color: #7C3AED; }}
-        </style>
-    </head>
-    <body style="margin: 0; padding: 0; font-family: 'Inter', Arial, sans-serif; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); min-height: 100vh;">
-        <div style="max-width: 600px; margin: 0 auto; padding: 40px 20px;">
-            <!-- Main Container -->
-            <div style="background: rgba(255, 255, 255, 0.95); backdrop-filter: blur(10px); border-radius: 24px; padding: 40px; box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.25);">
+            <!-- Content -->
+            <div style="text-align: center; margin-bottom: 40px;">
+                <p style="font-size: 18px; color: #6B7280; margin-bottom: 30px; line-height: 1.6;">
+                    Great news! We've successfully processed your lead generation request and your personalized DMs are ready.
+                </p>
                 
-                <!-- Header with Logo -->
-                <div style="text-align: center; margin-bottom: 40px;">
-                    <img src="https://dmify.app/dmifylogo.png" alt="DMify" style="height: 48px; margin-bottom: 20px;">
-                    <h1 style="margin: 0; font-size: 32px; font-weight: 800; background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); -webkit-background-clip: text; -webkit-text-fill-color: transparent; background-clip: text;">
-                        🎉 Your Leads Are Ready!
-                    </h1>
+                <!-- Project Card -->
+                <div style="background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); border-radius: 16px; padding: 30px; margin: 30px 0; color: white; box-shadow: 0 10px 25px -5px rgba(79, 70, 229, 0.4);">
+                    <h2 style="margin: 0 0 15px 0; font-size: 24px; font-weight: 700;">
+                        {{ project_name }}
+                    </h2>
+                    <div style="font-size: 36px; font-weight: 800; margin: 20px 0;">
+                        {{ lead_count }} Messages Generated
+                    </div>
+                    <p style="margin: 0; opacity: 0.9; font-size: 16px;">
+                        Ready for your outreach campaigns
+                    </p>
                 </div>
                 
-                <!-- Content -->
-                <div style="text-align: center; margin-bottom: 40px;">
-                    <p style="font-size: 18px; color: #6B7280; margin-bottom: 30px; line-height: 1.6;">
-                        Great news! We've successfully processed your lead generation request and your personalized DMs are ready.
-                    </p>
-                    
-                    <!-- Project Card -->
-                    <div style="background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); border-radius: 16px; padding: 30px; margin: 30px 0; color: white; box-shadow: 0 10px 25px -5px rgba(79, 70, 229, 0.4);">
-                        <h2 style="margin: 0 0 15px 0; font-size: 24px; font-weight: 700;">
-                            {project_name}
-                        </h2>
-                        <div style="font-size: 36px; font-weight: 800; margin: 20px 0;">
-                            {lead_count} Messages Generated
-                        </div>
-                        <p style="margin: 0; opacity: 0.9; font-size: 16px;">
-                            Ready for your outreach campaigns
-                        </p>
-                    </div>
-                    
-                    <!-- Features List -->
-                    <div style="text-align: left; background: #F9FAFB; border-radius: 16px; padding: 30px; margin: 30px 0;">
-                        <h3 style="margin: 0 0 20px 0; font-size: 20px; font-weight: 700; color: #1F2937;">
-                            What you can do now:
-                        </h3>
-                        <div style="space-y: 15px;">
-                            <div style="display: flex; align-items: center; margin-bottom: 15px;">
-                                <div style="background: #10B981; border-radius: 50%; width: 24px; height: 24px; display: flex; align-items: center; justify-content: center; margin-right: 15px;">
-                                    <span style="color: white; font-weight: bold; font-size: 14px;">✓</span>
-                                </div>
-                                <span style="color: #374151; font-size: 16px;">View and analyze your personalized messages</span>
+                <!-- Features List -->
+                <div style="text-align: left; background: #F9FAFB; border-radius: 16px; padding: 30px; margin: 30px 0;">
+                    <h3 style="margin: 0 0 20px 0; font-size: 20px; font-weight: 700; color: #1F2937;">
+                        What you can do now:
+                    </h3>
+                    <div style="space-y: 15px;">
+                        <div style="display: flex; align-items: center; margin-bottom: 15px;">
+                            <div style="background: #10B981; border-radius: 50%; width: 24px; height: 24px; display: flex; align-items: center; justify-content: center; margin-right: 15px;">
+                                <span style="color: white; font-weight: bold; font-size: 14px;">✓</span>
                             </div>
-                            <div style="display: flex; align-items: center; margin-bottom: 15px;">
-                                <div style="background: #10B981; border-radius: 50%; width: 24px; height: 24px; display: flex; align-items: center; justify-content: center; margin-right: 15px;">
-                                    <span style="color: white; font-weight: bold; font-size: 14px;">✓</span>
-                                </div>
-                                <span style="color: #374151; font-size: 16px;">Copy messages for your Instagram outreach</span>
+                            <span style="color: #374151; font-size: 16px;">View and analyze your personalized messages</span>
+                        </div>
+                        <div style="display: flex; align-items: center; margin-bottom: 15px;">
+                            <div style="background: #10B981; border-radius: 50%; width: 24px; height: 24px; display: flex; align-items: center; justify-content: center; margin-right: 15px;">
+                                <span style="color: white; font-weight: bold; font-size: 14px;">✓</span>
                             </div>
-                            <div style="display: flex; align-items: center;">
-                                <div style="background: #10B981; border-radius: 50%; width: 24px; height: 24px; display: flex; align-items: center; justify-content: center; margin-right: 15px;">
-                                    <span style="color: white; font-weight: bold; font-size: 14px;">✓</span>
-                                </div>
-                                <span style="color: #374151; font-size: 16px;">Start converting prospects into customers</span>
+                            <span style="color: #374151; font-size: 16px;">Copy messages for your Instagram outreach</span>
+                        </div>
+                        <div style="display: flex; align-items: center;">
+                            <div style="background: #10B981; border-radius: 50%; width: 24px; height: 24px; display: flex; align-items: center; justify-content: center; margin-right: 15px;">
+                                <span style="color: white; font-weight: bold; font-size: 14px;">✓</span>
                             </div>
+                            <span style="color: #374151; font-size: 16px;">Start converting prospects into customers</span>
                         </div>
                     </div>
                 </div>
-                
-                <!-- CTA Section -->
-                <div style="text-align: center; margin-bottom: 30px;">
-                    <a href="{FRONTEND_URL}/app/dashboard" style="display: inline-block; background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); color: white; text-decoration: none; padding: 18px 40px; border-radius: 12px; font-weight: 600; font-size: 18px; box-shadow: 0 4px 14px 0 rgba(79, 70, 229, 0.4); transition: all 0.3s ease;">
-                        View My Messages →
-                    </a>
-                </div>
-                
-                <!-- Success Message -->
-                <div style="background: #ECFDF5; border: 1px solid #10B981; border-radius: 12px; padding: 20px; margin-bottom: 30px;">
-                    <div style="display: flex; align-items: center; margin-bottom: 10px;">
-                        <div style="background: #10B981; border-radius: 50%; width: 24px; height: 24px; display: flex; align-items: center; justify-content: center; margin-right: 12px;">
-                            <span style="color: white; font-weight: bold; font-size: 14px;">✓</span>
-                        </div>
-                        <p style="font-size: 16px; font-weight: 600; color: #065F46; margin: 0;">
-                            Ready to Scale Your Outreach
-                        </p>
+            </div>
+            
+            <!-- CTA Section -->
+            <div style="text-align: center; margin-bottom: 30px;">
+                <a href="{{ frontend_url }}/app/dashboard" style="display: inline-block; background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); color: white; text-decoration: none; padding: 18px 40px; border-radius: 12px; font-weight: 600; font-size: 18px; box-shadow: 0 4px 14px 0 rgba(79, 70, 229, 0.4); transition: all 0.3s ease;">
+                    View My Messages →
+                </a>
+            </div>
+            
+            <!-- Success Message -->
+            <div style="background: #ECFDF5; border: 1px solid #10B981; border-radius: 12px; padding: 20px; margin-bottom: 30px;">
+                <div style="display: flex; align-items: center; margin-bottom: 10px;">
+                    <div style="background: #10B981; border-radius: 50%; width: 24px; height: 24px; display: flex; align-items: center; justify-content: center; margin-right: 12px;">
+                        <span style="color: white; font-weight: bold; font-size: 14px;">✓</span>
                     </div>
-                    <p style="font-size: 14px; color: #065F46; margin: 0; line-height: 1.5;">
-                        Your AI-powered messages are crafted to get responses. Time to turn prospects into customers!
-                    </p>
-                </div>
-                
-                <!-- Footer -->
-                <div style="border-top: 1px solid #E5E7EB; padding-top: 30px; text-align: center;">
-                    <p style="font-size: 14px; color: #9CA3AF; margin: 0;">
-                        Best regards,<br>
-                        <strong style="color: #4F46E5;">The DMify Team</strong><br>
-                        <em>Powering your Instagram outreach with AI</em>
-                    </p>
-                    <p style="font-size: 14px; color: #9CA3AF; margin: 15px 0 0 0;">
-                        Questions? <a href="mailto:support@dmify.app" style="color: #4F46E5; text-decoration: none;">Contact our support team</a>
+                    <p style="font-size: 16px; font-weight: 600; color: #065F46; margin: 0;">
+                        Ready to Scale Your Outreach
                     </p>
                 </div>
+                <p style="font-size: 14px; color: #065F46; margin: 0; line-height: 1.5;">
+                    Your AI-powered messages are crafted to get responses. Time to turn prospects into customers!
+                </p>
             </div>
             
-            <!-- Bottom Footer -->
-            <div style="text-align: center; margin-top: 30px;">
-                <p style="font-size: 14px; color: rgba(255, 255, 255, 0.8); margin: 0;">
-                    © 2024 DMify - AI-Powered Instagram DM Automation
+            <!-- Footer -->
+            <div style="border-top: 1px solid #E5E7EB; padding-top: 30px; text-align: center;">
+                <p style="font-size: 14px; color: #9CA3AF; margin: 0;">
+                    Best regards,<br>
+                    <strong style="color: #4F46E5;">The DMify Team</strong><br>
+                    <em>Powering your Instagram outreach with AI</em>
+                </p>
+                <p style="font-size: 14px; color: #9CA3AF; margin: 15px 0 0 0;">
+                    Questions? <a href="mailto:support@dmify.app" style="color: #4F46E5; text-decoration: none;">Contact our support team</a>
                 </p>
             </div>
         </div>
-    </body>
-    </html>
+        
+        <!-- Bottom Footer -->
+        <div style="text-align: center; margin-top: 30px;">
+            <p style="font-size: 14px; color: rgba(255, 255, 255, 0.8); margin: 0;">
+                © 2024 DMify - AI-Powered Instagram DM Automation
+            </p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+async def send_leads_ready_emails(recipients: List[Dict[str, Any]]) -> bool:
     """
+    Tell users their DM batches finished, one Mailgun batch call per MAILGUN_BATCH_MAX_RECIPIENTS
     
-    return await send_email_mailgun(
-        to_email=email,
-        subject=subject,
-        html_content=html_content
+    recipients: [{"email", "project_name", "lead_count"}], at most one entry per email
+    """
+    html_content = render_template(
+        "leads_ready",
+        project_name="%recipient.project_name%",
+        lead_count="%recipient.lead_count%",
+        frontend_url=FRONTEND_URL
     )
+    # The subject is plain text, so it gets the unescaped name
+    subject = "🎉 Your leads are ready for '%recipient.project_title%'"
+    
+    queued = True
+    for start in range(0, len(recipients), MAILGUN_BATCH_MAX_RECIPIENTS):
+        chunk = recipients[start:start + MAILGUN_BATCH_MAX_RECIPIENTS]
+        # Mailgun substitutes these raw, so escape them here like the template would
+        recipient_variables = {
+            recipient["email"]: {
+                "project_name": html.escape(recipient["project_name"]),
+                "project_title": recipient["project_name"],
+                "lead_count": str(recipient["lead_count"])
+            }
+            for recipient in chunk
+        }
+        message = build_batch_message(recipient_variables, subject, html_content)
+        queued = await deliver_message("leads_ready", message) and queued
+    return queued
+
+async def send_leads_ready_email(email: str, project_name: str, lead_count: int) -> bool:
+    return await send_leads_ready_emails([{"email": email, "project_name": project_name, "lead_count": lead_count}])
 
 # Admin notification template for new user signups
 admin_notification_template = """
@@ -499,25 +541,216 @@ admin_notification_template = """
 async def send_admin_signup_notification(user_name: str, user_email: str) -> bool:
     """Send admin notification when a new user signs up"""
     try:
-        from datetime import datetime
-        
         # Format current time
         signup_time = datetime.utcnow().strftime("%B %d, %Y at %I:%M %p UTC")
         
         # Render template
-        template = template_env.from_string(admin_notification_template)
-        html_content = template.render(
+        html_content = render_template(
+            "admin_signup",
             user_name=user_name,
             user_email=user_email,
             signup_time=signup_time
         )
         
         # Send notification to admin
-        return await send_email_mailgun(
+        return await deliver_email(
+            kind="admin_signup",
             to_email=ADMIN_EMAIL,
             subject=f"🎉 New DMify Signup: {user_name}",
             html_content=html_content
         )
     except Exception as e:
         logging.error(f"Failed to send admin signup notification: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+# Admin digest template: every signup since the last digest in one email
+admin_signup_digest_template = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>New User Signups - DMify</title>
+</head>
+<body style="margin: 0; padding: 0; font-family: 'Inter', Arial, sans-serif; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); min-height: 100vh;">
+    <div style="max-width: 600px; margin: 0 auto; padding: 40px 20px;">
+        <!-- Main Container -->
+        <div style="background: rgba(255, 255, 255, 0.95); border-radius: 24px; padding: 40px; box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.25);">
+
+            <!-- Header with Logo -->
+            <div style="text-align: center; margin-bottom: 40px;">
+                <img src="https://dmify.app/dmifylogo.png" alt="DMify" style="height: 48px; margin-bottom: 20px;">
+                <h1 style="margin: 0; font-size: 28px; font-weight: 800; color: #4F46E5;">
+                    🎉 {{ signups | length }} New User Signups!
+                </h1>
+            </div>
+
+            <!-- User Details -->
+            <div style="background: #F9FAFB; border: 1px solid #E5E7EB; border-radius: 12px; padding: 24px; margin: 30px 0;">
+                <table style="width: 100%; border-collapse: collapse; font-size: 14px; color: #374151;">
+                    <tr>
+                        <th style="text-align: left; padding: 8px 0; color: #4F46E5;">Name</th>
+                        <th style="text-align: left; padding: 8px 0; color: #4F46E5;">Email</th>
+                        <th style="text-align: left; padding: 8px 0; color: #4F46E5;">Signup Time</th>
+                    </tr>
+                    {% for signup in signups %}
+                    <tr style="border-top: 1px solid #E5E7EB;">
+                        <td style="padding: 8px 8px 8px 0;">{{ signup.user_name }}</td>
+                        <td style="padding: 8px 8px 8px 0;"><a href="mailto:{{ signup.user_email }}" style="color: #4F46E5;">{{ signup.user_email }}</a></td>
+                        <td style="padding: 8px 0;">{{ signup.signup_time }}</td>
+                    </tr>
+                    {% endfor %}
+                </table>
+            </div>
+
+            <!-- Quick Actions -->
+            <div style="text-align: center; margin: 40px 0;">
+                <a href="https://dmify.app/app/dashboard" style="display: inline-block; background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); color: white; text-decoration: none; padding: 16px 32px; border-radius: 12px; font-weight: 600; font-size: 16px;">
+                    View Dashboard
+                </a>
+            </div>
+
+            <!-- Footer -->
+            <div style="border-top: 1px solid #E5E7EB; padding-top: 30px; text-align: center;">
+                <p style="font-size: 14px; color: #9CA3AF; margin: 10px 0 0 0;">
+                    DMify Admin Notification System
+                </p>
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+async def record_admin_signup(user_name: str, user_email: str) -> bool:
+    """Record a signup for the next admin digest instead of emailing the admin right away"""
+    return await AsyncDatabase.record_digest_event("admin_signup", {"user_name": user_name, "user_email": user_email}) is not None
+
+async def send_admin_signup_digest(signups: List[Dict[str, Any]]) -> bool:
+    """
+    One admin email for every signup since the last digest
+
+    signups: [{"user_name", "user_email", "created_at"}], oldest first
+    """
+    if not signups:
+        return True
+
+    if len(signups) == 1:
+        signup = signups[0]
+        html_content = render_template(
+            "admin_signup",
+            user_name=signup["user_name"],
+            user_email=signup["user_email"],
+            signup_time=signup["created_at"].strftime("%B %d, %Y at %I:%M %p UTC")
+        )
+        subject = f"🎉 New DMify Signup: {signup['user_name']}"
+    else:
+        html_content = render_template(
+            "admin_signup_digest",
+            signups=[
+                {**signup, "signup_time": signup["created_at"].strftime("%B %d, %Y at %I:%M %p UTC")}
+                for signup in signups
+            ]
+        )
+        subject = f"🎉 {len(signups)} New DMify Signups"
+
+    return await deliver_email(
+        kind="admin_signup",
+        to_email=ADMIN_EMAIL,
+        subject=subject,
+        html_content=html_content
+    )
+
+# Export ready template for background exports
+export_ready_template = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Your Export Is Ready - DMify</title>
+</head>
+<body style="margin: 0; padding: 0; font-family: 'Inter', Arial, sans-serif; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); min-height: 100vh;">
+    <div style="max-width: 600px; margin: 0 auto; padding: 40px 20px;">
+        <!-- Main Container -->
+        <div style="background: rgba(255, 255, 255, 0.95); backdrop-filter: blur(10px); border-radius: 24px; padding: 40px; box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.25);">
+            
+            <!-- Header with Logo -->
+            <div style="text-align: center; margin-bottom: 40px;">
+                <img src="https://dmify.app/dmifylogo.png" alt="DMify" style="height: 48px; margin-bottom: 20px;">
+                <h1 style="margin: 0; font-size: 32px; font-weight: 800; background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); -webkit-background-clip: text; -webkit-text-fill-color: transparent; background-clip: text;">
+                    Your Export Is Ready
+                </h1>
+            </div>
+            
+            <!-- Project Card -->
+            <div style="background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); border-radius: 16px; padding: 30px; margin: 30px 0; color: white; text-align: center; box-shadow: 0 10px 25px -5px rgba(79, 70, 229, 0.4);">
+                <h2 style="margin: 0 0 15px 0; font-size: 24px; font-weight: 700;">
+                    {{ project_name }}
+                </h2>
+                <div style="font-size: 28px; font-weight: 800; margin: 20px 0;">
+                    {{ row_count }} Messages &middot; {{ export_format | upper }}
+                </div>
+                <p style="margin: 0; opacity: 0.9; font-size: 16px;">
+                    Available to download for {{ retention_hours }} hours
+                </p>
+            </div>
+            
+            <!-- CTA Section -->
+            <div style="text-align: center; margin-bottom: 30px;">
+                <a href="{{ project_url }}" style="display: inline-block; background: linear-gradient(135deg, #4F46E5 0%, #7C3AED 100%); color: white; text-decoration: none; padding: 18px 40px; border-radius: 12px; font-weight: 600; font-size: 18px; box-shadow: 0 4px 14px 0 rgba(79, 70, 229, 0.4);">
+                    Download Export →
+                </a>
+            </div>
+            
+            <!-- Footer -->
+            <div style="border-top: 1px solid #E5E7EB; padding-top: 30px; text-align: center;">
+                <p style="font-size: 14px; color: #9CA3AF; margin: 0;">
+                    Best regards,<br>
+                    <strong style="color: #4F46E5;">The DMify Team</strong>
+                </p>
+            </div>
+        </div>
+        
+        <!-- Bottom Footer -->
+        <div style="text-align: center; margin-top: 30px;">
+            <p style="font-size: 14px; color: rgba(255, 255, 255, 0.8); margin: 0;">
+                © 2024 DMify - AI-Powered Instagram DM Automation
+            </p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+async def send_export_ready_email(email: str, project_name: str, project_id: str, export_job_id: str, export_format: str, row_count: int, retention_hours: int) -> bool:
+    """Tell a user their background export finished; the link opens the project so the download is authenticated"""
+    html_content = render_template(
+        "export_ready",
+        project_name=project_name,
+        row_count=row_count,
+        export_format=export_format,
+        retention_hours=retention_hours,
+        project_url=f"{FRONTEND_URL}/app/projects/{project_id}?export={export_job_id}"
+    )
+    
+    return await deliver_email(
+        kind="export_ready",
+        to_email=email,
+        subject=f"Your '{project_name}' export is ready - DMify",
+        html_content=html_content
+    )
+
+
+# Every template compiled once at import; sends only render
+TEMPLATES = {
+    "verification": template_env.from_string(verification_template),
+    "reset_password": template_env.from_string(reset_password_template),
+    "leads_ready": template_env.from_string(leads_ready_template),
+    "admin_signup": template_env.from_string(admin_notification_template),
+    "admin_signup_digest": template_env.from_string(admin_signup_digest_template),
+    "export_ready": template_env.from_string(export_ready_template)
+}
+
+def render_template(name: str, **context) -> str:
+    return TEMPLATES[name].render(**context)
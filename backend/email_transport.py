@@ -0,0 +1,168 @@
+from backend.metrics import LatencyWindow
+from collections import deque
+from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional
+import asyncio
+import httpx
+import logging
+import os
+import random
+import threading
+import time
+
+load_dotenv()
+
+# "mailgun" sends for real; "fake" records messages in memory so the email path can be load-tested offline
+EMAIL_TRANSPORT = os.getenv("EMAIL_TRANSPORT", "mailgun").lower()
+MAILGUN_API_BASE = os.getenv("MAILGUN_API_BASE", "https://api.mailgun.net/v3")
+MAILGUN_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MAILGUN_CONNECT_TIMEOUT_SECONDS", "5"))
+MAILGUN_TIMEOUT_SECONDS = float(os.getenv("MAILGUN_TIMEOUT_SECONDS", "10"))
+# Keep-alive connections shared by every send in the process
+MAILGUN_MAX_CONNECTIONS = int(os.getenv("MAILGUN_MAX_CONNECTIONS", "20"))
+# Retries after the first attempt, for network errors, 429 and 5xx responses
+MAILGUN_MAX_RETRIES = int(os.getenv("MAILGUN_MAX_RETRIES", "3"))
+# First backoff; doubles per retry, with jitter
+MAILGUN_RETRY_BACKOFF_SECONDS = float(os.getenv("MAILGUN_RETRY_BACKOFF_SECONDS", "0.5"))
+# Fake transport knobs for load tests
+FAKE_EMAIL_LATENCY_MS = float(os.getenv("FAKE_EMAIL_LATENCY_MS", "0"))
+FAKE_EMAIL_FAILURE_RATE = float(os.getenv("FAKE_EMAIL_FAILURE_RATE", "0"))
+FAKE_EMAIL_OUTBOX_SIZE = 1000
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class _SendStats:
+    def __init__(self):
+        self.latency = LatencyWindow()
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    def record(self, ok: bool, seconds: float, retries: int) -> None:
+        self.latency.record(seconds)
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.retries += retries
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {"sent": self.sent, "failed": self.failed, "retries": self.retries}
+        return {**counts, "latency": self.latency.stats()}
+
+
+class MailgunTransport:
+    """Mailgun over one pooled httpx.AsyncClient, retrying transient failures with backoff"""
+
+    name = "mailgun"
+
+    def __init__(self, domain: str, api_key: Optional[str]):
+        self.domain = domain
+        self.api_key = api_key
+        self.stats = _SendStats()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # A client is bound to the loop it was created on (asyncio.run in scripts makes a new one)
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=f"{MAILGUN_API_BASE}/{self.domain}",
+                auth=("api", self.api_key or ""),
+                timeout=httpx.Timeout(MAILGUN_TIMEOUT_SECONDS, connect=MAILGUN_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(max_connections=MAILGUN_MAX_CONNECTIONS, max_keepalive_connections=MAILGUN_MAX_CONNECTIONS)
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def send(self, data: Dict[str, Any]) -> bool:
+        """POST one message (form fields as Mailgun expects them); True once Mailgun accepted it"""
+        started = time.perf_counter()
+        retries = 0
+        ok = False
+        try:
+            client = self._get_client()
+            for attempt in range(MAILGUN_MAX_RETRIES + 1):
+                error = None
+                try:
+                    response = await client.post("/messages", data=data)
+                    if response.status_code == 200:
+                        ok = True
+                        return True
+                    error = f"Status: {response.status_code}, Response: {response.text}"
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        logging.error(f"Failed to send email to {data.get('to')}. {error}")
+                        return False
+                except httpx.TransportError as e:
+                    # Connect/read timeouts and dropped connections
+                    error = f"{type(e).__name__}: {str(e)}"
+
+                if attempt == MAILGUN_MAX_RETRIES:
+                    logging.error(f"Giving up on email to {data.get('to')} after {attempt + 1} attempts. {error}")
+                    return False
+
+                retries += 1
+                backoff = MAILGUN_RETRY_BACKOFF_SECONDS * (2 ** attempt)
+                logging.warning(f"Retrying email to {data.get('to')} in {backoff:.1f}s. {error}")
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+            return False
+        except Exception as e:
+            logging.error(f"Unexpected error sending email to {data.get('to')}: {str(e)}")
+            return False
+        finally:
+            self.stats.record(ok, time.perf_counter() - started, retries)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class FakeTransport:
+    """Accepts every message without network I/O; optional latency and failure injection"""
+
+    name = "fake"
+
+    def __init__(self):
+        self.stats = _SendStats()
+        self.outbox = deque(maxlen=FAKE_EMAIL_OUTBOX_SIZE)
+
+    async def send(self, data: Dict[str, Any]) -> bool:
+        started = time.perf_counter()
+        if FAKE_EMAIL_LATENCY_MS:
+            await asyncio.sleep(FAKE_EMAIL_LATENCY_MS / 1000)
+        ok = random.random() >= FAKE_EMAIL_FAILURE_RATE
+        if ok:
+            self.outbox.append(data)
+            logging.info(f"[fake email] to={data.get('to')} subject={data.get('subject')!r}")
+        self.stats.record(ok, time.perf_counter() - started, 0)
+        return ok
+
+    def sent_messages(self) -> List[Dict[str, Any]]:
+        return list(self.outbox)
+
+    async def aclose(self) -> None:
+        pass
+
+
+_transport = None
+
+
+def get_email_transport(domain: str, api_key: Optional[str]):
+    global _transport
+    if _transport is None:
+        _transport = FakeTransport() if EMAIL_TRANSPORT == "fake" else MailgunTransport(domain, api_key)
+    return _transport
+
+async def close_email_transport() -> None:
+    if _transport is not None:
+        await _transport.aclose()
+
+def email_transport_stats() -> Dict[str, Any]:
+    if _transport is None:
+        return {"transport": EMAIL_TRANSPORT, "sent": 0, "failed": 0, "retries": 0}
+    return {"transport": _transport.name, **_transport.stats.stats()}
@@ -0,0 +1,104 @@
+from backend.database import Database
+from backend.export_service import ExcelExportService, create_export_file, EXPORT_CURSOR_BATCH_SIZE
+from backend.email_service import send_export_ready_email
+from backend.email_outbox import dispatch_pending_emails, EMAIL_INLINE_DISPATCH
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+
+load_dotenv()
+
+# How long a claimed export belongs to its worker; renewed while the file is being built
+EXPORT_JOB_LEASE_SECONDS = int(os.getenv("EXPORT_JOB_LEASE_SECONDS", "600"))
+# Claims per export before the reaper gives up on it
+EXPORT_JOB_MAX_ATTEMPTS = int(os.getenv("EXPORT_JOB_MAX_ATTEMPTS", "3"))
+# Exports a worker process builds at once (each holds a cursor and a temp file)
+EXPORT_WORKER_CONCURRENCY = int(os.getenv("EXPORT_WORKER_CONCURRENCY", "2"))
+# How long finished export files stay downloadable
+EXPORT_RETENTION_HOURS = int(os.getenv("EXPORT_RETENTION_HOURS", "24"))
+# Set to false when a dedicated worker (run_worker.py) builds exports; follows DM_INLINE_JOBS by default
+EXPORT_INLINE_JOBS = os.getenv("EXPORT_INLINE_JOBS", os.getenv("DM_INLINE_JOBS", "true")).lower() == "true"
+
+
+async def heartbeat_export_job(job: dict):
+    while True:
+        await asyncio.sleep(EXPORT_JOB_LEASE_SECONDS / 3)
+        await asyncio.to_thread(Database.renew_export_job_lease, job["_id"], job["worker_id"], EXPORT_JOB_LEASE_SECONDS)
+
+async def process_export_job(job: dict):
+    """Build a claimed export into a temp file, store it in GridFS and optionally email the user"""
+    heartbeat = asyncio.create_task(heartbeat_export_job(job))
+    path = None
+    try:
+        project = await asyncio.to_thread(Database.get_project_by_id, job["project_id"], job["user_id"])
+        if not project:
+            await asyncio.to_thread(Database.fail_export_job, job["_id"], "Project not found", job["worker_id"])
+            return
+
+        path, row_count = await asyncio.to_thread(
+            create_export_file,
+            Database.iter_project_messages(job["project_id"], EXPORT_CURSOR_BATCH_SIZE),
+            project["name"],
+            job["format"],
+            job.get("include_user_info", False)
+        )
+        if not row_count:
+            await asyncio.to_thread(Database.fail_export_job, job["_id"], "No messages found for this project", job["worker_id"])
+            return
+
+        filename = ExcelExportService.get_filename(project["name"], job["format"])
+        size = os.path.getsize(path)
+        file_id = await asyncio.to_thread(
+            Database.save_export_file,
+            path,
+            filename,
+            {"export_job_id": job["_id"], "user_id": job["user_id"], "project_id": job["project_id"], "format": job["format"]}
+        )
+
+        completed = await asyncio.to_thread(
+            Database.complete_export_job,
+            job["_id"], job["worker_id"], file_id, filename, row_count, size, EXPORT_RETENTION_HOURS * 3600
+        )
+        if not completed:
+            logging.warning(f"Export job {job['_id']} lost its lease before completing")
+            return
+
+        logging.info(f"Export job {job['_id']} stored {row_count} messages ({size} bytes) as {job['format']}")
+
+        if job.get("notify_email"):
+            await send_export_ready_email(
+                job["notify_email"], project["name"], job["project_id"], job["_id"], job["format"], row_count, EXPORT_RETENTION_HOURS
+            )
+
+    except Exception as e:
+        logging.error(f"Export job {job['_id']} failed: {str(e)}")
+        await asyncio.to_thread(Database.fail_export_job, job["_id"], f"Export error: {str(e)}", job["worker_id"])
+    finally:
+        heartbeat.cancel()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+async def reap_export_jobs():
+    """Retry exports whose worker died and drop stored files past their retention"""
+    counts = await asyncio.to_thread(Database.requeue_expired_export_jobs, EXPORT_JOB_MAX_ATTEMPTS)
+    if counts["requeued"] or counts["failed"]:
+        logging.warning(f"Reaper requeued {counts['requeued']} and failed {counts['failed']} expired export jobs")
+    deleted = await asyncio.to_thread(Database.delete_expired_export_files)
+    if deleted:
+        logging.info(f"Deleted {deleted} expired export files")
+    return counts
+
+async def process_pending_export_jobs(worker_id: str):
+    """Drain pending export jobs one at a time from inside the web process"""
+    await reap_export_jobs()
+
+    while True:
+        job = await asyncio.to_thread(Database.claim_next_export_job, worker_id, EXPORT_JOB_LEASE_SECONDS)
+        if not job:
+            break
+        await process_export_job(job)
+
+    # Send the export-ready emails those jobs queued
+    if EMAIL_INLINE_DISPATCH:
+        await dispatch_pending_emails(worker_id)
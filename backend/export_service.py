@@ -1,10 +1,55 @@
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, NamedStyle
 from openpyxl.utils import get_column_letter
 from io import BytesIO
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Tuple, AsyncIterator
+import csv
+import io
+import json
 import logging
+import os
+import tempfile
+
+# Messages fetched per Mongo round trip while exporting
+EXPORT_CURSOR_BATCH_SIZE = int(os.getenv("EXPORT_CURSOR_BATCH_SIZE", "1000"))
+# Bytes per chunk when streaming an export file to the client
+EXPORT_STREAM_CHUNK_SIZE = 64 * 1024
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Formats accepted by the export endpoint, with their media types
+EXPORT_MEDIA_TYPES = {
+    "xlsx": XLSX_MEDIA_TYPE,
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson"
+}
+# Text exports are flushed to the client once this much output is buffered
+TEXT_EXPORT_FLUSH_BYTES = 64 * 1024
+
+# Optional columns taken from the scraped profile stored with each message: (column, user_info key)
+USER_INFO_COLUMNS = [
+    ("full_name", "fullName"),
+    ("followers", "followersCount"),
+    ("posts", "postsCount")
+]
+
+
+def _named_styles() -> List[NamedStyle]:
+    """Styles registered once per workbook; cells reference them by name instead of carrying their own"""
+    center_alignment = Alignment(horizontal="center", vertical="center")
+    return [
+        NamedStyle(name="dmify_title", font=Font(bold=True, size=14, color="4F46E5"), alignment=center_alignment),
+        NamedStyle(name="dmify_info", font=Font(size=10, italic=True, color="666666"), alignment=center_alignment),
+        NamedStyle(
+            name="dmify_header",
+            font=Font(color="FFFFFF", bold=True, size=12),
+            fill=PatternFill(start_color="4F46E5", end_color="4F46E5", fill_type="solid"),
+            alignment=center_alignment
+        ),
+        NamedStyle(name="dmify_data", font=Font(size=11), alignment=center_alignment),
+        NamedStyle(name="dmify_data_wrap", font=Font(size=11), alignment=Alignment(wrap_text=True, vertical="top")),
+    ]
 
 class ExcelExportService:
     """Service for exporting messages to Excel format"""
@@ -131,12 +176,110 @@ class ExcelExportService:
             raise Exception(f"Failed to create Excel file: {str(e)}")
     
     @staticmethod
-    def get_filename(project_name: str) -> str:
+    def write_messages_excel(messages: Iterable[Dict[str, Any]], project_name: str, path: str, include_user_info: bool = False) -> int:
         """
-        Generate a safe filename for the Excel export
+        Write messages to an .xlsx file at path with a write-only workbook
+        
+        Rows are written as they are read from messages (e.g. a Mongo cursor), so
+        memory stays flat no matter how many messages the project has.
+        include_user_info adds Full Name, Followers and Posts columns.
+        
+        Returns:
+            int: Number of messages written
+        """
+        wb = Workbook(write_only=True)
+        for style in _named_styles():
+            wb.add_named_style(style)
+        ws = wb.create_sheet("Messages")
+        
+        def styled(value: Any, style: str) -> WriteOnlyCell:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style
+            return cell
+        
+        headers = ["Username", "Generated Message", "Created Date", "Character Count"]
+        widths = [20, 80, 20, 15]
+        if include_user_info:
+            headers += ["Full Name", "Followers", "Posts"]
+            widths += [25, 12, 12]
+        last_col = get_column_letter(len(headers))
+        
+        # Column widths must be set before the first row is written
+        for col, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(col)].width = width
+        
+        ws.merged_cells.add(f'A1:{last_col}1')
+        ws.merged_cells.add(f'A2:{last_col}2')
+        ws.append([styled(f"DMify Messages Export - {project_name}", "dmify_title")])
+        ws.append([styled(f"Exported on {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", "dmify_info")])
+        ws.append([])
+        ws.append([styled(header, "dmify_header") for header in headers])
+        
+        count = 0
+        for message in messages:
+            created_date = message['created_at']
+            if isinstance(created_date, str):
+                created_date = datetime.fromisoformat(created_date.replace('Z', '+00:00'))
+            
+            row = [
+                styled(f"@{message['username']}", "dmify_data"),
+                styled(message['generated_message'], "dmify_data_wrap"),
+                styled(created_date.strftime('%m/%d/%Y %I:%M %p'), "dmify_data"),
+                styled(len(message['generated_message']), "dmify_data")
+            ]
+            if include_user_info:
+                user_info = message.get('user_info') or {}
+                row += [styled(user_info.get(key), "dmify_data") for _, key in USER_INFO_COLUMNS]
+            ws.append(row)
+            count += 1
+        
+        if count:
+            footer_row = 4 + count + 2
+            ws.append([])
+            ws.append([styled(f"Total Messages: {count} | Generated by DMify - AI Instagram DM Automation", "dmify_info")])
+            ws.merged_cells.add(f'A{footer_row}:{last_col}{footer_row}')
+        
+        wb.save(path)
+        return count
+    
+    @staticmethod
+    def create_messages_excel_file(messages: Iterable[Dict[str, Any]], project_name: str, include_user_info: bool = False) -> Tuple[str, int]:
+        """
+        Stream messages into a temporary .xlsx file
+        
+        Returns:
+            Tuple[str, int]: Path of the file (caller removes it, see iter_file) and number of messages
+        """
+        fd, path = tempfile.mkstemp(prefix="dmify_export_", suffix=".xlsx")
+        os.close(fd)
+        try:
+            count = ExcelExportService.write_messages_excel(messages, project_name, path, include_user_info)
+            logging.info(f"Successfully created streaming Excel export with {count} messages for project: {project_name}")
+            return path, count
+        except Exception as e:
+            os.remove(path)
+            logging.error(f"Error creating Excel export: {str(e)}")
+            raise Exception(f"Failed to create Excel file: {str(e)}")
+    
+    @staticmethod
+    def iter_file(path: str, remove: bool = True) -> Iterator[bytes]:
+        """Yield a file in chunks, removing it afterwards (also if the client disconnects)"""
+        try:
+            with open(path, "rb") as f:
+                while chunk := f.read(EXPORT_STREAM_CHUNK_SIZE):
+                    yield chunk
+        finally:
+            if remove:
+                os.remove(path)
+    
+    @staticmethod
+    def get_filename(project_name: str, extension: str = "xlsx") -> str:
+        """
+        Generate a safe filename for the export
         
         Args:
             project_name: Name of the project
+            extension: File extension of the export format
             
         Returns:
             str: Safe filename with timestamp
@@ -148,6 +291,96 @@ class ExcelExportService:
         # Add timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         
-        return f"DMify_Messages_{safe_project_name}_{timestamp}.xlsx"
+        return f"DMify_Messages_{safe_project_name}_{timestamp}.{extension}"
+
+
+class TextExportService:
+    """Service for exporting messages as CSV or NDJSON, streamed straight from a cursor"""
+    
+    @staticmethod
+    def message_to_row(message: Dict[str, Any], include_user_info: bool = False) -> Dict[str, Any]:
+        created_at = message['created_at']
+        row = {
+            "username": message['username'],
+            "generated_message": message['generated_message'],
+            "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+            "character_count": len(message['generated_message'])
+        }
+        if include_user_info:
+            user_info = message.get('user_info') or {}
+            for column, key in USER_INFO_COLUMNS:
+                row[column] = user_info.get(key)
+        return row
+    
+    @staticmethod
+    def write_file(messages: Iterable[Dict[str, Any]], path: str, export_format: str, include_user_info: bool = False) -> int:
+        """Write messages to a .csv or .ndjson file at path row by row; returns messages written"""
+        count = 0
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            if export_format == "csv":
+                columns = ["username", "generated_message", "created_at", "character_count"]
+                if include_user_info:
+                    columns += [column for column, _ in USER_INFO_COLUMNS]
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                for message in messages:
+                    writer.writerow(TextExportService.message_to_row(message, include_user_info))
+                    count += 1
+            else:
+                for message in messages:
+                    f.write(json.dumps(TextExportService.message_to_row(message, include_user_info), ensure_ascii=False) + "\n")
+                    count += 1
+        return count
+    
+    @staticmethod
+    async def iter_csv(messages: AsyncIterator[Dict[str, Any]], include_user_info: bool = False) -> AsyncIterator[bytes]:
+        """Yield CSV (with a header row) in chunks of about TEXT_EXPORT_FLUSH_BYTES"""
+        columns = ["username", "generated_message", "created_at", "character_count"]
+        if include_user_info:
+            columns += [column for column, _ in USER_INFO_COLUMNS]
+        
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns)
+        writer.writeheader()
+        
+        async for message in messages:
+            writer.writerow(TextExportService.message_to_row(message, include_user_info))
+            if buffer.tell() >= TEXT_EXPORT_FLUSH_BYTES:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
     
+    @staticmethod
+    async def iter_ndjson(messages: AsyncIterator[Dict[str, Any]], include_user_info: bool = False) -> AsyncIterator[bytes]:
+        """Yield one JSON object per line in chunks of about TEXT_EXPORT_FLUSH_BYTES"""
+        lines = []
+        size = 0
+        
+        async for message in messages:
+            line = json.dumps(TextExportService.message_to_row(message, include_user_info), ensure_ascii=False) + "\n"
+            lines.append(line)
+            size += len(line)
+            if size >= TEXT_EXPORT_FLUSH_BYTES:
+                yield "".join(lines).encode("utf-8")
+                lines = []
+                size = 0
+        
+        if lines:
+            yield "".join(lines).encode("utf-8")
+
+
+def create_export_file(messages: Iterable[Dict[str, Any]], project_name: str, export_format: str, include_user_info: bool = False) -> Tuple[str, int]:
+    """Write an export in any supported format to a temporary file; returns (path, message count)"""
+    if export_format == "xlsx":
+        return ExcelExportService.create_messages_excel_file(messages, project_name, include_user_info)
 
+    fd, path = tempfile.mkstemp(prefix="dmify_export_", suffix=f".{export_format}")
+    os.close(fd)
+    try:
+        return path, TextExportService.write_file(messages, path, export_format, include_user_info)
+    except Exception:
+        os.remove(path)
+        raise
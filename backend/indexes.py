@@ -0,0 +1,314 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from backend.database import db, Database, _ensure_dm_job_events_collection
+from typing import List, Dict, Any
+import argparse
+import logging
+
+# Every index the app relies on, with the Database queries it serves.
+# create_index is idempotent, so this list is safe to apply on every start.
+INDEXES = [
+    {
+        "collection": "users",
+        "keys": [("email", ASCENDING)],
+        "options": {"unique": True},
+        "serves": ["get_user_by_email", "verify_email_code (user update)", "update_user_password"]
+    },
+    {
+        "collection": "projects",
+        "keys": [("user_id", ASCENDING), ("created_at", DESCENDING)],
+        "options": {},
+        "serves": ["get_user_projects", "delete_account_immediately"]
+    },
+    {
+        "collection": "messages",
+        "keys": [("project_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+        "options": {},
+        "serves": ["get_project_messages (sorted by created_at)", "get_project_messages_page (keyset)", "delete_project (cascade)"]
+    },
+    {
+        "collection": "messages",
+        "keys": [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+        "options": {},
+        "serves": ["get_user_messages / get_user_messages_page (keyset, optional date range)", "delete_account_immediately"]
+    },
+    {
+        "collection": "messages",
+        "keys": [("user_id", ASCENDING), ("project_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+        "options": {},
+        "serves": ["get_user_messages / get_user_messages_page (filtered by project)"]
+    },
+    {
+        "collection": "verification_codes",
+        "keys": [("email", ASCENDING), ("code", ASCENDING)],
+        "options": {},
+        "serves": ["verify_email_code", "verify_reset_token", "create_verification_code (delete by email)"]
+    },
+    {
+        "collection": "verification_codes",
+        "keys": [("email", ASCENDING), ("type", ASCENDING)],
+        "options": {},
+        "serves": ["create_password_reset_token (delete by email + type)"]
+    },
+    {
+        "collection": "verification_codes",
+        "keys": [("expires_at", ASCENDING)],
+        "options": {"expireAfterSeconds": 0},
+        "serves": ["TTL: MongoDB deletes codes and reset tokens once expires_at passes"]
+    },
+    {
+        "collection": "user_credits",
+        "keys": [("user_id", ASCENDING)],
+        "options": {"unique": True},
+        "serves": ["get_user_credits", "use_credit", "add_credits", "add_payment_credits", "get_user_credit_info", "initialize_user_credits (one doc per user)"]
+    },
+    {
+        "collection": "payment_transactions",
+        "keys": [("stripe_session_id", ASCENDING)],
+        "options": {"unique": True},
+        "serves": ["get_payment_by_session_id", "update_payment_status"]
+    },
+    {
+        "collection": "payment_transactions",
+        "keys": [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+        "options": {},
+        "serves": ["get_user_payment_history (sorted by created_at)", "get_user_payment_history_page (keyset)"]
+    },
+    {
+        "collection": "dm_generation_jobs",
+        "keys": [("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)],
+        "options": {},
+        "serves": ["get_pending_dm_jobs", "claim_next_dm_job (any user)", "get_processing_dm_job_counts"]
+    },
+    {
+        "collection": "dm_generation_jobs",
+        "keys": [("status", ASCENDING), ("user_id", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)],
+        "options": {},
+        "serves": ["claim_next_dm_job (per user, DMJobScheduler)", "get_pending_dm_job_users (DISTINCT_SCAN)"]
+    },
+    {
+        "collection": "dm_generation_jobs",
+        "keys": [("status", ASCENDING), ("lease_expires_at", ASCENDING)],
+        "options": {},
+        "serves": ["requeue_expired_dm_jobs"]
+    },
+    {
+        "collection": "dm_generation_jobs",
+        "keys": [("project_id", ASCENDING), ("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+        "options": {},
+        "serves": ["get_project_dm_jobs (sorted by created_at)", "get_project_dm_jobs_page (keyset)"]
+    },
+    {
+        "collection": "export_jobs",
+        "keys": [("status", ASCENDING), ("created_at", ASCENDING)],
+        "options": {},
+        "serves": ["claim_next_export_job"]
+    },
+    {
+        "collection": "export_jobs",
+        "keys": [("status", ASCENDING), ("lease_expires_at", ASCENDING)],
+        "options": {},
+        "serves": ["requeue_expired_export_jobs"]
+    },
+    {
+        "collection": "export_jobs",
+        "keys": [("status", ASCENDING), ("expires_at", ASCENDING)],
+        "options": {},
+        "serves": ["delete_expired_export_files"]
+    },
+    {
+        "collection": "export_jobs",
+        "keys": [("user_id", ASCENDING)],
+        "options": {},
+        "serves": ["delete_export_jobs (delete_account_immediately)"]
+    },
+    {
+        "collection": "export_jobs",
+        "keys": [("project_id", ASCENDING)],
+        "options": {},
+        "serves": ["delete_export_jobs (delete_project)"]
+    },
+    {
+        "collection": "export_files.files",
+        "keys": [("metadata.user_id", ASCENDING)],
+        "options": {},
+        "serves": ["delete_export_jobs (files of unfinished jobs, delete_account_immediately)"]
+    },
+    {
+        "collection": "export_files.files",
+        "keys": [("metadata.project_id", ASCENDING)],
+        "options": {},
+        "serves": ["delete_export_jobs (files of unfinished jobs, delete_project)"]
+    },
+    {
+        "collection": "export_cache.files",
+        "keys": [("metadata.project_id", ASCENDING), ("metadata.format", ASCENDING), ("metadata.include_user_info", ASCENDING), ("metadata.content_version", ASCENDING)],
+        "options": {},
+        "serves": ["get_cached_export", "save_cached_export (drop superseded versions)", "delete_project (cascade)"]
+    },
+    {
+        "collection": "export_cache.files",
+        "keys": [("metadata.user_id", ASCENDING)],
+        "options": {},
+        "serves": ["delete_account_immediately (cached exports)"]
+    },
+    {
+        "collection": "refresh_tokens",
+        "keys": [("token_hash", ASCENDING)],
+        "options": {"unique": True},
+        "serves": ["consume_refresh_token", "get_refresh_token"]
+    },
+    {
+        "collection": "refresh_tokens",
+        "keys": [("family_id", ASCENDING)],
+        "options": {},
+        "serves": ["revoke_refresh_token_family"]
+    },
+    {
+        "collection": "refresh_tokens",
+        "keys": [("user_id", ASCENDING)],
+        "options": {},
+        "serves": ["revoke_user_refresh_tokens", "delete_account_immediately"]
+    },
+    {
+        "collection": "refresh_tokens",
+        "keys": [("expires_at", ASCENDING)],
+        "options": {"expireAfterSeconds": 0},
+        "serves": ["TTL: MongoDB deletes refresh tokens once expires_at passes"]
+    },
+    {
+        "collection": "email_outbox",
+        "keys": [("status", ASCENDING), ("next_attempt_at", ASCENDING)],
+        "options": {},
+        "serves": ["claim_next_email", "retry_dead_emails"]
+    },
+    {
+        "collection": "email_outbox",
+        "keys": [("status", ASCENDING), ("lease_expires_at", ASCENDING)],
+        "options": {},
+        "serves": ["requeue_expired_emails"]
+    },
+    {
+        "collection": "email_digest_events",
+        "keys": [("kind", ASCENDING), ("digest_id", ASCENDING)],
+        "options": {},
+        "serves": ["claim_digest_events (undigested events of a kind)"]
+    },
+    {
+        "collection": "email_digest_events",
+        "keys": [("digest_id", ASCENDING)],
+        "options": {},
+        "serves": ["claim_digest_events (read back)", "release_digest_events"]
+    },
+    {
+        "collection": "email_digest_events",
+        "keys": [("digested_at", ASCENDING)],
+        "options": {"expireAfterSeconds": 7 * 24 * 3600},
+        "serves": ["TTL: MongoDB deletes digested events after a week (undigested ones have no digested_at)"]
+    },
+    {
+        "collection": "stripe_events",
+        "keys": [("event_id", ASCENDING)],
+        "options": {"unique": True},
+        "serves": ["record_stripe_event (dedupes Stripe redeliveries)", "mark/retry/fail_stripe_event", "replay_stripe_events"]
+    },
+    {
+        "collection": "stripe_events",
+        "keys": [("status", ASCENDING), ("next_attempt_at", ASCENDING)],
+        "options": {},
+        "serves": ["claim_next_stripe_event", "replay_stripe_events (failed)"]
+    },
+    {
+        "collection": "stripe_events",
+        "keys": [("status", ASCENDING), ("lease_expires_at", ASCENDING)],
+        "options": {},
+        "serves": ["requeue_expired_stripe_events"]
+    },
+    {
+        "collection": "instagram_profiles",
+        "keys": [("username", ASCENDING)],
+        "options": {"unique": True},
+        "serves": ["get_cached_profile", "save_cached_profile"]
+    },
+]
+
+
+def index_name(spec: Dict[str, Any]) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in spec["keys"])
+
+def ensure_indexes(dry_run: bool = False) -> List[Dict[str, Any]]:
+    """Create any missing indexes and return a report line per index"""
+    report = []
+    existing_by_collection = {}
+
+    for spec in INDEXES:
+        collection = db[spec["collection"]]
+        name = index_name(spec)
+        entry = {
+            "collection": spec["collection"],
+            "index": name,
+            "options": spec["options"],
+            "serves": spec["serves"]
+        }
+
+        try:
+            if spec["collection"] not in existing_by_collection:
+                existing_by_collection[spec["collection"]] = collection.index_information()
+            existing = existing_by_collection[spec["collection"]]
+
+            if name in existing:
+                entry["status"] = "exists"
+            elif dry_run:
+                entry["status"] = "missing"
+            else:
+                collection.create_index(spec["keys"], name=name, **spec["options"])
+                entry["status"] = "created"
+        except OperationFailure as e:
+            # e.g. duplicate emails blocking a unique index, or an index with other options
+            entry["status"] = "error"
+            entry["error"] = str(e)
+        except Exception as e:
+            entry["status"] = "error"
+            entry["error"] = str(e)
+
+        report.append(entry)
+
+    if not dry_run:
+        try:
+            _ensure_dm_job_events_collection()
+        except Exception as e:
+            logging.error(f"Failed to create dm_job_events collection: {str(e)}")
+
+    return report
+
+def log_index_report(report: List[Dict[str, Any]]) -> None:
+    for entry in report:
+        if entry["status"] == "error":
+            logging.error(f"Index {entry['collection']}.{entry['index']} failed: {entry['error']}")
+        elif entry["status"] != "exists":
+            logging.info(f"Index {entry['collection']}.{entry['index']} {entry['status']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and report DMify MongoDB indexes")
+    parser.add_argument("--dry-run", action="store_true", help="only report which indexes are missing")
+    parser.add_argument("--backfill-message-user-ids", action="store_true",
+                        help="set user_id on messages saved without one so they appear in the /scrape/messages feed")
+    args = parser.parse_args()
+
+    if args.backfill_message_user_ids and not args.dry_run:
+        print(f"Backfilled user_id on {Database.backfill_message_user_ids()} messages")
+
+    report = ensure_indexes(dry_run=args.dry_run)
+    for entry in report:
+        options = f" {entry['options']}" if entry["options"] else ""
+        print(f"[{entry['status']:>7}] {entry['collection']}.{entry['index']}{options}")
+        for query in entry["serves"]:
+            print(f"            serves: {query}")
+        if entry.get("error"):
+            print(f"            error: {entry['error']}")
+
+    if any(entry["status"] == "error" for entry in report):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
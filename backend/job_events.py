@@ -0,0 +1,108 @@
+from backend.database import Database
+from bson import ObjectId
+from datetime import datetime
+from typing import Optional, Dict, Any
+import asyncio
+import json
+import logging
+import threading
+import time
+
+# Events buffered per subscriber before new ones are dropped (a slow client can resync with GET /jobs)
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+def _serialize(event: Dict[str, Any]) -> Dict[str, Any]:
+    payload = {}
+    for key, value in event.items():
+        if key == "_id":
+            continue
+        if isinstance(value, ObjectId):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        payload[key] = value
+    return payload
+
+
+class JobEventSubscription:
+    def __init__(self, user_id: str, project_id: Optional[str], loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.project_id = project_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if event.get("user_id") != self.user_id:
+            return False
+        return self.project_id is None or event.get("project_id") == self.project_id
+
+    def _put(self, payload: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class JobEventBroker:
+    """
+    Fans job events out to SSE subscribers in this process.
+
+    Workers append events to the capped dm_job_events collection; each web
+    process runs a single tailing thread over it no matter how many clients
+    are connected.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, user_id: str, project_id: Optional[str] = None) -> JobEventSubscription:
+        subscription = JobEventSubscription(user_id, project_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._tail, name="job-event-tail", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: JobEventSubscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _dispatch(self, event: Dict[str, Any]) -> None:
+        payload = _serialize(event)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.matches(payload):
+                subscription.loop.call_soon_threadsafe(subscription._put, payload)
+
+    def _tail(self) -> None:
+        last_id = Database.get_latest_dm_job_event_id()
+        while True:
+            try:
+                cursor = Database.tail_dm_job_events(last_id)
+                while cursor.alive:
+                    for event in cursor:
+                        last_id = event["_id"]
+                        self._dispatch(event)
+                # The cursor dies when the collection is empty; retry shortly
+                time.sleep(1)
+            except Exception as e:
+                logging.error(f"Job event tail failed: {str(e)}")
+                time.sleep(2)
+
+
+job_event_broker = JobEventBroker()
+
+
+def format_sse(payload: Dict[str, Any]) -> str:
+    return f"event: {payload.get('type', 'job')}\ndata: {json.dumps(payload)}\n\n"
@@ -1,16 +1,62 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from backend.routes.auth import router as auth_router
 from backend.routes.projects import router as projects_router
 from backend.routes.scraping import router as scraping_router
 from backend.routes.payments import router as payments_router
 from backend.scraper_algos import scrape
+from backend.profile_cache import ProfileCache
+from backend.completion_cache import CompletionCache
+from backend.user_cache import UserCache
+from backend.password_hasher import PasswordHasher
+from backend.email_transport import close_email_transport, email_transport_stats
+from backend.email_outbox import email_outbox_stats, run_inline_dispatcher, EMAIL_INLINE_DISPATCH
+from backend.stripe_events import stripe_event_stats, run_inline_consumer, STRIPE_EVENT_INLINE_PROCESSING
+from backend.pagination import NEXT_CURSOR_HEADER
+from backend.indexes import ensure_indexes, log_index_report
+from backend.async_database import client as async_mongo_client
+from backend.worker import WEB_WORKER_ID
 from pydantic import BaseModel
+import asyncio
+import logging
+import os
+
+# Index creation is idempotent; disable if indexes are managed with `python -m backend.indexes`
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
+
+async def bootstrap_indexes():
+    report = await asyncio.to_thread(ensure_indexes)
+    log_index_report(report)
+
+def log_task_failure(task: asyncio.Task) -> None:
+    """Done-callback for background startup tasks, whose exceptions nothing else would see"""
+    if not task.cancelled() and task.exception():
+        logging.error(f"Background task {task.get_name()} failed: {task.exception()!r}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    index_bootstrap = None
+    if ENSURE_INDEXES_ON_STARTUP:
+        # Run in the background so a slow index build never delays serving
+        index_bootstrap = asyncio.create_task(bootstrap_indexes(), name="bootstrap_indexes")
+        index_bootstrap.add_done_callback(log_task_failure)
+    # Digests, email retries and Stripe event retries come due without a request to run them
+    email_dispatcher = asyncio.create_task(run_inline_dispatcher(WEB_WORKER_ID)) if EMAIL_INLINE_DISPATCH else None
+    stripe_consumer = asyncio.create_task(run_inline_consumer(WEB_WORKER_ID)) if STRIPE_EVENT_INLINE_PROCESSING else None
+    yield
+    # A build already handed to MongoDB finishes server-side; we only stop waiting for it
+    for task in (index_bootstrap, email_dispatcher, stripe_consumer):
+        if task:
+            task.cancel()
+    await async_mongo_client.close()
+    await close_email_transport()
 
 app = FastAPI(
     title="DMify API",
     description="Instagram DM Generator with User Management",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
@@ -26,6 +72,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 
@@ -47,3 +94,15 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "service": "dmify-api"}
+
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "profile_cache": ProfileCache.stats(),
+        "completion_cache": CompletionCache.stats(),
+        "user_cache": UserCache.stats(),
+        "password_hasher": PasswordHasher.stats(),
+        "email": email_transport_stats(),
+        "email_outbox": email_outbox_stats(),
+        "stripe_events": stripe_event_stats()
+    }
@@ -0,0 +1,32 @@
+from collections import deque
+from typing import Any, Dict
+import threading
+
+# Recent samples kept per window for the percentiles on /metrics
+LATENCY_WINDOW_SIZE = 1024
+
+
+class LatencyWindow:
+    """Thread-safe count plus a rolling window of durations (seconds) reported as millisecond percentiles"""
+
+    def __init__(self, size: int = LATENCY_WINDOW_SIZE):
+        self.count = 0
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self._samples.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._samples)
+            count = self.count
+
+        def pick(q: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+        return {"count": count, "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
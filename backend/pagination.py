@@ -0,0 +1,63 @@
+from bson import ObjectId
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple
+import base64
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Response header carrying the cursor for the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Newest first, with _id breaking ties between documents created in the same millisecond
+KEYSET_SORT = [("created_at", -1), ("_id", -1)]
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    raw = f"{doc['created_at'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, _id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), ObjectId(_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def keyset_filter(cursor: Optional[str]) -> Dict[str, Any]:
+    """Query clause selecting documents that sort after the cursor under KEYSET_SORT"""
+    if not cursor:
+        return {}
+
+    created_at, _id = decode_cursor(cursor)
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": _id}}
+        ]
+    }
+
+def paginate(collection, query: Dict[str, Any], limit: int, cursor: Optional[str] = None) -> Tuple[list, Optional[str]]:
+    """Fetch one keyset page. Returns (documents, next_cursor)."""
+    page_query = dict(query)
+    after = keyset_filter(cursor)
+    if after:
+        page_query = {"$and": [query, after]}
+
+    # One extra document tells us whether another page exists
+    docs = list(collection.find(page_query).sort(KEYSET_SORT).limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+async def paginate_async(collection, query: Dict[str, Any], limit: int, cursor: Optional[str] = None) -> Tuple[list, Optional[str]]:
+    """paginate for an AsyncCollection"""
+    page_query = dict(query)
+    after = keyset_filter(cursor)
+    if after:
+        page_query = {"$and": [query, after]}
+
+    docs = await collection.find(page_query).sort(KEYSET_SORT).limit(limit + 1).to_list(None)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from backend.metrics import LatencyWindow
+from dotenv import load_dotenv
+from typing import Any, Callable, Dict
+import asyncio
+import os
+import threading
+import time
+
+load_dotenv()
+
+# bcrypt releases the GIL while hashing, so threads give real parallelism up to the core count
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashes allowed to wait for a worker; beyond this, requests are shed with a 503 instead of queueing for seconds
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", str(PASSWORD_HASH_WORKERS * 4)))
+# Retry-After sent with a shed request
+PASSWORD_HASH_RETRY_AFTER_SECONDS = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", "1"))
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+
+_lock = threading.Lock()
+_in_flight = 0
+_shed = 0
+# Per operation: time waiting for a worker, and total time including the hash
+_queue_wait = {"hash": LatencyWindow(), "verify": LatencyWindow()}
+_latency = {"hash": LatencyWindow(), "verify": LatencyWindow()}
+
+
+def _release(_future) -> None:
+    # Runs when the worker finishes, even if the awaiting request was cancelled meanwhile
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+
+class PasswordHasher:
+    """bcrypt off the event loop, on a bounded pool that sheds load instead of building a backlog"""
+
+    @staticmethod
+    async def _run(operation: str, fn: Callable, *args) -> Any:
+        global _in_flight, _shed
+        with _lock:
+            if _in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+                _shed += 1
+                raise PasswordHasherBusy()
+            _in_flight += 1
+
+        submitted = time.perf_counter()
+        timing = {}
+
+        def timed():
+            timing["started"] = time.perf_counter()
+            return fn(*args)
+
+        future = _executor.submit(timed)
+        future.add_done_callback(_release)
+        result = await asyncio.wrap_future(future)
+
+        _queue_wait[operation].record(timing["started"] - submitted)
+        _latency[operation].record(time.perf_counter() - submitted)
+        return result
+
+    @staticmethod
+    async def hash(password: str) -> str:
+        return await PasswordHasher._run("hash", pwd_context.hash, password)
+
+    @staticmethod
+    async def verify(plain_password: str, hashed_password: str) -> bool:
+        return await PasswordHasher._run("verify", pwd_context.verify, plain_password, hashed_password)
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        with _lock:
+            in_flight, shed = _in_flight, _shed
+        return {
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_queue": PASSWORD_HASH_MAX_QUEUE,
+            "in_flight": in_flight,
+            "queued": max(0, in_flight - PASSWORD_HASH_WORKERS),
+            "shed": shed,
+            **{
+                operation: {"queue_wait": _queue_wait[operation].stats(), "latency": _latency[operation].stats()}
+                for operation in _latency
+            }
+        }
@@ -11,6 +11,9 @@ load_dotenv()
 # Initialize Stripe
 stripe.api_key = os.getenv("STRIPE_API_KEY")
 
+# How long a claimed payment may stay fulfilling before another handler assumes the first one died
+PAYMENT_FULFILLMENT_TIMEOUT_SECONDS = int(os.getenv("PAYMENT_FULFILLMENT_TIMEOUT_SECONDS", "300"))
+
 # Payment plan configuration - One-time message purchases
 PAYMENT_PLANS = {
     "plan_1": {
@@ -125,8 +128,17 @@ class PaymentService:
                 logging.error(f"Payment not completed for session: {stripe_session_id}")
                 return False
             
-            # Add credits to user account
-            success = Database.add_credits(
+            # Only one handler gets past this, even when a redelivery or a requeued event runs in another process
+            if not Database.claim_payment_fulfillment(stripe_session_id, PAYMENT_FULFILLMENT_TIMEOUT_SECONDS):
+                transaction = Database.get_payment_by_session_id(stripe_session_id)
+                if transaction and transaction["status"] == "completed":
+                    logging.info(f"Payment already processed for session: {stripe_session_id}")
+                    return True
+                logging.warning(f"Payment for session {stripe_session_id} is being fulfilled elsewhere")
+                return False
+            
+            # Keyed on the transaction, so taking over from a handler that died after crediting adds nothing twice
+            success = Database.add_payment_credits(
                 user_id=transaction["user_id"],
                 credits_to_add=transaction["credits"],
                 transaction_id=transaction["_id"]
@@ -137,6 +149,8 @@ class PaymentService:
                 logging.info(f"Successfully added {transaction['credits']} credits to user {transaction['user_id']}")
                 return True
             else:
+                # Hand the transaction back so a retry can claim it
+                Database.update_payment_status(stripe_session_id, "pending")
                 logging.error(f"Failed to add credits for session: {stripe_session_id}")
                 return False
                 
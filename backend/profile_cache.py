@@ -0,0 +1,64 @@
+from backend.cache import TTLCache
+from backend.database import Database
+from dotenv import load_dotenv
+from typing import Optional, Dict, Any
+import threading
+import os
+
+load_dotenv()
+
+# How long a scraped profile is considered fresh
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+# Bound on profiles kept in process memory
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "5000"))
+
+_memory_cache = TTLCache(PROFILE_CACHE_MAX_ENTRIES, PROFILE_CACHE_TTL_SECONDS)
+_stats_lock = threading.Lock()
+_stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0}
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+class ProfileCache:
+    """Two-level cache (process LRU, then MongoDB) for filtered Instagram profiles"""
+
+    @staticmethod
+    def get(username: str) -> Optional[Dict[str, Any]]:
+        """Get a fresh filtered profile, or None if it has to be scraped"""
+        username = username.lower()
+
+        profile = _memory_cache.get(username)
+        if profile is not None:
+            _count("memory_hits")
+            return profile
+
+        profile = Database.get_cached_profile(username, PROFILE_CACHE_TTL_SECONDS)
+        if profile is not None:
+            _count("mongo_hits")
+            _memory_cache.set(username, profile)
+            return profile
+
+        _count("misses")
+        return None
+
+    @staticmethod
+    def set(username: str, profile: Dict[str, Any]) -> None:
+        """Cache a filtered profile (the output of filter_user)"""
+        username = username.lower()
+        _memory_cache.set(username, profile)
+        Database.save_cached_profile(username, profile)
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        with _stats_lock:
+            stats = dict(_stats)
+
+        lookups = stats["memory_hits"] + stats["mongo_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["mongo_hits"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["ttl_seconds"] = PROFILE_CACHE_TTL_SECONDS
+        stats["memory"] = _memory_cache.stats()
+        return stats
@@ -1,9 +1,13 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks
 from pydantic import BaseModel, EmailStr
-from backend.database import Database
+from backend.async_database import AsyncDatabase
 from backend.auth import Auth, get_current_user
-from backend.email_service import send_verification_email, send_password_reset_email, send_admin_signup_notification
+from backend.user_cache import UserCache
+from backend.email_service import send_verification_email, send_password_reset_email, record_admin_signup
+from backend.email_outbox import dispatch_pending_emails, EMAIL_INLINE_DISPATCH
+from backend.worker import WEB_WORKER_ID
 from datetime import timedelta
+from typing import Optional
 import re
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
@@ -32,11 +36,43 @@ class ResetPasswordRequest(BaseModel):
     token: str
     new_password: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
 class AuthResponse(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str
     user: dict
 
+def token_response(user: dict, refresh_token: str) -> dict:
+    access_token_expires = timedelta(minutes=30)
+    access_token = Auth.create_access_token(
+        data={"sub": user["_id"]}, expires_delta=access_token_expires
+    )
+    
+    user_data = {
+        "id": user["_id"],
+        "email": user["email"],
+        "name": user["name"],
+        "created_at": user["created_at"]
+    }
+    
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "user": user_data
+    }
+
+def dispatch_emails_after_response(background_tasks: BackgroundTasks) -> None:
+    # Queued emails go out once the response is sent, unless run_worker.py dispatches them
+    if EMAIL_INLINE_DISPATCH:
+        background_tasks.add_task(dispatch_pending_emails, WEB_WORKER_ID)
+
 def validate_password(password: str) -> bool:
     if len(password) < 8:
         return False
@@ -47,7 +83,7 @@ def validate_password(password: str) -> bool:
     return True
 
 @router.post("/signup")
-async def signup(request: SignupRequest):
+async def signup(request: SignupRequest, background_tasks: BackgroundTasks):
 
     
 
@@ -58,7 +94,7 @@ async def signup(request: SignupRequest):
         )
     
 
-    existing_user = Database.get_user_by_email(request.email)
+    existing_user = await AsyncDatabase.get_user_by_email(request.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -66,33 +102,35 @@ async def signup(request: SignupRequest):
         )
     
 
-    password_hash = Auth.hash_password(request.password)
-    user_id = Database.create_user(request.email, password_hash, request.name)
+    password_hash = await Auth.hash_password(request.password)
+    user_id = await AsyncDatabase.create_user(request.email, password_hash, request.name)
     
-    verification_code = Database.create_verification_code(request.email)
+    verification_code = await AsyncDatabase.create_verification_code(request.email)
     
-    email_sent = await send_verification_email(request.email, verification_code)
+    # Only queued; delivery and retries happen in the outbox dispatcher
+    email_queued = await send_verification_email(request.email, verification_code)
     
-    if not email_sent:
+    if not email_queued:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to send verification email. Please try again."
         )
     
-    # Send admin notification (don't fail signup if this fails)
+    # Admin notification goes out in the next signup digest (don't fail signup if this fails)
     try:
-        await send_admin_signup_notification(request.name, request.email)
+        await record_admin_signup(request.name, request.email)
     except Exception as e:
         # Log the error but don't fail the signup
         import logging
-        logging.error(f"Failed to send admin signup notification: {str(e)}")
+        logging.error(f"Failed to record admin signup notification: {str(e)}")
     
+    dispatch_emails_after_response(background_tasks)
     return {"message": "User created successfully. Please check your email for verification code."}
 
 @router.post("/verify-email")
 async def verify_email(request: VerifyEmailRequest):
     
-    user = Database.get_user_by_email(request.email)
+    user = await AsyncDatabase.get_user_by_email(request.email)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -102,7 +140,8 @@ async def verify_email(request: VerifyEmailRequest):
     if user.get("email_verified", False):
         return {"message": "Email already verified"}
     
-    if Database.verify_email_code(request.email, request.code):
+    if await AsyncDatabase.verify_email_code(request.email, request.code):
+        UserCache.invalidate(user["_id"])
         return {"message": "Email verified successfully. You can now login."}
     else:
         raise HTTPException(
@@ -111,9 +150,9 @@ async def verify_email(request: VerifyEmailRequest):
         )
 
 @router.post("/resend-verification")
-async def resend_verification_code(request: ResendCodeRequest):
+async def resend_verification_code(request: ResendCodeRequest, background_tasks: BackgroundTasks):
     
-    user = Database.get_user_by_email(request.email)
+    user = await AsyncDatabase.get_user_by_email(request.email)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -123,16 +162,17 @@ async def resend_verification_code(request: ResendCodeRequest):
     if user.get("email_verified", False):
         return {"message": "Email already verified"}
     
-    verification_code = Database.create_verification_code(request.email)
+    verification_code = await AsyncDatabase.create_verification_code(request.email)
     
-    email_sent = await send_verification_email(request.email, verification_code)
+    email_queued = await send_verification_email(request.email, verification_code)
     
-    if not email_sent:
+    if not email_queued:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to send verification email. Please try again."
         )
     
+    dispatch_emails_after_response(background_tasks)
     return {"message": "Verification code sent successfully"}
 
 @router.post("/login", response_model=AuthResponse)
@@ -140,7 +180,7 @@ async def login(request: LoginRequest):
 
     
 
-    user = Auth.authenticate_user(request.email, request.password)
+    user = await Auth.authenticate_user(request.email, request.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -154,28 +194,37 @@ async def login(request: LoginRequest):
         )
     
 
-    access_token_expires = timedelta(minutes=30)
-    access_token = Auth.create_access_token(
-        data={"sub": user["_id"]}, expires_delta=access_token_expires
-    )
-    
+    refresh_token = await Auth.create_refresh_token(user["_id"])
+    return token_response(user, refresh_token)
 
-    user_data = {
-        "id": user["_id"],
-        "email": user["email"],
-        "name": user["name"],
-        "created_at": user["created_at"]
-    }
+@router.post("/refresh", response_model=AuthResponse)
+async def refresh(request: RefreshRequest):
+    """Exchange a refresh token for a new access token and a rotated refresh token (no password check)"""
     
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": user_data
-    }
+    rotated = await Auth.rotate_refresh_token(request.refresh_token)
+    if not rotated:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token"
+        )
+    
+    user_id, refresh_token = rotated
+    user = UserCache.get(user_id) or await AsyncDatabase.get_user_by_id(user_id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token"
+        )
+    
+    return token_response(user, refresh_token)
 
 @router.post("/logout")
-async def logout():
-
+async def logout(request: Optional[LogoutRequest] = None):
+    """Revoke the session's refresh token; the access token simply expires"""
+    
+    if request and request.refresh_token:
+        await Auth.revoke_refresh_token(request.refresh_token)
+    
     return {"message": "Successfully logged out"}
 
 @router.get("/me")
@@ -190,11 +239,11 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     return user_data
 
 @router.post("/forgot-password")
-async def forgot_password(request: ForgotPasswordRequest):
+async def forgot_password(request: ForgotPasswordRequest, background_tasks: BackgroundTasks):
     """Send password reset email"""
     
     # Check if user exists
-    user = Database.get_user_by_email(request.email)
+    user = await AsyncDatabase.get_user_by_email(request.email)
     if not user:
         # Return success even if user doesn't exist (security)
         return {"message": "If an account exists, you'll receive reset instructions"}
@@ -207,17 +256,18 @@ async def forgot_password(request: ForgotPasswordRequest):
         )
     
     # Create reset token
-    reset_token = Database.create_password_reset_token(request.email)
+    reset_token = await AsyncDatabase.create_password_reset_token(request.email)
     
-    # Send reset email
-    email_sent = await send_password_reset_email(request.email, reset_token)
+    # Queue reset email
+    email_queued = await send_password_reset_email(request.email, reset_token)
     
-    if not email_sent:
+    if not email_queued:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to send reset email. Please try again."
         )
     
+    dispatch_emails_after_response(background_tasks)
     return {"message": "If an account exists, you'll receive reset instructions"}
 
 @router.post("/reset-password")
@@ -232,17 +282,17 @@ async def reset_password(request: ResetPasswordRequest):
         )
     
     # Verify reset token
-    if not Database.verify_reset_token(request.email, request.token):
+    if not await AsyncDatabase.verify_reset_token(request.email, request.token):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid or expired reset token"
         )
     
     # Hash new password
-    new_password_hash = Auth.hash_password(request.new_password)
+    new_password_hash = await Auth.hash_password(request.new_password)
     
     # Update password
-    success = Database.update_user_password(request.email, new_password_hash)
+    success = await AsyncDatabase.update_user_password(request.email, new_password_hash)
     
     if not success:
         raise HTTPException(
@@ -250,6 +300,12 @@ async def reset_password(request: ResetPasswordRequest):
             detail="Failed to update password"
         )
     
+    user = await AsyncDatabase.get_user_by_email(request.email)
+    if user:
+        UserCache.invalidate(user["_id"])
+        # Sessions started with the old password must log in again
+        await AsyncDatabase.revoke_user_refresh_tokens(user["_id"])
+    
     return {"message": "Password updated successfully"}
 
 @router.delete('/delete-account')
@@ -260,7 +316,8 @@ async def delete_account(current_user: dict = Depends(get_current_user)):
     """
     try:
         # Immediately delete all user data
-        success = Database.delete_account_immediately(current_user["_id"])
+        success = await AsyncDatabase.delete_account_immediately(current_user["_id"])
+        UserCache.invalidate(current_user["_id"])
         
         if not success:
             raise HTTPException(
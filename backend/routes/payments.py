@@ -1,10 +1,14 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, Query, BackgroundTasks
 from pydantic import BaseModel
-from backend.database import Database
+from backend.async_database import AsyncDatabase
 from backend.auth import get_current_user
 from backend.payment_service import PaymentService, PAYMENT_PLANS
+from backend.stripe_events import process_pending_stripe_events, STRIPE_EVENT_INLINE_PROCESSING
+from backend.worker import WEB_WORKER_ID
+from backend.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+import asyncio
 import logging
 import stripe
 import os
@@ -68,7 +72,9 @@ async def create_checkout_session(
     success_url = os.getenv("FRONTEND_URL", "https://dmify.app") + "/app/dashboard?payment=success&session_id={CHECKOUT_SESSION_ID}"
     cancel_url = os.getenv("FRONTEND_URL", "https://dmify.app") + "/app/dashboard?payment=cancelled"
     
-    session_data = PaymentService.create_checkout_session(
+    # Stripe's SDK is blocking, so it runs off the event loop
+    session_data = await asyncio.to_thread(
+        PaymentService.create_checkout_session,
         user_id=current_user["_id"],
         plan_id=request.plan_id,
         success_url=success_url,
@@ -88,15 +94,15 @@ async def get_user_credits(current_user: dict = Depends(get_current_user)):
     """Get current user's credit information"""
     
     # Get credit info
-    credit_info = Database.get_user_credit_info(current_user["_id"])
+    credit_info = await AsyncDatabase.get_user_credit_info(current_user["_id"])
     
     if not credit_info:
         # Initialize credits if they don't exist (for existing users)
-        Database.initialize_user_credits(current_user["_id"])
-        credit_info = Database.get_user_credit_info(current_user["_id"])
+        await AsyncDatabase.initialize_user_credits(current_user["_id"])
+        credit_info = await AsyncDatabase.get_user_credit_info(current_user["_id"])
     
     # Get current credit balance
-    current_credits = Database.get_user_credits(current_user["_id"])
+    current_credits = await AsyncDatabase.get_user_credits(current_user["_id"])
     
     return {
         "credits": current_credits,
@@ -105,70 +111,68 @@ async def get_user_credits(current_user: dict = Depends(get_current_user)):
     }
 
 @router.post("/webhook")
-async def stripe_webhook(request: Request):
-    """Handle Stripe webhook events"""
-    
-    try:
-        # Get the raw payload and signature
-        payload = await request.body()
-        signature = request.headers.get("stripe-signature")
-        
-        if not signature:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Missing stripe-signature header"
-            )
-        
-        # Verify the webhook signature
-        event = PaymentService.verify_webhook_signature(payload, signature)
-        if not event:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid webhook signature"
-            )
-        
-        # Handle the event
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            session_id = session['id']
-            
-            logging.info(f"Processing checkout.session.completed for session: {session_id}")
-            
-            # Handle successful one-time payment
-            success = PaymentService.handle_successful_payment(session_id)
-            if not success:
-                logging.error(f"Failed to process payment for session: {session_id}")
-                # Don't return error to Stripe, as we've received the event
-                # We can retry processing later if needed
-        
-        elif event['type'] == 'checkout.session.async_payment_succeeded':
-            session = event['data']['object']
-            session_id = session['id']
-            
-            logging.info(f"Processing checkout.session.async_payment_succeeded for session: {session_id}")
-            
-            # Handle successful delayed payment
-            success = PaymentService.handle_successful_payment(session_id)
-            if not success:
-                logging.error(f"Failed to process delayed payment for session: {session_id}")
-        
-        else:
-            logging.info(f"Unhandled event type: {event['type']}")
-        
-        return {"status": "success"}
-        
-    except Exception as e:
-        logging.error(f"Error processing webhook: {str(e)}")
+async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Store a verified Stripe event and acknowledge it; fulfillment happens in backend/stripe_events.py"""
+    
+    # Get the raw payload and signature
+    payload = await request.body()
+    signature = request.headers.get("stripe-signature")
+    
+    if not signature:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Missing stripe-signature header"
+        )
+    
+    # Verify the webhook signature
+    event = PaymentService.verify_webhook_signature(payload, signature)
+    if not event:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid webhook signature"
+        )
+    
+    # The unique event_id index makes Stripe's redeliveries no-ops
+    recorded = await AsyncDatabase.record_stripe_event(event["id"], event["type"], payload.decode("utf-8"))
+    if recorded is None:
+        # Not stored, so let Stripe deliver it again
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
         )
+    
+    if not recorded:
+        logging.info(f"Duplicate Stripe event {event['id']} ({event['type']})")
+    elif STRIPE_EVENT_INLINE_PROCESSING:
+        background_tasks.add_task(process_pending_stripe_events, WEB_WORKER_ID)
+    
+    return {"status": "success"}
 
 @router.get("/history")
-async def get_payment_history(current_user: dict = Depends(get_current_user)):
-    """Get user's payment history"""
+async def get_payment_history(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the user's payment history, newest first. With limit or cursor, one page whose next cursor is in
+    X-Next-Cursor; without either, the full history."""
+    
+    if limit is None and cursor is None:
+        history, next_cursor = await AsyncDatabase.get_user_payment_history(current_user["_id"]), None
+    else:
+        try:
+            history, next_cursor = await AsyncDatabase.get_user_payment_history_page(
+                current_user["_id"], limit or DEFAULT_PAGE_SIZE, cursor
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
     
-    history = Database.get_user_payment_history(current_user["_id"])
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # Format the response
     formatted_history = []
@@ -1,11 +1,18 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, BackgroundTasks, Header, Response
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
+from backend.async_database import AsyncDatabase
 from backend.database import Database
 from backend.auth import get_current_user
-from backend.export_service import ExcelExportService
-from typing import List, Optional
+from backend.export_service import ExcelExportService, TextExportService, EXPORT_CURSOR_BATCH_SIZE, EXPORT_MEDIA_TYPES
+from backend.export_jobs import process_pending_export_jobs, EXPORT_INLINE_JOBS
+from backend.worker import WEB_WORKER_ID
+from typing import List, Optional, Literal
+import asyncio
 import logging
+import os
+import tempfile
 
 router = APIRouter(prefix="/projects", tags=["projects"])
 
@@ -29,7 +36,7 @@ class ProjectResponse(BaseModel):
 @router.get("/", response_model=List[ProjectResponse])
 async def get_user_projects(current_user: dict = Depends(get_current_user)):
 
-    projects = Database.get_user_projects(current_user["_id"])
+    projects = await AsyncDatabase.get_user_projects(current_user["_id"])
     
     return [
         {
@@ -69,7 +76,7 @@ async def create_project(
         )
     
 
-    project_id = Database.create_project(
+    project_id = await AsyncDatabase.create_project(
         user_id=current_user["_id"],
         name=project.name.strip(),
         product_info=project.product_info.strip(),
@@ -77,7 +84,7 @@ async def create_project(
     )
     
 
-    created_project = Database.get_project_by_id(project_id, current_user["_id"])
+    created_project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     
     return {
         "id": created_project["_id"],
@@ -93,7 +100,7 @@ async def get_project(
     current_user: dict = Depends(get_current_user)
 ):
 
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     
     if not project:
         raise HTTPException(
@@ -118,7 +125,7 @@ async def update_project(
 
     
 
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -141,7 +148,7 @@ async def update_project(
         )
     
 
-    success = Database.update_project(project_id, current_user["_id"], updates)
+    success = await AsyncDatabase.update_project(project_id, current_user["_id"], updates)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -149,7 +156,7 @@ async def update_project(
         )
     
 
-    updated_project = Database.get_project_by_id(project_id, current_user["_id"])
+    updated_project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     
     return {
         "id": updated_project["_id"],
@@ -167,7 +174,7 @@ async def delete_project(
 
     
 
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -175,7 +182,7 @@ async def delete_project(
         )
     
 
-    success = Database.delete_project(project_id, current_user["_id"])
+    success = await AsyncDatabase.delete_project(project_id, current_user["_id"])
     if not success:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -184,48 +191,151 @@ async def delete_project(
     
     return {"message": "Project deleted successfully"}
 
+async def _prepend(first: dict, rest):
+    yield first
+    async for item in rest:
+        yield item
+
+async def _tee_to_file(chunks, path: str, state: dict):
+    """Pass chunks through while writing them to path; state["complete"] is set once all were sent"""
+    try:
+        with open(path, "wb") as f:
+            async for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        state["complete"] = True
+    finally:
+        # Client went away: nothing worth caching, and the background task may not run
+        if not state.get("complete") and os.path.exists(path):
+            os.remove(path)
+
+def _cache_text_export(path: str, state: dict, *cache_args):
+    """Runs after the response: keep a fully sent text export for the next download, then drop the temp file"""
+    try:
+        if state.get("complete"):
+            Database.save_cached_export(path, *cache_args)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+def export_etag(project_id: str, content_version: int, export_format: str, include_user_info: bool) -> str:
+    # Weak: a rebuilt xlsx differs byte-wise (export timestamp) but holds the same messages
+    return f'W/"{project_id}.{content_version}.{export_format}.{int(include_user_info)}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
 @router.get("/{project_id}/export")
 async def export_project_messages(
     project_id: str,
+    export_format: str = Query("xlsx", alias="format", pattern="^(xlsx|csv|ndjson)$"),
+    include_user_info: bool = False,
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Export project messages to Excel file - Available for all users
+    Export project messages as xlsx, csv or ndjson - Available for all users
+    
+    include_user_info adds the scraped full name, follower and post counts.
+    Responses carry an ETag tied to the project's content version: If-None-Match gets a 304
+    while the messages are unchanged, and a repeat download is served from the export cache.
     """
     try:
         # Verify project exists and belongs to user
-        project = Database.get_project_by_id(project_id, current_user["_id"])
+        project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
         if not project:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Project not found"
             )
         
-        # Get project messages
-        messages = Database.get_project_messages(project_id)
-        if not messages:
+        # Read before any message so a cache entry never claims a version newer than its rows
+        content_version = project.get("content_version", 0)
+        etag = export_etag(project_id, content_version, export_format, include_user_info)
+        cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+        
+        cached = await AsyncDatabase.get_cached_export(project_id, content_version, export_format, include_user_info)
+        grid_out = await AsyncDatabase.open_cached_export(cached["file_id"]) if cached else None
+        if grid_out:
+            async def iter_chunks():
+                while chunk := await grid_out.readchunk():
+                    yield chunk
+            
+            logging.info(f"{export_format.upper()} export served from cache for user {current_user['_id']}, project {project_id}")
+            return StreamingResponse(
+                iter_chunks(),
+                media_type=EXPORT_MEDIA_TYPES[export_format],
+                headers={
+                    **cache_headers,
+                    "Content-Disposition": f"attachment; filename={cached['filename']}",
+                    "Content-Length": str(cached["size"])
+                }
+            )
+        
+        filename = ExcelExportService.get_filename(project["name"], export_format)
+        cache_args = (filename, current_user["_id"], project_id, content_version, export_format, include_user_info)
+        
+        if export_format in ("csv", "ndjson"):
+            # Text formats stream straight from the cursor; the first row only confirms there is something to send
+            messages = AsyncDatabase.iter_project_messages(project_id, EXPORT_CURSOR_BATCH_SIZE)
+            first = await anext(messages, None)
+            if first is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="No messages found for this project"
+                )
+            
+            # A copy goes to a temp file and into the cache once the whole export was sent
+            fd, path = tempfile.mkstemp(prefix="dmify_export_", suffix=f".{export_format}")
+            os.close(fd)
+            state = {}
+            iter_rows = TextExportService.iter_csv if export_format == "csv" else TextExportService.iter_ndjson
+            logging.info(f"{export_format.upper()} export started for user {current_user['_id']}, project {project_id}")
+            return StreamingResponse(
+                _tee_to_file(iter_rows(_prepend(first, messages), include_user_info), path, state),
+                media_type=EXPORT_MEDIA_TYPES[export_format],
+                headers={**cache_headers, "Content-Disposition": f"attachment; filename={filename}"},
+                background=BackgroundTask(asyncio.to_thread, _cache_text_export, path, state, *cache_args)
+            )
+        
+        # Rows go from the Mongo cursor straight into a write-only workbook on disk,
+        # off the event loop, so memory stays flat for any project size
+        path, count = await asyncio.to_thread(
+            ExcelExportService.create_messages_excel_file,
+            Database.iter_project_messages(project_id, EXPORT_CURSOR_BATCH_SIZE),
+            project["name"],
+            include_user_info
+        )
+        if not count:
+            os.remove(path)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No messages found for this project"
             )
         
-        # Generate Excel file
-        excel_buffer = ExcelExportService.create_messages_excel(messages, project["name"])
-        filename = ExcelExportService.get_filename(project["name"])
-        
         # Log export activity
-        logging.info(f"Excel export generated for user {current_user['_id']}, project {project_id}, {len(messages)} messages")
+        logging.info(f"Excel export generated for user {current_user['_id']}, project {project_id}, {count} messages")
         
-        # Return file as streaming response
-        def iter_file():
-            yield excel_buffer.getvalue()
+        # The workbook is complete on disk, so it can be cached before a byte is sent
+        await asyncio.to_thread(Database.save_cached_export, path, *cache_args)
         
+        # Stream the file in chunks; iter_file deletes it once sent
         return StreamingResponse(
-            iter_file(),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            ExcelExportService.iter_file(path),
+            media_type=EXPORT_MEDIA_TYPES["xlsx"],
             headers={
+                **cache_headers,
                 "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                "Content-Length": str(os.path.getsize(path))
             }
         )
         
@@ -238,3 +348,128 @@ async def export_project_messages(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to export messages. Please try again."
         )
+
+# Background Export Jobs
+
+class ExportJobRequest(BaseModel):
+    format: Literal["xlsx", "csv", "ndjson"] = "xlsx"
+    include_user_info: bool = False
+    notify: bool = False  # email the user when the file is ready
+
+class ExportJobResponse(BaseModel):
+    id: str
+    status: str  # pending, processing, completed, failed, expired
+    format: str
+    created_at: str
+    completed_at: Optional[str] = None
+    row_count: Optional[int] = None
+    size: Optional[int] = None
+    expires_at: Optional[str] = None
+    download_url: Optional[str] = None
+    error: Optional[str] = None
+
+def format_export_job(job: dict) -> dict:
+    return {
+        "id": job["_id"],
+        "status": job["status"],
+        "format": job["format"],
+        "created_at": job["created_at"].isoformat(),
+        "completed_at": job["completed_at"].isoformat() if job.get("completed_at") else None,
+        "row_count": job.get("row_count"),
+        "size": job.get("size"),
+        "expires_at": job["expires_at"].isoformat() if job.get("expires_at") else None,
+        "download_url": f"/projects/{job['project_id']}/exports/{job['_id']}/download" if job["status"] == "completed" else None,
+        "error": job.get("error")
+    }
+
+async def get_owned_export_job(project_id: str, job_id: str, user_id: str) -> dict:
+    job = await AsyncDatabase.get_export_job(job_id, user_id)
+    if not job or job["project_id"] != project_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export not found"
+        )
+    return job
+
+@router.post("/{project_id}/exports", response_model=ExportJobResponse)
+async def create_export_job(
+    project_id: str,
+    request: ExportJobRequest,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue an export to be built in the background; poll it or wait for the email"""
+    
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+    
+    job_id = await AsyncDatabase.create_export_job(
+        user_id=current_user["_id"],
+        project_id=project_id,
+        export_format=request.format,
+        include_user_info=request.include_user_info,
+        notify_email=current_user["email"] if request.notify else None
+    )
+    
+    if EXPORT_INLINE_JOBS:
+        background_tasks.add_task(process_pending_export_jobs, WEB_WORKER_ID)
+    
+    job = await AsyncDatabase.get_export_job(job_id, current_user["_id"])
+    return format_export_job(job)
+
+@router.get("/{project_id}/exports/{job_id}", response_model=ExportJobResponse)
+async def get_export_job_status(
+    project_id: str,
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the status of a background export, with its download URL once completed"""
+    
+    job = await get_owned_export_job(project_id, job_id, current_user["_id"])
+    return format_export_job(job)
+
+@router.get("/{project_id}/exports/{job_id}/download")
+async def download_export(
+    project_id: str,
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream a finished background export from GridFS"""
+    
+    job = await get_owned_export_job(project_id, job_id, current_user["_id"])
+    if job["status"] == "expired":
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Export has expired, please create a new one"
+        )
+    if job["status"] != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Export is {job['status']}"
+        )
+    
+    grid_out = await AsyncDatabase.open_export_file(job["file_id"])
+    if not grid_out:
+        # Reaped between the status check and the open
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Export has expired, please create a new one"
+        )
+    
+    async def iter_chunks():
+        while chunk := await grid_out.readchunk():
+            yield chunk
+    
+    return StreamingResponse(
+        iter_chunks(),
+        media_type=EXPORT_MEDIA_TYPES[job["format"]],
+        headers={
+            "Content-Disposition": f"attachment; filename={job['filename']}",
+            "Content-Length": str(job["size"])
+        }
+    )
+
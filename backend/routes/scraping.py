@@ -1,16 +1,38 @@
-from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks
+from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks, UploadFile, File, Form, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from backend.database import Database
-from backend.auth import get_current_user
-from backend.scraper_algos import scrape
+from bson import ObjectId
+from backend.async_database import AsyncDatabase
+from backend.auth import Auth, get_current_user, get_current_user_for_stream, SSE_TICKET_EXPIRE_SECONDS
+from backend.job_events import job_event_broker, format_sse
+from backend import async_scraper_algos
+from backend.worker import process_pending_dm_jobs
+from backend.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
 from typing import List, Optional
 from datetime import datetime
 import logging
+import csv
+import io
+import os
+import re
 
 router = APIRouter(prefix="/scrape", tags=["scraping"])
 
+# Set to false when a dedicated worker (run_worker.py) drains the queue
+DM_INLINE_JOBS = os.getenv("DM_INLINE_JOBS", "true").lower() == "true"
+# Upper bound on usernames accepted by one bulk queue request
+BULK_QUEUE_MAX_ROWS = int(os.getenv("BULK_QUEUE_MAX_ROWS", "10000"))
+# Largest username upload read into memory; generous for a CSV of BULK_QUEUE_MAX_ROWS rows with a few extra columns
+BULK_QUEUE_MAX_UPLOAD_BYTES = int(os.getenv("BULK_QUEUE_MAX_UPLOAD_BYTES", str(BULK_QUEUE_MAX_ROWS * 256)))
+
+INSTAGRAM_USERNAME_RE = re.compile(r"^[a-z0-9._]{1,30}$")
+# Comment line sent on idle SSE streams so proxies keep the connection open
+SSE_KEEPALIVE_SECONDS = 15
+
 class ScrapeRequest(BaseModel):
     username: str
+    force_refresh: bool = False  # re-scrape even if a cached profile is fresh
+    new_variant: bool = False  # ask the LLM for a new DM instead of a cached one
 
 class MessageResponse(BaseModel):
     id: str
@@ -45,14 +67,14 @@ async def generate_dm_message(
         )
     
     # Check if user has available credits
-    current_credits = Database.get_user_credits(current_user["_id"])
+    current_credits = await AsyncDatabase.get_user_credits(current_user["_id"])
     if current_credits <= 0:
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
             detail="Insufficient credits. Please purchase more credits to continue generating messages."
         )
 
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -63,27 +85,30 @@ async def generate_dm_message(
     username = request.username.strip().lstrip('@')
     
     try:
-        # Use one message from allowance (subscription or credit)
-        message_used = Database.use_monthly_message(current_user["_id"])
-        if not message_used:
+        # Use one credit
+        credit_used = await AsyncDatabase.use_credit(current_user["_id"])
+        if not credit_used:
             raise HTTPException(
                 status_code=status.HTTP_402_PAYMENT_REQUIRED,
-                detail="Failed to use message allowance. Please try again or check your subscription status."
+                detail="Insufficient credits. Please purchase more credits to continue generating messages."
             )
 
         # Extract first name only for more natural messaging
         first_name = current_user["name"].split()[0] if current_user["name"] else "there"
         
-        result = scrape(
+        # Async pipeline so the worker keeps serving other requests during the scrape
+        result = await async_scraper_algos.scrape(
             username=username,
             product_info=project["product_info"],
             offer_info=project["offer_info"],
-            name=first_name
+            name=first_name,
+            force_refresh=request.force_refresh,
+            new_variant=request.new_variant
         )
         
         if not result["success"]:
-            # If scraping failed, refund the message usage (subscription or credit)
-            Database.refund_monthly_message(current_user["_id"])
+            # If scraping failed, refund the credit
+            await AsyncDatabase.add_credits(current_user["_id"], 1, "refund_failed_message")
             return {
                 "success": False,
                 "message": None,
@@ -93,7 +118,7 @@ async def generate_dm_message(
             }
         
 
-        message_id = Database.save_message(
+        message_id = await AsyncDatabase.save_message(
             project_id=project_id,
             username=username,
             generated_message=result["message"],
@@ -113,9 +138,9 @@ async def generate_dm_message(
         # Re-raise HTTP exceptions as is
         raise
     except Exception as e:
-        # For unexpected errors, refund the message if it was used
+        # For unexpected errors, refund the credit
         try:
-            Database.refund_monthly_message(current_user["_id"])
+            await AsyncDatabase.add_credits(current_user["_id"], 1, "refund_processing_error")
         except:
             pass  # If refund fails, log but don't break the error response
         
@@ -130,20 +155,34 @@ async def generate_dm_message(
 @router.get("/projects/{project_id}/messages", response_model=List[MessageResponse])
 async def get_project_messages(
     project_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
+    """Get project messages, newest first. With limit or cursor, one page whose next cursor is in X-Next-Cursor;
+    without either, every message (what the dashboard expects)."""
 
-    
-
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Project not found"
         )
     
-
-    messages = Database.get_project_messages(project_id)
+    if limit is None and cursor is None:
+        messages, next_cursor = await AsyncDatabase.get_project_messages(project_id), None
+    else:
+        try:
+            messages, next_cursor = await AsyncDatabase.get_project_messages_page(project_id, limit or DEFAULT_PAGE_SIZE, cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     return [
         {
@@ -165,17 +204,14 @@ async def get_message(
 
     
 
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Project not found"
         )
     
-
-    messages = Database.get_project_messages(project_id)
-    message = next((m for m in messages if m["_id"] == message_id), None)
-    
+    message = await AsyncDatabase.get_project_message(project_id, message_id)
     if not message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -206,39 +242,21 @@ async def update_message(
         )
     
     # Verify project exists and belongs to user
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Project not found"
         )
     
-    # Get the message to verify it exists and belongs to this project
-    messages = Database.get_project_messages(project_id)
-    message = next((m for m in messages if m["_id"] == message_id), None)
-    
-    if not message:
+    # Scoped to the project, so a message from another project is a 404
+    updated_message = await AsyncDatabase.update_message(project_id, message_id, request.generated_message.strip())
+    if not updated_message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Message not found"
         )
     
-    # Update the message
-    success = Database.update_message(message_id, request.generated_message.strip())
-    if not success:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to update message"
-        )
-    
-    # Return the updated message
-    updated_message = Database.get_message_by_id(message_id)
-    if not updated_message:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to retrieve updated message"
-        )
-    
     return {
         "id": updated_message["_id"],
         "username": updated_message["username"],
@@ -248,16 +266,50 @@ async def update_message(
     }
 
 @router.get("/messages", response_model=List[MessageResponse])
-async def get_all_user_messages(current_user: dict = Depends(get_current_user)):
+async def get_all_user_messages(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    project_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the user's messages across all projects, newest first. With limit or cursor, one page whose next cursor is
+    in X-Next-Cursor; without either, every matching message (what the dashboard and messages page expect)."""
     
-    user_projects = Database.get_user_projects(current_user["_id"])
-    all_messages = []
+    if project_id and not ObjectId.is_valid(project_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid project_id"
+        )
     
-    for project in user_projects:
-        project_messages = Database.get_project_messages(project["_id"])
-        all_messages.extend(project_messages)
+    if limit is None and cursor is None:
+        all_messages = await AsyncDatabase.get_user_messages(
+            current_user["_id"],
+            project_id=project_id,
+            since=since,
+            until=until
+        )
+        next_cursor = None
+    else:
+        try:
+            all_messages, next_cursor = await AsyncDatabase.get_user_messages_page(
+                current_user["_id"],
+                limit or DEFAULT_PAGE_SIZE,
+                cursor,
+                project_id=project_id,
+                since=since,
+                until=until
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
     
-    all_messages.sort(key=lambda x: x["created_at"], reverse=True)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     return [
         {
@@ -283,84 +335,14 @@ class DMJobResponse(BaseModel):
 
 class QueueDMRequest(BaseModel):
     username: str
+    force_refresh: bool = False  # re-scrape even if a cached profile is fresh
+    new_variant: bool = False  # ask the LLM for a new DM instead of a cached one
 
 class QueueDMResponse(BaseModel):
     job_id: str
     status: str
     message: str
 
-def process_dm_job(job_id: str):
-    """Background function to process DM generation jobs"""
-    try:
-        # Get the job
-        job = Database.get_dm_job(job_id)
-        if not job:
-            logging.error(f"Job {job_id} not found")
-            return
-        
-        # Mark as processing
-        Database.update_dm_job_status(job_id, "processing", datetime.utcnow())
-        
-        # Get project and user info
-        project = Database.get_project_by_id(job["project_id"], job["user_id"])
-        user = Database.get_user_by_id(job["user_id"])
-        
-        if not project or not user:
-            Database.fail_dm_job(job_id, "Project or user not found")
-            return
-        
-        # Check credit balance before processing
-        current_credits = Database.get_user_credits(job["user_id"])
-        if current_credits <= 0:
-            Database.fail_dm_job(job_id, "Insufficient credits")
-            return
-        
-        # Use one credit
-        credit_used = Database.use_credit(job["user_id"])
-        if not credit_used:
-            Database.fail_dm_job(job_id, "Failed to use credit")
-            return
-        
-        try:
-            # Extract first name only for more natural messaging
-            first_name = user["name"].split()[0] if user["name"] else "there"
-            
-            # Run the scraping
-            result = scrape(
-                username=job["username"],
-                product_info=project["product_info"],
-                offer_info=project["offer_info"],
-                name=first_name
-            )
-            
-            if not result["success"]:
-                # Refund credit if scraping failed (e.g., private profile)
-                Database.add_credits(job["user_id"], 1, "refund_failed_message")
-                Database.fail_dm_job(job_id, result["error"])
-                return
-            
-            # Save the message
-            message_id = Database.save_message(
-                project_id=job["project_id"],
-                username=job["username"],
-                generated_message=result["message"],
-                user_info=result["user_info"],
-                user_id=job["user_id"]
-            )
-            
-            # Complete the job
-            result["message_id"] = message_id
-            Database.complete_dm_job(job_id, result)
-            
-        except Exception as e:
-            # Refund credit on error
-            Database.add_credits(job["user_id"], 1, "refund_processing_error")
-            Database.fail_dm_job(job_id, f"Processing error: {str(e)}")
-            
-    except Exception as e:
-        logging.error(f"Error processing job {job_id}: {str(e)}")
-        Database.fail_dm_job(job_id, f"Unexpected error: {str(e)}")
-
 @router.post("/projects/{project_id}/queue", response_model=QueueDMResponse)
 async def queue_dm_generation(
     project_id: str,
@@ -377,7 +359,7 @@ async def queue_dm_generation(
         )
     
     # Check if user has available credits
-    current_credits = Database.get_user_credits(current_user["_id"])
+    current_credits = await AsyncDatabase.get_user_credits(current_user["_id"])
     if current_credits <= 0:
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
@@ -385,7 +367,7 @@ async def queue_dm_generation(
         )
 
     # Verify project exists and belongs to user
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -393,14 +375,17 @@ async def queue_dm_generation(
         )
     
     # Create the job
-    job_id = Database.create_dm_job(
+    job_id = await AsyncDatabase.create_dm_job(
         user_id=current_user["_id"],
         project_id=project_id,
-        username=request.username
+        username=request.username,
+        force_refresh=request.force_refresh,
+        new_variant=request.new_variant
     )
     
-    # Add background task to process the job
-    background_tasks.add_task(process_dm_job, job_id)
+    # Without a dedicated worker, drain the queue in the background of this process
+    if DM_INLINE_JOBS:
+        background_tasks.add_task(process_pending_dm_jobs)
     
     return {
         "job_id": job_id,
@@ -408,6 +393,175 @@ async def queue_dm_generation(
         "message": f"DM generation for @{request.username.strip().lstrip('@')} has been queued"
     }
 
+class BulkQueueRequest(BaseModel):
+    usernames: List[str]
+    force_refresh: bool = False
+    new_variant: bool = False
+
+class RejectedRow(BaseModel):
+    row: int
+    value: str
+    reason: str
+
+class BulkQueueResponse(BaseModel):
+    batch_id: Optional[str] = None
+    queued: int
+    rejected: List[RejectedRow]
+    message: str
+
+def normalize_usernames(rows: List[str]):
+    """Strip @/whitespace, lowercase and dedupe handles. Returns (usernames, rejected rows)."""
+    usernames = []
+    rejected = []
+    seen = set()
+    
+    for row, value in enumerate(rows, 1):
+        username = (value or "").strip().lstrip('@').strip().lower()
+        # Accept profile links like https://www.instagram.com/handle/
+        if "instagram.com/" in username:
+            username = username.split("instagram.com/", 1)[1].split("?", 1)[0].strip("/").split("/", 1)[0]
+        
+        if not username:
+            rejected.append({"row": row, "value": value, "reason": "Empty username"})
+        elif not INSTAGRAM_USERNAME_RE.match(username):
+            rejected.append({"row": row, "value": value, "reason": "Invalid Instagram username"})
+        elif username in seen:
+            rejected.append({"row": row, "value": value, "reason": "Duplicate username"})
+        else:
+            seen.add(username)
+            usernames.append(username)
+    
+    return usernames, rejected
+
+def parse_username_file(content: str) -> List[str]:
+    """Read handles from a TXT (one per line) or CSV file (a username/handle column, else the first column)"""
+    reader = csv.reader(io.StringIO(content))
+    rows = [row for row in reader if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+    
+    column = 0
+    header = [cell.strip().lower() for cell in rows[0]]
+    for name in ("username", "handle", "instagram", "ig"):
+        if name in header:
+            column = header.index(name)
+            rows = rows[1:]
+            break
+    
+    return [row[column] if column < len(row) else "" for row in rows]
+
+async def queue_dm_batch(
+    project_id: str,
+    rows: List[str],
+    force_refresh: bool,
+    new_variant: bool,
+    background_tasks: BackgroundTasks,
+    current_user: dict
+) -> dict:
+    if len(rows) > BULK_QUEUE_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many usernames. A single batch can contain at most {BULK_QUEUE_MAX_ROWS}."
+        )
+    
+    # Check if user has available credits
+    current_credits = await AsyncDatabase.get_user_credits(current_user["_id"])
+    if current_credits <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail="Insufficient credits. Please purchase more credits to continue generating messages."
+        )
+    
+    # Verify project exists and belongs to user
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+    
+    usernames, rejected = normalize_usernames(rows)
+    if not usernames:
+        return {
+            "batch_id": None,
+            "queued": 0,
+            "rejected": rejected,
+            "message": "No valid usernames to queue"
+        }
+    
+    batch_id = await AsyncDatabase.create_dm_job_batch(
+        user_id=current_user["_id"],
+        project_id=project_id,
+        usernames=usernames,
+        force_refresh=force_refresh,
+        new_variant=new_variant
+    )
+    
+    # Without a dedicated worker, drain the queue in the background of this process
+    if DM_INLINE_JOBS:
+        background_tasks.add_task(process_pending_dm_jobs)
+    
+    return {
+        "batch_id": batch_id,
+        "queued": len(usernames),
+        "rejected": rejected,
+        "message": f"{len(usernames)} DM generations have been queued"
+    }
+
+@router.post("/projects/{project_id}/queue/bulk", response_model=BulkQueueResponse)
+async def queue_dm_generation_bulk(
+    project_id: str,
+    request: BulkQueueRequest,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue DM generation jobs for a list of usernames in one request"""
+    
+    return await queue_dm_batch(
+        project_id,
+        request.usernames,
+        request.force_refresh,
+        request.new_variant,
+        background_tasks,
+        current_user
+    )
+
+@router.post("/projects/{project_id}/queue/bulk/upload", response_model=BulkQueueResponse)
+async def queue_dm_generation_upload(
+    project_id: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    force_refresh: bool = Form(False),
+    new_variant: bool = Form(False),
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue DM generation jobs from an uploaded CSV or TXT file of usernames"""
+    
+    # Read one byte past the cap so an oversized file is rejected without holding all of it
+    raw = await file.read(BULK_QUEUE_MAX_UPLOAD_BYTES + 1)
+    if len(raw) > BULK_QUEUE_MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large. Uploads can be at most {BULK_QUEUE_MAX_UPLOAD_BYTES // 1024} KB."
+        )
+    
+    try:
+        content = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be UTF-8 encoded CSV or TXT"
+        )
+    
+    return await queue_dm_batch(
+        project_id,
+        parse_username_file(content),
+        force_refresh,
+        new_variant,
+        background_tasks,
+        current_user
+    )
+
 @router.get("/jobs/{job_id}", response_model=DMJobResponse)
 async def get_dm_job_status(
     job_id: str,
@@ -415,7 +569,7 @@ async def get_dm_job_status(
 ):
     """Get the status of a DM generation job"""
     
-    job = Database.get_dm_job(job_id)
+    job = await AsyncDatabase.get_dm_job(job_id)
     if not job:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -442,19 +596,37 @@ async def get_dm_job_status(
 @router.get("/projects/{project_id}/jobs", response_model=List[DMJobResponse])
 async def get_project_dm_jobs(
     project_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get all DM generation jobs for a project"""
+    """Get DM generation jobs for a project, newest first. With limit or cursor, one page whose next cursor is in
+    X-Next-Cursor; without either, every job (what the project page polls)."""
     
     # Verify project exists and belongs to user
-    project = Database.get_project_by_id(project_id, current_user["_id"])
+    project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Project not found"
         )
     
-    jobs = Database.get_project_dm_jobs(project_id, current_user["_id"])
+    if limit is None and cursor is None:
+        jobs, next_cursor = await AsyncDatabase.get_project_dm_jobs(project_id, current_user["_id"]), None
+    else:
+        try:
+            jobs, next_cursor = await AsyncDatabase.get_project_dm_jobs_page(
+                project_id, current_user["_id"], limit or DEFAULT_PAGE_SIZE, cursor
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     return [
         {
@@ -476,7 +648,7 @@ async def cancel_dm_job(
 ):
     """Cancel a pending DM generation job"""
     
-    job = Database.get_dm_job(job_id)
+    job = await AsyncDatabase.get_dm_job(job_id)
     if not job:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -497,7 +669,7 @@ async def cancel_dm_job(
             detail="Can only cancel pending jobs"
         )
     
-    success = Database.delete_dm_job(job_id, current_user["_id"])
+    success = await AsyncDatabase.delete_dm_job(job_id, current_user["_id"])
     if not success:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -505,3 +677,52 @@ async def cancel_dm_job(
         )
     
     return {"message": "Job cancelled successfully"}
+
+@router.post("/events/ticket")
+async def create_events_ticket(current_user: dict = Depends(get_current_user)):
+    """Exchange the access token for a short-lived ticket to pass as /scrape/events?ticket="""
+    
+    return {
+        "ticket": Auth.create_stream_ticket(current_user["_id"]),
+        "expires_in": SSE_TICKET_EXPIRE_SECONDS
+    }
+
+@router.get("/events")
+async def stream_job_events(
+    request: Request,
+    project_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user_for_stream)
+):
+    """Server-sent events for DM job state changes and batch progress"""
+    
+    if project_id:
+        # Verify project exists and belongs to user
+        project = await AsyncDatabase.get_project_by_id(project_id, current_user["_id"])
+        if not project:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Project not found"
+            )
+    
+    subscription = job_event_broker.subscribe(current_user["_id"], project_id)
+    
+    async def event_stream():
+        try:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                payload = await subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if payload is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield format_sse(payload)
+        finally:
+            job_event_broker.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # disable proxy buffering so events arrive immediately
+        }
+    )
@@ -0,0 +1,65 @@
+from backend.database import Database
+from dotenv import load_dotenv
+from datetime import datetime
+import logging
+import os
+
+load_dotenv()
+
+# Max jobs one user may have processing at once across all workers (0 = no cap)
+DM_JOBS_PER_USER_LIMIT = int(os.getenv("DM_JOBS_PER_USER_LIMIT", "0"))
+
+
+class DMJobScheduler:
+    """
+    Fair-share scheduler for DM generation jobs.
+
+    Users with pending work are ordered by their highest job priority, then by
+    how many jobs they already have processing, then by their oldest job at that
+    priority. Both summaries cost about the number of active users, not the
+    size of the backlog (see get_pending_dm_job_users). Jobs are claimed one
+    per user per round, so a user with a 10,000-lead batch gets the same share
+    of each claim as a user with a single lead.
+    """
+
+    @staticmethod
+    def claim_jobs(limit: int, worker_id: str, lease_seconds: int, per_user_limit: int = DM_JOBS_PER_USER_LIMIT) -> list:
+        if limit <= 0:
+            return []
+
+        pending_users = Database.get_pending_dm_job_users()
+        if not pending_users:
+            return []
+
+        processing = Database.get_processing_dm_job_counts()
+        pending_users.sort(key=lambda user: (
+            -(user.get("priority") or 0),
+            processing.get(user["_id"], 0),
+            user.get("oldest") or datetime.utcnow()
+        ))
+
+        jobs = []
+        active_users = [user["_id"] for user in pending_users]
+        while active_users and len(jobs) < limit:
+            next_round = []
+            for user_id in active_users:
+                if len(jobs) >= limit:
+                    break
+
+                if per_user_limit and processing.get(user_id, 0) >= per_user_limit:
+                    continue
+
+                job = Database.claim_next_dm_job(worker_id, lease_seconds, user_id=user_id)
+                if not job:
+                    # Drained by us or another worker
+                    continue
+
+                jobs.append(job)
+                processing[user_id] = processing.get(user_id, 0) + 1
+                next_round.append(user_id)
+
+            active_users = next_round
+
+        if jobs:
+            logging.info(f"Scheduler claimed {len(jobs)} DM jobs for {len({job['user_id'] for job in jobs})} users")
+        return jobs
@@ -1,6 +1,8 @@
 from apify_client import ApifyClient
 from dotenv import load_dotenv
 from openai import OpenAI
+from backend.profile_cache import ProfileCache
+from backend.completion_cache import CompletionCache
 import os
 
 load_dotenv()
@@ -8,6 +10,10 @@ load_dotenv()
 apify = ApifyClient(os.getenv("APIFY_API_TOKEN"))
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+MODEL = "gpt-4.1-mini"
+# Bump whenever business_prompt changes so cached completions are not reused
+PROMPT_VERSION = "1"
+
 
 business_prompt = """
 You are a master direct message (DM) copywriter specialized in Instagram outreach. 
@@ -78,31 +84,89 @@ You will be provided with your name, which you are to add to the end of the DM.
 - Skip gracefully if any info is missing.  
 - Return only the finished DM text, ready to send.  
 """
+def parse_profile_item(item):
+    latest_posts = item.get("latestPosts", [])
+    first_5_captions = []
+    for i, post in enumerate(latest_posts):
+        if i >= 5: 
+            break
+        caption = post.get("caption", "")
+        first_5_captions.append(caption)
+    
+    return {
+        "fullName": item.get("fullName", "NO NAME"),
+        "biography": item.get("biography", "NO BIOGRAPHY"), 
+        "private": item.get("private", False),
+        "isBusinessAccount": item.get("isBusinessAccount", False),
+        "followersCount": item.get("followersCount", 0),
+        "postsCount": item.get("postsCount", 0),
+        "first_5_captions": first_5_captions
+    }
+
+def item_username(item):
+    """Work out which requested username a dataset item belongs to"""
+    username = item.get("username")
+    if not username:
+        # Error items only echo back the input URL
+        input_url = item.get("inputUrl") or item.get("url") or ""
+        username = input_url.rstrip("/").rsplit("/", 1)[-1]
+    return username.strip().lstrip('@').lower()
+
 def scrape_instagram_profile(username):
     run_input = { "usernames": [username] }
     run = apify.actor("apify/instagram-profile-scraper").call(run_input=run_input)
     myDict = {}
     for item in apify.dataset(run["defaultDatasetId"]).iterate_items():
-        latest_posts = item.get("latestPosts", [])
-        first_5_captions = []
-        for i, post in enumerate(latest_posts):
-            if i >= 5: 
-                break
-            caption = post.get("caption", "")
-            first_5_captions.append(caption)
-        
-        myDict = {
-            "fullName": item.get("fullName", "NO NAME"),
-            "biography": item.get("biography", "NO BIOGRAPHY"), 
-            "private": item.get("private", False),
-            "isBusinessAccount": item.get("isBusinessAccount", False),
-            "followersCount": item.get("followersCount", 0),
-            "postsCount": item.get("postsCount", 0),
-            "first_5_captions": first_5_captions
-        }
+        myDict = parse_profile_item(item)
     return myDict
 
+def map_profile_items(usernames, items):
+    """
+    Map dataset items from a batch run back to the requested usernames.
+    Usernames the actor returned nothing (or an error item) for get
+    {"error": "..."} so callers can report them individually.
+    """
+    wanted = {username.strip().lstrip('@').lower() for username in usernames}
+    profiles = {}
+    for item in items:
+        username = item_username(item)
+        if username not in wanted:
+            continue
+        if item.get("error"):
+            profiles[username] = {"error": item.get("errorDescription") or item["error"]}
+        else:
+            profiles[username] = parse_profile_item(item)
+    
+    for username in wanted:
+        profiles.setdefault(username, {"error": "Profile not found"})
+    
+    return profiles
+
+def scrape_instagram_profiles(usernames):
+    """
+    Scrape many profiles with a single actor run.
+    
+    Returns a dict keyed by lowercase username. Each value is either the
+    profile dict produced by scrape_instagram_profile or {"error": "..."}.
+    """
+    usernames = list(dict.fromkeys(u.strip().lstrip('@').lower() for u in usernames if u.strip()))
+    if not usernames:
+        return {}
+    
+    try:
+        run = apify.actor("apify/instagram-profile-scraper").call(run_input={"usernames": usernames})
+        if not run:
+            raise Exception("Actor run did not start")
+        # iterate_items pages through the dataset instead of loading it all at once
+        items = apify.dataset(run["defaultDatasetId"]).iterate_items()
+        return map_profile_items(usernames, items)
+    except Exception as e:
+        return {username: {"error": f"An error occurred: {str(e)}"} for username in usernames}
+
 def filter_user(user_dict):
+    if user_dict.get("error"):
+        return {"message": user_dict["error"]}
+    
     if user_dict.get("private"):
         return {"message": "Failed to scan private account"}
     
@@ -115,38 +179,81 @@ def filter_user(user_dict):
     }
 
 
-def construct_business_message(user_info, product_info, offer_info, name):
+def get_filtered_profiles(usernames, force_refresh=False):
+    """
+    Get filtered profiles for many usernames, serving fresh ones from the
+    profile cache and scraping the rest with a single actor run.
+    
+    Returns a dict keyed by lowercase username with filter_user output,
+    so failures look like {"message": "..."}.
+    """
+    usernames = list(dict.fromkeys(u.strip().lstrip('@').lower() for u in usernames if u.strip()))
+    profiles = {}
+    to_scrape = []
+    
+    for username in usernames:
+        cached = None if force_refresh else ProfileCache.get(username)
+        if cached is not None:
+            profiles[username] = cached
+        else:
+            to_scrape.append(username)
+    
+    if to_scrape:
+        for username, user_info in scrape_instagram_profiles(to_scrape).items():
+            filtered_user_info = filter_user(user_info)
+            # Only successful scrapes are cached so failures get retried
+            if "message" not in filtered_user_info:
+                ProfileCache.set(username, filtered_user_info)
+            profiles[username] = filtered_user_info
+    
+    return profiles
+
+def get_filtered_profile(username, force_refresh=False):
+    username = username.strip().lstrip('@').lower()
+    profiles = get_filtered_profiles([username], force_refresh=force_refresh)
+    return profiles.get(username, {"message": "Profile not found"})
+
+def build_prompt_messages(user_info, product_info, offer_info, name):
+    return [
+        {"role": "system", "content": business_prompt},
+        {"role": "user", "content": f"User Info: {user_info}, Product Info: {product_info}, Offer Info: {offer_info}, Name: {name}"}
+    ]
+
+def construct_business_message(user_info, product_info, offer_info, name, new_variant=False):
+    # new_variant skips the lookup (the user asked for a fresh DM) but still caches the result
+    cache_key = CompletionCache.make_key(MODEL, PROMPT_VERSION, user_info, product_info, offer_info, name)
+    if not new_variant:
+        cached = CompletionCache.get(cache_key)
+        if cached is not None:
+            return cached
+    
     response = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[
-            {"role": "system", "content": business_prompt},
-            {"role": "user", "content": f"User Info: {user_info}, Product Info: {product_info}, Offer Info: {offer_info}, Name: {name}"}
-        ]
+        model=MODEL,
+        messages=build_prompt_messages(user_info, product_info, offer_info, name)
     )
-    return response.choices[0].message.content
-
-def scrape(username, product_info, offer_info, name):
+    message = response.choices[0].message.content
+    CompletionCache.set(cache_key, message)
+    return message
 
+def generate_from_profile(user_info, product_info, offer_info, name, new_variant=False):
+    """Run the LLM half of the pipeline on a profile already passed through filter_user"""
     try:
 
-        user_info = scrape_instagram_profile(username)
-        
-        filtered_user_info = filter_user(user_info)
-        
-        if "message" in filtered_user_info:
+        if "message" in user_info:
+            # filter_user's failure shape (private, missing or failed lookup)
             return {
                 "success": False,
                 "message": None,
                 "user_info": None,
-                "error": filtered_user_info["message"]
+                "error": user_info["message"]
             }
         
-        generated_message = construct_business_message(filtered_user_info, product_info, offer_info, name)
+        generated_message = construct_business_message(user_info, product_info, offer_info, name, new_variant=new_variant)
         
         return {
             "success": True,
             "message": generated_message,
-            "user_info": filtered_user_info,
+            "user_info": user_info,
             "error": None
         }
         
@@ -158,6 +265,22 @@ def scrape(username, product_info, offer_info, name):
             "error": f"An error occurred: {str(e)}"
         }
 
+def scrape(username, product_info, offer_info, name, force_refresh=False, new_variant=False):
+
+    try:
+
+        user_info = get_filtered_profile(username, force_refresh=force_refresh)
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "message": None,
+            "user_info": None,
+            "error": f"An error occurred: {str(e)}"
+        }
+    
+    return generate_from_profile(user_info, product_info, offer_info, name, new_variant=new_variant)
+
 def main():
     print("=" * 60)
     print("📱 INSTAGRAM DM GENERATOR")
@@ -0,0 +1,125 @@
+from backend.database import Database
+from backend.payment_service import PaymentService
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Any, Dict
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+
+load_dotenv()
+
+# How long a claimed event belongs to its consumer (fulfillment is one Stripe call and a few writes)
+STRIPE_EVENT_LEASE_SECONDS = int(os.getenv("STRIPE_EVENT_LEASE_SECONDS", "120"))
+# Processing attempts before an event is marked failed and left for a replay
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv("STRIPE_EVENT_MAX_ATTEMPTS", "8"))
+# Wait before the second attempt; doubles per attempt after that
+STRIPE_EVENT_RETRY_BACKOFF_SECONDS = float(os.getenv("STRIPE_EVENT_RETRY_BACKOFF_SECONDS", "30"))
+# How often run_worker.py looks for due events
+STRIPE_EVENT_POLL_SECONDS = float(os.getenv("STRIPE_EVENT_POLL_SECONDS", "2"))
+# With inline processing, how often the web process retries due events without a webhook to trigger it
+STRIPE_EVENT_INLINE_POLL_SECONDS = float(os.getenv("STRIPE_EVENT_INLINE_POLL_SECONDS", "30"))
+# Set to false when run_worker.py processes Stripe events; follows DM_INLINE_JOBS by default
+STRIPE_EVENT_INLINE_PROCESSING = os.getenv("STRIPE_EVENT_INLINE_PROCESSING", os.getenv("DM_INLINE_JOBS", "true")).lower() == "true"
+
+FULFILLMENT_EVENT_TYPES = ("checkout.session.completed", "checkout.session.async_payment_succeeded")
+
+_stats = {"processed": 0, "retried": 0, "failed": 0}
+
+
+def handle_stripe_event(event: Dict[str, Any]) -> bool:
+    """Fulfill one Stripe event (blocking); True when it needs no further processing"""
+    if event["type"] not in FULFILLMENT_EVENT_TYPES:
+        logging.info(f"Unhandled event type: {event['type']}")
+        return True
+
+    session = event["data"]["object"]
+    session_id = session["id"]
+
+    # Delayed payment methods complete checkout unpaid; async_payment_succeeded follows once the money arrives
+    if event["type"] == "checkout.session.completed" and session.get("payment_status") != "paid":
+        logging.info(f"Checkout session {session_id} completed awaiting payment")
+        return True
+
+    logging.info(f"Processing {event['type']} for session: {session_id}")
+    return PaymentService.handle_successful_payment(session_id)
+
+async def process_stripe_event(stored: Dict[str, Any]) -> bool:
+    """Process one claimed event, then mark it processed, schedule a retry or mark it failed"""
+    try:
+        processed = await asyncio.to_thread(handle_stripe_event, json.loads(stored["payload"]))
+        error = None if processed else "Payment could not be fulfilled (see logs)"
+    except Exception as e:
+        processed = False
+        error = f"Processing error: {str(e)}"
+
+    if processed:
+        _stats["processed"] += 1
+        await asyncio.to_thread(Database.mark_stripe_event_processed, stored["event_id"], stored["worker_id"])
+        return True
+
+    if stored["attempts"] >= STRIPE_EVENT_MAX_ATTEMPTS:
+        _stats["failed"] += 1
+        logging.error(f"Stripe event {stored['event_id']} ({stored['type']}) failed after {stored['attempts']} attempts: {error}")
+        await asyncio.to_thread(Database.fail_stripe_event, stored["event_id"], stored["worker_id"], error)
+        return False
+
+    _stats["retried"] += 1
+    backoff = STRIPE_EVENT_RETRY_BACKOFF_SECONDS * (2 ** (stored["attempts"] - 1))
+    await asyncio.to_thread(
+        Database.retry_stripe_event, stored["event_id"], stored["worker_id"], error, datetime.utcnow() + timedelta(seconds=backoff)
+    )
+    return False
+
+async def process_pending_stripe_events(worker_id: str) -> int:
+    """Process every due event, one at a time; returns how many succeeded (claim_payment_fulfillment guards against double credits across processes)"""
+    requeued = await asyncio.to_thread(Database.requeue_expired_stripe_events)
+    if requeued:
+        logging.warning(f"Requeued {requeued} Stripe events whose consumer died")
+
+    processed = 0
+    while True:
+        stored = await asyncio.to_thread(Database.claim_next_stripe_event, worker_id, STRIPE_EVENT_LEASE_SECONDS)
+        if not stored:
+            return processed
+        processed += await process_stripe_event(stored)
+
+async def run_inline_consumer(worker_id: str) -> None:
+    """Retry loop for the web process when run_worker.py is not processing Stripe events"""
+    while True:
+        await asyncio.sleep(STRIPE_EVENT_INLINE_POLL_SECONDS)
+        try:
+            await process_pending_stripe_events(worker_id)
+        except Exception as e:
+            logging.error(f"Inline Stripe event processing failed: {str(e)}")
+
+def stripe_event_stats() -> Dict[str, Any]:
+    return dict(_stats)
+
+def main():
+    parser = argparse.ArgumentParser(description="DMify Stripe webhook events")
+    parser.add_argument("--process-once", action="store_true", help="process every due event and exit")
+    parser.add_argument("--list-failed", action="store_true", help="show the most recent failed events")
+    parser.add_argument("--replay", nargs="+", metavar="EVENT_ID", help="queue these events again, even if they were processed")
+    parser.add_argument("--replay-failed", action="store_true", help="queue every failed event again with fresh attempts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.list_failed:
+        for event in Database.get_failed_stripe_events():
+            print(f"{event['event_id']}  {event['type']}  attempts={event['attempts']}  {event['created_at']:%Y-%m-%d %H:%M}  {event['last_error']}")
+    if args.replay:
+        print(f"Queued {Database.replay_stripe_events(args.replay)} of {len(args.replay)} events")
+    if args.replay_failed:
+        print(f"Queued {Database.replay_stripe_events()} failed events")
+    if args.process_once:
+        worker_id = f"cli:{socket.gethostname()}:{os.getpid()}"
+        print(f"Processed {asyncio.run(process_pending_stripe_events(worker_id))} events")
+    if not (args.list_failed or args.replay or args.replay_failed or args.process_once):
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
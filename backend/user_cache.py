@@ -0,0 +1,36 @@
+from backend.cache import TTLCache
+from dotenv import load_dotenv
+from typing import Optional, Dict, Any
+import os
+
+load_dotenv()
+
+# Kept short: other web processes only see a password change or deletion once this expires
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+_cache = TTLCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+
+
+class UserCache:
+    """Per-process cache of authenticated users by id, so get_current_user skips Mongo on most requests"""
+
+    @staticmethod
+    def get(user_id: str) -> Optional[Dict[str, Any]]:
+        user = _cache.get(user_id)
+        # Copy so a route mutating current_user cannot corrupt the cached entry
+        return dict(user) if user is not None else None
+
+    @staticmethod
+    def set(user: Dict[str, Any]) -> None:
+        # The password hash is never needed after authentication
+        cached = {key: value for key, value in user.items() if key != "password_hash"}
+        _cache.set(user["_id"], cached)
+
+    @staticmethod
+    def invalidate(user_id: str) -> None:
+        _cache.delete(user_id)
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        return _cache.stats()
@@ -0,0 +1,352 @@
+from backend.database import Database
+from backend.scheduler import DMJobScheduler
+from backend.export_jobs import process_export_job, reap_export_jobs, EXPORT_JOB_LEASE_SECONDS, EXPORT_WORKER_CONCURRENCY
+from backend import async_scraper_algos
+from backend.email_transport import close_email_transport
+from backend.email_outbox import dispatch_pending_emails, EMAIL_DISPATCH_POLL_SECONDS
+from backend.stripe_events import process_pending_stripe_events, STRIPE_EVENT_POLL_SECONDS
+from dotenv import load_dotenv
+from typing import Optional
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+load_dotenv()
+
+# How many queued jobs share one Apify actor run
+DM_JOB_BATCH_SIZE = int(os.getenv("DM_JOB_BATCH_SIZE", "10"))
+# How many jobs a worker process keeps in flight at once
+DM_WORKER_CONCURRENCY = int(os.getenv("DM_WORKER_CONCURRENCY", "50"))
+# How long a claimed job belongs to its worker before others may take it over
+DM_JOB_LEASE_SECONDS = int(os.getenv("DM_JOB_LEASE_SECONDS", "300"))
+# Idle sleep between polls when the queue is empty
+DM_WORKER_POLL_SECONDS = float(os.getenv("DM_WORKER_POLL_SECONDS", "2"))
+# Claims per job before the reaper gives up on it, fails it and refunds its credit
+DM_JOB_MAX_ATTEMPTS = int(os.getenv("DM_JOB_MAX_ATTEMPTS", "3"))
+# How often a worker looks for jobs whose lease expired
+DM_REAPER_INTERVAL_SECONDS = float(os.getenv("DM_REAPER_INTERVAL_SECONDS", "60"))
+
+# Lease owner id for jobs drained inside a web process
+WEB_WORKER_ID = f"web:{socket.gethostname()}:{os.getpid()}"
+
+
+async def reserve_dm_job(job: dict) -> Optional[dict]:
+    """Load project/user for a claimed job and take its credit. Returns None if the job was failed."""
+    job_id = job["_id"]
+
+    # Get project and user info
+    project = await asyncio.to_thread(Database.get_project_by_id, job["project_id"], job["user_id"])
+    user = await asyncio.to_thread(Database.get_user_by_id, job["user_id"])
+
+    if not project or not user:
+        await asyncio.to_thread(Database.fail_dm_job, job_id, "Project or user not found", job.get("worker_id"))
+        return None
+
+    # A retried job (lease expired mid-run) already paid for itself
+    if job.get("credit_used") and not job.get("credit_refunded"):
+        return {"job": job, "project": project, "user": user}
+
+    # Check credit balance before processing
+    current_credits = await asyncio.to_thread(Database.get_user_credits, job["user_id"])
+    if current_credits <= 0:
+        await asyncio.to_thread(Database.fail_dm_job, job_id, "Insufficient credits", job.get("worker_id"))
+        return None
+
+    # Use one credit
+    credit_used = await asyncio.to_thread(Database.use_credit, job["user_id"])
+    if not credit_used:
+        await asyncio.to_thread(Database.fail_dm_job, job_id, "Failed to use credit", job.get("worker_id"))
+        return None
+    await asyncio.to_thread(Database.mark_dm_job_credit_used, job_id)
+
+    return {"job": job, "project": project, "user": user}
+
+async def finish_dm_job(reserved: dict, profile: dict):
+    """Generate and save the DM for a reserved job from its filtered profile"""
+    job = reserved["job"]
+    project = reserved["project"]
+    user = reserved["user"]
+    job_id = job["_id"]
+
+    try:
+        # filter_user reports private/missing/failed lookups as {"message": ...}; nothing to generate from
+        profile_error = profile.get("message") or profile.get("error")
+        if profile_error:
+            if await asyncio.to_thread(Database.fail_dm_job, job_id, profile_error, job.get("worker_id")):
+                await asyncio.to_thread(Database.refund_dm_job_credit, job_id, "refund_failed_message")
+            return
+
+        # Extract first name only for more natural messaging
+        first_name = user["name"].split()[0] if user["name"] else "there"
+
+        result = await async_scraper_algos.generate_from_profile(
+            user_info=profile,
+            product_info=project["product_info"],
+            offer_info=project["offer_info"],
+            name=first_name,
+            new_variant=job.get("new_variant", False)
+        )
+
+        if not result["success"]:
+            # Refund credit if scraping failed (e.g., private profile)
+            if await asyncio.to_thread(Database.fail_dm_job, job_id, result["error"], job.get("worker_id")):
+                await asyncio.to_thread(Database.refund_dm_job_credit, job_id, "refund_failed_message")
+            return
+
+        # Save the message
+        message_id = await asyncio.to_thread(
+            Database.save_message,
+            project_id=job["project_id"],
+            username=job["username"],
+            generated_message=result["message"],
+            user_info=result["user_info"],
+            user_id=job["user_id"]
+        )
+
+        # Complete the job
+        result["message_id"] = message_id
+        if not await asyncio.to_thread(Database.complete_dm_job, job_id, result, job.get("worker_id")):
+            logging.warning(f"Job {job_id} lost its lease before completing")
+
+    except Exception as e:
+        # Refund credit on error
+        if await asyncio.to_thread(Database.fail_dm_job, job_id, f"Processing error: {str(e)}", job.get("worker_id")):
+            await asyncio.to_thread(Database.refund_dm_job_credit, job_id, "refund_processing_error")
+
+async def heartbeat_dm_jobs(jobs: list):
+    """Keep renewing the lease on claimed jobs until cancelled"""
+    by_worker = {}
+    for job in jobs:
+        by_worker.setdefault(job.get("worker_id"), []).append(job["_id"])
+
+    while True:
+        await asyncio.sleep(DM_JOB_LEASE_SECONDS / 3)
+        for worker_id, job_ids in by_worker.items():
+            await asyncio.to_thread(Database.renew_dm_job_leases, job_ids, worker_id, DM_JOB_LEASE_SECONDS)
+
+async def reap_expired_dm_jobs():
+    counts = await asyncio.to_thread(Database.requeue_expired_dm_jobs, DM_JOB_LEASE_SECONDS, DM_JOB_MAX_ATTEMPTS)
+    if counts["requeued"] or counts["failed"]:
+        logging.warning(f"Reaper requeued {counts['requeued']} and failed {counts['failed']} expired DM jobs")
+    return counts
+
+async def process_dm_job_batch(jobs: list):
+    """Process claimed jobs with one actor run for all of their usernames"""
+    heartbeat = asyncio.create_task(heartbeat_dm_jobs(jobs))
+    try:
+        await _process_dm_job_batch(jobs)
+    finally:
+        heartbeat.cancel()
+
+async def _process_dm_job_batch(jobs: list):
+    reserved_jobs = []
+    for job in jobs:
+        try:
+            reserved = await reserve_dm_job(job)
+            if reserved:
+                reserved_jobs.append(reserved)
+        except Exception as e:
+            logging.error(f"Error processing job {job['_id']}: {str(e)}")
+            if await asyncio.to_thread(Database.fail_dm_job, job["_id"], f"Unexpected error: {str(e)}", job.get("worker_id")):
+                await asyncio.to_thread(Database.refund_dm_job_credit, job["_id"], "refund_processing_error")
+
+    if not reserved_jobs:
+        return
+
+    # One actor run per group; cached profiles skip the actor entirely
+    profiles = await async_scraper_algos.get_filtered_profiles(
+        [r["job"]["username"] for r in reserved_jobs if not r["job"].get("force_refresh")]
+    )
+    profiles.update(await async_scraper_algos.get_filtered_profiles(
+        [r["job"]["username"] for r in reserved_jobs if r["job"].get("force_refresh")],
+        force_refresh=True
+    ))
+
+    # The LLM calls for a batch run concurrently
+    await asyncio.gather(*[
+        finish_dm_job(reserved, profiles.get(reserved["job"]["username"].lower(), {"message": "Profile not found"}))
+        for reserved in reserved_jobs
+    ])
+
+async def process_pending_dm_jobs():
+    """Drain pending DM jobs in batches from inside the web process"""
+    # Without a dedicated worker nobody else recovers jobs left behind by a restart
+    await reap_expired_dm_jobs()
+
+    while True:
+        jobs = await asyncio.to_thread(
+            DMJobScheduler.claim_jobs, DM_JOB_BATCH_SIZE, WEB_WORKER_ID, DM_JOB_LEASE_SECONDS
+        )
+        if not jobs:
+            return
+
+        logging.info(f"Processing batch of {len(jobs)} DM jobs")
+        await process_dm_job_batch(jobs)
+
+
+class DMWorker:
+    """
+    Standalone worker that claims DM jobs through DMJobScheduler and keeps up to
+    `concurrency` in flight, plus up to EXPORT_WORKER_CONCURRENCY export jobs,
+    and sends queued email from the outbox and fulfills stored Stripe events
+    """
+
+    def __init__(self, concurrency: int = DM_WORKER_CONCURRENCY, batch_size: int = DM_JOB_BATCH_SIZE):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.in_flight = 0
+        self.exports_in_flight = 0
+        self.dispatching_email = False
+        self.processing_stripe_events = False
+        self._tasks = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        logging.info(f"Worker {self.worker_id} stopping, waiting for {self.in_flight} jobs")
+        self._stopping.set()
+
+    async def _run_batch(self, jobs: list):
+        try:
+            await process_dm_job_batch(jobs)
+        except Exception as e:
+            logging.error(f"Worker {self.worker_id} batch failed: {str(e)}")
+        finally:
+            self.in_flight -= len(jobs)
+
+    async def _run_email_dispatch(self):
+        try:
+            await dispatch_pending_emails(self.worker_id)
+        except Exception as e:
+            logging.error(f"Worker {self.worker_id} email dispatch failed: {str(e)}")
+        finally:
+            self.dispatching_email = False
+
+    async def _run_stripe_events(self):
+        try:
+            await process_pending_stripe_events(self.worker_id)
+        except Exception as e:
+            logging.error(f"Worker {self.worker_id} Stripe event processing failed: {str(e)}")
+        finally:
+            self.processing_stripe_events = False
+
+    async def _run_export(self, job: dict):
+        try:
+            await process_export_job(job)
+        finally:
+            self.exports_in_flight -= 1
+
+    def _start(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _claim_export(self) -> bool:
+        """Start one pending export if there is a free export slot; returns True if one was claimed"""
+        if self.exports_in_flight >= EXPORT_WORKER_CONCURRENCY:
+            return False
+
+        job = await asyncio.to_thread(Database.claim_next_export_job, self.worker_id, EXPORT_JOB_LEASE_SECONDS)
+        if not job:
+            return False
+
+        logging.info(f"Worker {self.worker_id} claimed export job {job['_id']}")
+        self.exports_in_flight += 1
+        self._start(self._run_export(job))
+        return True
+
+    async def _wait(self, timeout: float):
+        """Sleep until a batch finishes, a stop is requested, or the timeout passes"""
+        waiters = set(self._tasks)
+        stop_waiter = asyncio.create_task(self._stopping.wait())
+        waiters.add(stop_waiter)
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        stop_waiter.cancel()
+
+    async def run(self):
+        logging.info(f"Worker {self.worker_id} started (concurrency={self.concurrency}, batch_size={self.batch_size})")
+
+        last_reap = 0.0
+        last_email_dispatch = 0.0
+        last_stripe_poll = 0.0
+        loop = asyncio.get_running_loop()
+
+        while not self._stopping.is_set():
+            if loop.time() - last_reap >= DM_REAPER_INTERVAL_SECONDS:
+                last_reap = loop.time()
+                await reap_expired_dm_jobs()
+                await reap_export_jobs()
+
+            # One dispatch pass at a time; it sends every due email concurrently, then returns
+            if not self.dispatching_email and loop.time() - last_email_dispatch >= EMAIL_DISPATCH_POLL_SECONDS:
+                last_email_dispatch = loop.time()
+                self.dispatching_email = True
+                self._start(self._run_email_dispatch())
+
+            if not self.processing_stripe_events and loop.time() - last_stripe_poll >= STRIPE_EVENT_POLL_SECONDS:
+                last_stripe_poll = loop.time()
+                self.processing_stripe_events = True
+                self._start(self._run_stripe_events())
+
+            # Exports have their own slots so a large export never starves DM generation
+            claimed_export = await self._claim_export()
+
+            free_slots = self.concurrency - self.in_flight
+            if free_slots <= 0:
+                await self._wait(DM_WORKER_POLL_SECONDS)
+                continue
+
+            jobs = await asyncio.to_thread(
+                DMJobScheduler.claim_jobs,
+                min(free_slots, self.batch_size),
+                self.worker_id,
+                DM_JOB_LEASE_SECONDS
+            )
+            if not jobs:
+                if not claimed_export:
+                    await self._wait(DM_WORKER_POLL_SECONDS)
+                continue
+
+            logging.info(f"Worker {self.worker_id} claimed {len(jobs)} DM jobs")
+            self.in_flight += len(jobs)
+            self._start(self._run_batch(jobs))
+
+        # Let claimed jobs finish so they are not left in processing
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        logging.info(f"Worker {self.worker_id} stopped")
+
+
+async def run_worker(concurrency: int, batch_size: int):
+    worker = DMWorker(concurrency=concurrency, batch_size=batch_size)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        # Export-ready emails share one pooled HTTP client per process
+        await close_email_transport()
+
+def main():
+    parser = argparse.ArgumentParser(description="DMify DM generation worker")
+    parser.add_argument("--concurrency", type=int, default=DM_WORKER_CONCURRENCY, help="jobs kept in flight at once")
+    parser.add_argument("--batch-size", type=int, default=DM_JOB_BATCH_SIZE, help="jobs per Apify actor run")
+    parser.add_argument("--reap-once", action="store_true", help="requeue/fail jobs with expired leases, drop expired exports and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.reap_once:
+        print(asyncio.run(reap_expired_dm_jobs()))
+        print(asyncio.run(reap_export_jobs()))
+        return
+
+    asyncio.run(run_worker(args.concurrency, args.batch_size))
+
+if __name__ == "__main__":
+    main()
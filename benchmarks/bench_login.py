@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Login throughput versus concurrency.
+
+In-process (default): runs N concurrent bcrypt verifications the way the login
+route does, through the bounded PasswordHasher pool, and reports throughput,
+latency, shed requests and the worst event loop stall. --inline runs bcrypt on
+the event loop instead, which is how login behaved before the pool.
+
+    python benchmarks/bench_login.py
+    python benchmarks/bench_login.py --inline
+    PASSWORD_HASH_WORKERS=8 python benchmarks/bench_login.py --concurrency 1 8 32
+
+Against a running server (needs a verified account):
+
+    python benchmarks/bench_login.py --url http://localhost:8000 --email a@b.com --password secret123
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from backend.password_hasher import PasswordHasher, PasswordHasherBusy, pwd_context, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+
+BENCH_PASSWORD = "benchmark-password-1"
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+def print_header():
+    print(f"{'concurrency':>11} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'shed':>6} {'max loop stall ms':>18}")
+
+def print_row(concurrency, ok, seconds, latencies, shed, stall):
+    print(f"{concurrency:>11} {ok / seconds:>9.1f} {percentile(latencies, 0.50):>8.0f} "
+          f"{percentile(latencies, 0.95):>8.0f} {shed:>6} {stall:>18}")
+
+async def run_in_process(concurrency: int, duration: float, password_hash: str, inline: bool):
+    deadline = time.perf_counter() + duration
+    latencies = []
+    shed = 0
+    max_stall = 0.0
+
+    async def watch_loop():
+        # A 10 ms tick that fires late means the loop was blocked (every other request would wait too)
+        nonlocal max_stall
+        while time.perf_counter() < deadline:
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            max_stall = max(max_stall, time.perf_counter() - before - 0.01)
+
+    async def login():
+        nonlocal shed
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if inline:
+                    pwd_context.verify(BENCH_PASSWORD, password_hash)
+                else:
+                    await PasswordHasher.verify(BENCH_PASSWORD, password_hash)
+                latencies.append(time.perf_counter() - started)
+            except PasswordHasherBusy:
+                shed += 1
+                # A shed client backs off briefly instead of hammering the pool
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(watch_loop(), *(login() for _ in range(concurrency)))
+    print_row(concurrency, len(latencies), time.perf_counter() - started, latencies, shed, f"{max_stall * 1000:.0f}")
+
+def run_http(url: str, email: str, password: str, concurrency: int, duration: float):
+    import requests
+
+    deadline = time.perf_counter() + duration
+    latencies = []
+    shed = 0
+    errors = 0
+    lock = threading.Lock()
+
+    def login():
+        nonlocal shed, errors
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = session.post(f"{url}/auth/login", json={"email": email, "password": password})
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                elif response.status_code == 503:
+                    shed += 1
+                else:
+                    errors += 1
+            if response.status_code == 503:
+                time.sleep(0.05)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(login)
+    print_row(concurrency, len(latencies), time.perf_counter() - started, latencies, shed, "n/a")
+    if errors:
+        print(f"{'':>11} {errors} requests failed with other status codes")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark login throughput versus concurrency")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--inline", action="store_true", help="run bcrypt on the event loop (pre-pool behaviour)")
+    parser.add_argument("--url", help="benchmark POST /auth/login on a running server instead")
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    if args.url:
+        if not args.email or not args.password:
+            parser.error("--url needs --email and --password of a verified account")
+        print(f"HTTP login against {args.url}")
+        print_header()
+        for concurrency in args.concurrency:
+            run_http(args.url.rstrip("/"), args.email, args.password, concurrency, args.duration)
+        return
+
+    password_hash = pwd_context.hash(BENCH_PASSWORD)
+    mode = "inline on the event loop" if args.inline else f"pool: {PASSWORD_HASH_WORKERS} workers, queue {PASSWORD_HASH_MAX_QUEUE}"
+    print(f"bcrypt verify, {mode}, {os.cpu_count()} CPUs")
+    print_header()
+    for concurrency in args.concurrency:
+        asyncio.run(run_in_process(concurrency, args.duration, password_hash, args.inline))
+
+if __name__ == "__main__":
+    main()
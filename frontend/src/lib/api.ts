@@ -4,6 +4,8 @@ const BASE_URL = 'https://dmify-app.onrender.com';
 
 class ApiService {
   private api: AxiosInstance;
+  // One refresh at a time; concurrent 401s wait for the same rotated token
+  private refreshing: Promise<string | null> | null = null;
 
   constructor() {
     this.api = axios.create({
@@ -27,12 +29,22 @@ class ApiService {
 
     this.api.interceptors.response.use(
       (response) => response,
-      (error) => {
-        // Only redirect to login on 401 if it's not a login request
+      async (error) => {
+        // Only handle 401 if it's not an auth request
         // and the user currently has a token (meaning their session expired)
         if (error.response?.status === 401 && 
             !error.config?.url?.includes('/auth/login') && 
+            !error.config?.url?.includes('/auth/refresh') && 
             this.getToken()) {
+          // Try the refresh token once before sending the user back to login
+          if (!error.config._retried) {
+            const token = await this.refreshAccessToken();
+            if (token) {
+              error.config._retried = true;
+              error.config.headers.Authorization = `Bearer ${token}`;
+              return this.api.request(error.config);
+            }
+          }
           this.clearAuth();
           window.location.href = '/login';
         }
@@ -41,6 +53,28 @@ class ApiService {
     );
   }
 
+  private refreshAccessToken(): Promise<string | null> {
+    if (!this.refreshing) {
+      const refreshToken = this.getRefreshToken();
+      this.refreshing = (refreshToken
+        ? this.api.post('/auth/refresh', { refresh_token: refreshToken })
+            .then((response) => {
+              this.storeSession(response.data);
+              return response.data.access_token as string;
+            })
+            .catch(() => {
+              // Another tab sharing this storage may have rotated the token first; use its session
+              const current = this.getRefreshToken();
+              return current && current !== refreshToken ? this.getToken() : null;
+            })
+        : Promise.resolve(null)
+      ).finally(() => {
+        this.refreshing = null;
+      });
+    }
+    return this.refreshing;
+  }
+
   private getToken(): string | null {
     return localStorage.getItem('dmify_token');
   }
@@ -49,8 +83,19 @@ class ApiService {
     localStorage.setItem('dmify_token', token);
   }
 
+  private getRefreshToken(): string | null {
+    return localStorage.getItem('dmify_refresh_token');
+  }
+
+  private storeSession(data: any): void {
+    this.setToken(data.access_token);
+    localStorage.setItem('dmify_refresh_token', data.refresh_token);
+    localStorage.setItem('dmify_user', JSON.stringify(data.user));
+  }
+
   private clearAuth(): void {
     localStorage.removeItem('dmify_token');
+    localStorage.removeItem('dmify_refresh_token');
     localStorage.removeItem('dmify_user');
   }
 
@@ -72,8 +117,7 @@ class ApiService {
   async login(email: string, password: string) {
     const response = await this.api.post('/auth/login', { email, password });
     if (response.data.access_token) {
-      this.setToken(response.data.access_token);
-      localStorage.setItem('dmify_user', JSON.stringify(response.data.user));
+      this.storeSession(response.data);
     }
     return response.data;
   }
@@ -84,7 +128,7 @@ class ApiService {
   }
 
   async logout() {
-    await this.api.post('/auth/logout');
+    await this.api.post('/auth/logout', { refresh_token: this.getRefreshToken() });
     this.clearAuth();
   }
 